@@ -0,0 +1,9 @@
+"""ipkg benchmarks.
+
+These modules are not installed with ipkg. Run them from the source tree::
+
+    python -m benchmarks.solver --size 500 --depth 6 --fanout 4
+    python -m benchmarks.startup --repeat 50
+
+Use ``--help`` to list the options of each benchmark.
+"""
@@ -0,0 +1,152 @@
+"""Dependency solver benchmark.
+
+Generates synthetic formula and package repositories, then times
+``BaseRepository.find``, ``Solver.from_obj``, ``Solver.solve`` and
+``Environment.install`` against them.
+
+Usage::
+
+    python -m benchmarks.solver --size 500 --depth 6 --fanout 4 --versions 3
+
+Use ``--json`` to get machine readable results, for example to compare
+them between two revisions in CI.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+from timeit import default_timer
+
+from ipkg.dependencies import Solver, DependencyLoop
+from ipkg.environments import Environment
+from ipkg.repositories import PackageRepository, FormulaRepository
+
+from .synthetic import Graph, ROOT, make_formula_repository, \
+    make_package_repository, load_root
+
+
+def measure(func, repeat):
+    """Call ``func`` ``repeat`` times.
+
+    Returns the best and mean times, and the last result.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = func()
+        times.append(default_timer() - start)
+    return {'best': min(times), 'mean': sum(times) / len(times)}, result
+
+
+def run(graph, workdir, repeat=3, workers=8):
+    """Run the benchmarks against ``graph``, using ``workdir`` to store the
+       generated repositories and environments.
+    """
+    results = {}
+    formula_base = make_formula_repository(graph,
+                                           os.path.join(workdir, 'formulas'))
+    package_base = os.path.join(workdir, 'packages')
+    make_package_repository(graph, package_base)
+    names = sorted(graph.dependencies)
+
+    def load_formulas():
+        repository = FormulaRepository(formula_base)
+        repository.load()
+        return repository
+
+    results['formula_repository.load'], formulas = measure(load_formulas,
+                                                           repeat)
+    packages = PackageRepository(package_base)
+    packages.load()
+
+    for label, repository in (('package_repository', packages),
+                              ('formula_repository', formulas)):
+        results[label + '.find'], _ = measure(
+            lambda: [repository.find(name) for name in names], repeat)
+
+    root = load_root(formula_base)
+
+    for label, repository in (('package_repository', packages),
+                              ('formula_repository', formulas)):
+        results[label + '.from_obj'], solver = measure(
+            lambda: Solver.from_obj(root, repositories=[repository],
+                                    workers=workers), repeat)
+        try:
+            results[label + '.solve'], _ = measure(
+                lambda: solver.solve(root), repeat)
+        except DependencyLoop:
+            results[label + '.solve'] = 'DependencyLoop'
+        results[label + '.stats'] = dict(solver.stats)
+        results[label + '.timings'] = dict(solver.timings)
+
+    if graph.loops:
+        # Environment.install would never end
+        results['environment.install'] = 'skipped'
+    else:
+        environments = []
+
+        def install():
+            prefix = tempfile.mkdtemp(prefix='env-', dir=workdir)
+            environments.append(prefix)
+            environment = Environment(prefix)
+            environment.directories.create(False)
+            environment.install(ROOT, packages)
+            return environment
+
+        results['environment.install'], _ = measure(install, repeat)
+        for prefix in environments:
+            shutil.rmtree(prefix)
+
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100,
+                        help='Count of package names (Default: %(default)s)')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Dependency graph depth (Default: %(default)s)')
+    parser.add_argument('--fanout', type=int, default=3,
+                        help='Dependencies per package '
+                             '(Default: %(default)s)')
+    parser.add_argument('--versions', type=int, default=1,
+                        help='Versions per package (Default: %(default)s)')
+    parser.add_argument('--loops', type=int, default=0,
+                        help='Count of dependency loops '
+                             '(Default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (Default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark (Default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Concurrent repository lookups '
+                             '(Default: %(default)s)')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Write results as JSON.')
+    args = parser.parse_args(args)
+
+    graph = Graph(args.size, args.depth, args.fanout, args.versions,
+                  args.loops, args.seed)
+    workdir = tempfile.mkdtemp(prefix='ipkg-benchmark-')
+    try:
+        results = run(graph, workdir, args.repeat, args.workers)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        for name in sorted(results):
+            value = results[name]
+            if isinstance(value, dict) and 'best' in value:
+                value = 'best %.4fs, mean %.4fs' % (value['best'],
+                                                    value['mean'])
+            sys.stdout.write('%-36s %s\n' % (name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""ipkg command line startup benchmark.
+
+Times ``ipkg printenv`` and ``ipkg exec`` in a new environment, and
+reports how long they take compared to a bare Python interpreter start.
+
+Usage::
+
+    python -m benchmarks.startup --repeat 50
+"""
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+from os import devnull
+from os.path import join
+
+from ipkg.environments import Environment
+
+from .solver import measure
+
+
+IPKG = [sys.executable, '-m', 'ipkg.cli']
+
+
+def run(workdir, repeat=20):
+    """Run the benchmarks, using ``workdir`` to store an environment.
+    """
+    prefix = join(workdir, 'env')
+    Environment(prefix).directories.create()
+    commands = (
+        ('python', [sys.executable, '-c', 'pass']),
+        ('ipkg --help', IPKG + ['--help']),
+        ('ipkg printenv', IPKG + ['printenv', prefix]),
+        ('ipkg exec', IPKG + ['exec', prefix, 'true']),
+    )
+
+    results = {}
+    with open(devnull, 'w') as null:
+        for name, command in commands:
+            results[name], _ = measure(
+                lambda: subprocess.check_call(command, stdout=null), repeat)
+
+    baseline = results['python']['best']
+    for name, result in results.items():
+        result['overhead'] = result['best'] - baseline
+
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Runs per command (Default: %(default)s)')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Write results as JSON.')
+    args = parser.parse_args(args)
+
+    workdir = tempfile.mkdtemp(prefix='ipkg-benchmark-')
+    try:
+        results = run(workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        for name in sorted(results):
+            result = results[name]
+            sys.stdout.write('%-16s best %6.1fms, mean %6.1fms, '
+                             'overhead %6.1fms\n' % (
+                                 name, result['best'] * 1000,
+                                 result['mean'] * 1000,
+                                 result['overhead'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
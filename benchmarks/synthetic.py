@@ -0,0 +1,167 @@
+"""Synthetic formula and package repositories.
+
+The generated dependency graph has a single ``root`` package, depending on
+every package of the first level. Each package of a level depends on
+``fanout`` packages of the next level, so ``depth`` controls the length of
+the dependency chains and ``size`` the total count of package names.
+
+``loops`` adds dependencies from the last level back to the first one,
+to create dependency loops.
+"""
+import os
+import json
+import random
+import tarfile
+
+from ipkg.build import Formula
+from ipkg.compat import StringIO
+from ipkg.packages import META_FILE, make_filename
+from ipkg.repositories import LocalPackageRepository
+from ipkg.utils import mkdir
+
+
+ROOT = 'root'
+
+FORMULA_TEMPLATE = '''from ipkg.build import Formula, File
+
+
+class %(class_name)s(Formula):
+
+    name = %(name)r
+    version = %(version)r
+    platform = 'any'
+    sources = File('/dev/null')
+    dependencies = %(dependencies)r
+
+    def install(self):
+        pass
+'''
+
+
+class Graph(object):
+    """A synthetic dependency graph.
+
+    ``dependencies`` maps each package name to the list of names it
+    depends on. Every name has ``versions`` versions, from ``1.0`` up.
+    """
+    def __init__(self, size=100, depth=4, fanout=3, versions=1, loops=0,
+                 seed=0):
+        self.size = size
+        self.depth = depth
+        self.fanout = fanout
+        self.versions = ['%d.0' % (v + 1) for v in range(versions)]
+        self.loops = loops
+
+        rand = random.Random(seed)
+        per_level = max(1, size // depth)
+        self.levels = [['pkg-%d-%d' % (level, index)
+                        for index in range(per_level)]
+                       for level in range(depth)]
+
+        self.dependencies = {ROOT: list(self.levels[0])}
+        for level, names in enumerate(self.levels):
+            if level + 1 < depth:
+                next_names = self.levels[level + 1]
+                count = min(fanout, len(next_names))
+                for name in names:
+                    self.dependencies[name] = rand.sample(next_names, count)
+            else:
+                for name in names:
+                    self.dependencies[name] = []
+
+        for _ in range(loops):
+            name = rand.choice(self.levels[-1])
+            self.dependencies[name].append(rand.choice(self.levels[0]))
+
+    def __iter__(self):
+        """Yields ``(name, version, dependencies)`` tuples.
+        """
+        for name in sorted(self.dependencies):
+            versions = ['1.0'] if name == ROOT else self.versions
+            for version in versions:
+                yield name, version, self.requirements(name)
+
+    def requirements(self, name):
+        """Returns the requirement strings of a package.
+
+        When there are several versions, odd dependencies are restricted
+        to versions older than the most recent one.
+        """
+        result = []
+        for index, dependency in enumerate(self.dependencies[name]):
+            if index % 2 and len(self.versions) > 1:
+                result.append('%s<%s' % (dependency, self.versions[-1]))
+            else:
+                result.append(dependency)
+        return result
+
+
+def make_formula_repository(graph, base):
+    """Write a formula repository for ``graph`` in the ``base`` directory.
+    """
+    mkdir(base, False)
+    for name, version, dependencies in graph:
+        name_dir = os.path.join(base, name)
+        mkdir(name_dir, False)
+        filepath = os.path.join(name_dir, '%s-%s.py' % (name, version))
+        with open(filepath, 'w') as formula_file:
+            formula_file.write(FORMULA_TEMPLATE % {
+                'class_name': name.replace('-', '_'),
+                'name': name,
+                'version': version,
+                'dependencies': tuple(dependencies),
+            })
+    return base
+
+
+def make_package(name, version, dependencies, package_dir):
+    """Create a package file containing a single file.
+    """
+    content = '%s %s\n' % (name, version)
+    data_file = 'share/%s/%s' % (name, version)
+    meta = {
+        'name': name,
+        'version': version,
+        'revision': '1',
+        'platform': 'any',
+        'dependencies': dependencies,
+        'homepage': None,
+        'hostname': 'benchmark',
+        'timestamp': 0,
+        'files': [data_file],
+        'build_prefix': '/nonexistent',
+        'build_platform': 'any',
+        'envvars': None,
+    }
+    filepath = os.path.join(package_dir, make_filename(**meta))
+
+    pkg = tarfile.open(filepath, 'w:bz2')
+    for member_name, data in ((META_FILE, json.dumps(meta)),
+                              (data_file, content)):
+        tarinfo = tarfile.TarInfo(member_name)
+        tarinfo.size = len(data)
+        tarinfo.mode = 0644
+        pkg.addfile(tarinfo, StringIO(data))
+    pkg.close()
+
+    return filepath
+
+
+def make_package_repository(graph, base):
+    """Write a package repository for ``graph`` in the ``base`` directory.
+    """
+    mkdir(base, False)
+    for name, version, dependencies in graph:
+        package_dir = os.path.join(base, name)
+        mkdir(package_dir, False)
+        make_package(name, version, dependencies, package_dir)
+    repository = LocalPackageRepository(base)
+    repository.update_metadata()
+    return repository
+
+
+def load_root(formula_repository_base):
+    """Load the root formula of a generated formula repository.
+    """
+    return Formula.from_file(os.path.join(formula_repository_base, ROOT,
+                                          '%s-1.0.py' % ROOT))
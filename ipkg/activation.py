@@ -0,0 +1,152 @@
+"""Environment activation.
+
+An activation describes the changes an ipkg environment makes to the
+variables of the processes running inside it:
+
+* ``defaults``: values of variables which are not already defined,
+* ``variables``: values of variables, overriding existing ones,
+* ``paths``: list of ``(name, directories)``, directories to put first in
+  path list variables, in insertion order,
+* ``envvars``: values of the variables of packages, set last so that they
+  override all others.
+
+``HOME`` is always the one of the ipkg process.
+
+Environments store their activation in a file, updated when packages are
+installed or uninstalled, so that commands can be run in an environment
+without loading it. This module is used by ``ipkg exec``, so it must be
+fast to import.
+"""
+import os
+import json
+
+
+#: Name of the activation file, at the root of environments
+ACTIVATION_FILE = '.ipkg.activation'
+PATH_SEPARATOR = ':'
+
+
+def make(directories, envvars=()):
+    """Returns the activation of an environment.
+
+    ``directories`` is a ``EnvironmentDirectories`` object and ``envvars``
+    an iterable of package variables dictionaries.
+    Their values can be format strings, using directory names.
+    """
+    # Imported here to keep this module fast to import
+    from .platforms import Platform
+
+    if Platform.current().os_name == 'osx':
+        dyn_lib_var_name = 'DYLD_LIBRARY_PATH'
+    else:
+        dyn_lib_var_name = 'LD_LIBRARY_PATH'
+
+    shortname = os.path.split(os.path.realpath(directories['prefix']))[1]
+    variables = {
+        'IPKG_ENVIRONMENT': directories['prefix'],
+        'TMPDIR': directories['tmp'],
+        'PS1': '(%s)\\h:\\w\\$ ' % shortname,
+    }
+
+    package_variables = {}
+    for package_envvars in envvars:
+        for name, value in package_envvars.items():
+            try:
+                value = value % directories
+            except KeyError:
+                # invalid format string ?
+                pass
+            package_variables[name] = value
+
+    return {
+        'prefix': directories['prefix'],
+        'defaults': {
+            'MANPATH': '/usr/share/man',
+        },
+        'paths': [
+            ('PATH', [directories['bin'], directories['sbin']]),
+            ('C_INCLUDE_PATH', [directories['include']]),
+            (dyn_lib_var_name, [directories['lib']]),
+            ('MANPATH', [directories['man']]),
+            ('PKG_CONFIG_PATH', [directories['pkgconfig']]),
+        ],
+        'variables': variables,
+        'envvars': package_variables,
+    }
+
+
+def apply(activation, environ):
+    """Returns a copy of the ``environ`` variables dictionary, modified by
+       ``activation``.
+    """
+    result = dict(environ)
+
+    for name, value in activation['defaults'].items():
+        if name not in result:
+            result[name] = value
+
+    result['HOME'] = os.environ.get('HOME', '/')
+    result.update(activation['variables'])
+
+    for name, directories in activation['paths']:
+        value = result.get(name)
+        items = [] if value is None else value.split(PATH_SEPARATOR)
+        for directory in directories:
+            if directory in items:
+                items.remove(directory)
+            items.insert(0, directory)
+        result[name] = PATH_SEPARATOR.join(items)
+
+    result.update(activation['envvars'])
+    return result
+
+
+def write(prefix, activation):
+    """Write the ``activation`` file of the environment at ``prefix``.
+    """
+    with open(os.path.join(prefix, ACTIVATION_FILE), 'w') as fileobj:
+        json.dump(activation, fileobj, indent=4)
+
+
+def load(prefix):
+    """Load the activation of the environment at ``prefix``.
+
+    Returns ``None`` if the environment has no activation file, or if it
+    was written for an environment at another path or by a previous ipkg
+    version.
+    """
+    try:
+        with open(os.path.join(prefix, ACTIVATION_FILE)) as fileobj:
+            activation = json.load(fileobj)
+    except (IOError, ValueError):
+        return None
+
+    if 'envvars' in activation and \
+            os.path.realpath(activation['prefix']) == os.path.realpath(prefix):
+        return activation
+
+
+def execute(prefix, command):
+    """Replace the current process by ``command``, running in the
+       environment at ``prefix``.
+
+    ``command`` is a list, its first item is the executable, which is
+    searched in the environment ``PATH``.
+    """
+    activation = load(prefix)
+
+    if activation is None:
+        # Environment created by a previous ipkg version, or moved
+        from .environments import Environment
+        activation = Environment(prefix).write_activation()
+
+    environ = apply(activation, os.environ)
+    # Activation files values are unicode strings
+    environ = dict((name, value.encode('utf-8') if isinstance(value, unicode)
+                    else value) for name, value in environ.items())
+
+    try:
+        os.execvpe(command[0], command, environ)
+    except OSError as exception:
+        from .utils import ExecutionFailed
+        raise ExecutionFailed(command, exception.strerror)
@@ -0,0 +1,110 @@
+"""asyncio interface.
+
+Blocking ipkg operations are run in a thread pool executor, and return
+asyncio futures, so that an event loop can drive many downloads and
+installs at once. Concurrency is bounded by the executor size.
+
+Requires ``asyncio``, or its ``trollius`` backport on Python 2.
+Futures are returned instead of coroutines, so this module can be used
+with both, with ``await``, ``yield from`` or ``yield From()``.
+"""
+import os
+import threading
+from collections import defaultdict
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from .exceptions import IpkgException
+from .compat import basestring
+
+
+#: Maximum number of blocking operations run at once by the default
+#: executor
+DEFAULT_CONCURRENCY = 8
+
+EXECUTOR = None
+# Installs in an environment are serialized, by environment path
+ENVIRONMENT_LOCKS = defaultdict(threading.Lock)
+LOCK = threading.Lock()
+
+
+class AsyncUnavailable(IpkgException):
+
+    MESSAGE = 'asyncio is not available, install trollius on Python 2'
+
+
+def get_executor():
+    """Returns the default executor, created on first use.
+    """
+    global EXECUTOR
+    with LOCK:
+        if EXECUTOR is None:
+            from concurrent.futures import ThreadPoolExecutor
+            EXECUTOR = ThreadPoolExecutor(DEFAULT_CONCURRENCY)
+    return EXECUTOR
+
+
+def run(func, *args, **kw):
+    """Run ``func(*args)`` in an executor, and returns an asyncio future.
+
+    ``loop`` and ``executor`` keyword arguments default to the current
+    event loop and to the default executor.
+    """
+    if asyncio is None:
+        raise AsyncUnavailable()
+    loop = kw.pop('loop', None) or asyncio.get_event_loop()
+    executor = kw.pop('executor', None) or get_executor()
+    return loop.run_in_executor(executor, func, *args)
+
+
+def vopen(url, loop=None, executor=None, **kw):
+    """Open a file, like ``ipkg.files.vopen``.
+
+    The future result is the file, downloaded if it is remote.
+    """
+    from .files import vopen as sync_vopen
+
+    def open_file():
+        fileobj = sync_vopen(url, **kw)
+        # Remote files are downloaded when first accessed
+        fileobj.seek(0)
+        return fileobj
+
+    return run(open_file, loop=loop, executor=executor)
+
+
+def find(repository, requirement, loop=None, executor=None):
+    """Find the packages of ``repository`` matching ``requirement``.
+    """
+    return run(repository.find, requirement, loop=loop, executor=executor)
+
+
+def install(environment, package, repository=None,
+            loop=None, executor=None):
+    """Install ``package`` in ``environment``.
+
+    The package is looked up and downloaded first, while other
+    installs in the same environment may be running.
+    """
+    def fetch_and_install():
+        from .packages import PackageFile
+
+        fetched = package
+        if isinstance(fetched, basestring) and \
+                not os.path.isfile(fetched) and repository is not None:
+            fetched = repository[fetched]
+        if isinstance(fetched, PackageFile):
+            fetched._tarfile
+
+        with LOCK:
+            lock = ENVIRONMENT_LOCKS[os.path.realpath(environment.prefix)]
+        with lock:
+            environment.install(fetched, repository)
+
+    return run(fetch_and_install, loop=loop, executor=executor)
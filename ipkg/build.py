@@ -8,19 +8,54 @@ import time
 import tarfile
 import json
 import imp
+import ast
+import marshal
+import struct
+import py_compile
 from socket import gethostname
+from functools import partial
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from os import scandir
+except ImportError:  # Python 2
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from .environments import Environment
+from .pool import EnvironmentPool, PoolException
+from .compiler_cache import CompilerCache
+from . import workspaces
+from .jobserver import get_jobserver, merge_makeflags
 from .exceptions import IpkgException
 from .packages import META_FILE, make_filename
-from .files import vopen
+from .files import vopen, cache
 from .mixins import NameVersionRevisionComparable
-from .utils import unarchive, mkdir
+from .utils import unarchive, mkdir, parallel_map
 from .compat import basestring, StringIO
 from .platforms import Platform
+from .requirements import Requirement
 
 
 LOGGER = logging.getLogger(__name__)
+#: Directory of the built packages, in the cache directory
+BUILD_CACHE_DIR = 'builds'
+#: Directory of the formulas bytecode and indexes, in the cache directory
+FORMULA_CACHE_DIR = 'formulas'
+#: Number of files downloaded at once by ``fetch_sources()``
+FETCH_WORKERS = 8
+#: Suffix of the file storing build information next to a package
+BUILD_INFO_SUFFIX = '.build.json'
+#: Formula attributes read without importing formula files
+INDEXED_ATTRIBUTES = ('name', 'version', 'revision', 'platform',
+                      'dependencies')
 
 
 class BuildError(IpkgException):
@@ -37,14 +72,83 @@ class IncompleteFormula(BuildError):
         return 'The "%s" attribute is mandatory' % self.attr
 
 
-def find_files(base):
+def get_children_usage():
+    """Returns the resource usage of terminated child processes, or
+       ``None`` if it is not available.
+    """
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def get_command_phase(command):
+    """Returns the build phase of a ``command``: its executable name, or
+       ``make install``.
+    """
+    args = command.split() if isinstance(command, basestring) else command
+    name = os.path.basename(args[0])
+    if name in ('make', 'gmake') and 'install' in args[1:]:
+        return 'make install'
+    return name
+
+
+def get_source_date_epoch():
+    """Returns the modification time of files in reproducible packages.
+
+    It is read from ``SOURCE_DATE_EPOCH``, as defined by
+    https://reproducible-builds.org, and defaults to 0.
+    """
+    try:
+        return int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+    except ValueError:
+        raise BuildError('Invalid SOURCE_DATE_EPOCH: %s' %
+                         os.environ['SOURCE_DATE_EPOCH'])
+
+
+def normalize_tarinfo(mtime, tarinfo):
+    """Remove the properties of ``tarinfo`` which depend on the build
+       host, or on the time of the build.
+    """
+    tarinfo.mtime = mtime
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    if tarinfo.isdir() or tarinfo.mode & 0111:
+        tarinfo.mode = 0755
+    else:
+        tarinfo.mode = 0644
+    return tarinfo
+
+
+def find_files(base, directory_links=False):
     """Create a list of files in prefix ``base``.
+
+    Symlinks to directories are not followed. They are only listed if
+    ``directory_links`` is true, as staged installs package them as is.
+
+    Uses ``scandir`` when available, to avoid a ``stat`` call per file.
     """
     result = []
-    for parent, _, files in os.walk(base):
-        rel_dir = parent.split(base)[1][1:]
-        for filename in files:
-            result.append(os.path.join(rel_dir, filename))
+
+    if scandir is None:
+        for parent, directories, files in os.walk(base):
+            rel_dir = parent.split(base)[1][1:]
+            if directory_links:
+                files.extend(name for name in directories
+                             if os.path.islink(os.path.join(parent, name)))
+            for filename in files:
+                result.append(os.path.join(rel_dir, filename))
+
+    else:
+        directories = ['']
+        while directories:
+            rel_dir = directories.pop()
+            for entry in scandir(os.path.join(base, rel_dir)):
+                path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(path)
+                elif directory_links or not entry.is_symlink() or \
+                        not entry.is_dir():
+                    result.append(path)
+
     return result
 
 
@@ -63,6 +167,26 @@ class Formula(NameVersionRevisionComparable):
     # Arguments passed to ``./configure``
     configure_args = ['--prefix=%(prefix)s']
     platform = None
+    # Path of the file which defines the formula, set by ``from_file()``
+    formula_file = None
+    # If true, ``install()`` must install files in ``stage_prefix``
+    # instead of the environment prefix. The default ``install()`` passes
+    # ``DESTDIR`` to ``make install``.
+    staged_install = False
+    # If true, ``make`` runs parallel jobs, shared with other builds
+    # through a jobserver (see ``ipkg.jobserver``). ``ipkg build
+    # --parallel-make`` also enables it.
+    parallel_make = False
+    # If true, identical builds create identical package files: the build
+    # directory only depends on the build key, package members are sorted
+    # and normalized, and the build host, time and stats are stored in a
+    # separate file (see ``BUILD_INFO_SUFFIX``). ``ipkg build
+    # --reproducible`` also enables it.
+    reproducible = False
+    # If true, C and C++ compilers run through ``ccache`` or ``sccache``
+    # when available (see ``ipkg.compiler_cache``). ``ipkg build
+    # --compiler-cache`` also enables it.
+    compiler_cache = False
 
     def __init__(self, environment=None, verbose=False, log=None):
 
@@ -75,7 +199,18 @@ class Formula(NameVersionRevisionComparable):
         self.verbose = verbose
         self.log = log or logging.getLogger(__name__)
         self.src_root = None
+        self.destdir = None
+        # Phases durations and commands resource usage of the last build
+        self.build_stats = None
         self.__cwd = os.getcwd()
+        self.__compiler_variables = {}
+        self.__build_key = None
+
+    @property
+    def stage_prefix(self):
+        """Where a staged install must put the environment prefix files.
+        """
+        return self.destdir + self.environment.prefix
 
     def run_command(self, command, data=None, cwd=None):
         """Run a ``command``.
@@ -94,8 +229,62 @@ class Formula(NameVersionRevisionComparable):
         else:
             stdout = stderr = open(os.devnull, 'w')
 
-        return self.environment.execute(command, stdout=stdout, stderr=stderr,
-                                        cwd=cwd or self.__cwd, data=data),
+        variables = {}
+        if self.parallel_make:
+            makeflags = self.environment.variables.get('MAKEFLAGS')
+            variables['MAKEFLAGS'] = merge_makeflags(
+                makeflags and str(makeflags), get_jobserver().makeflags)
+        if self.reproducible:
+            variables['SOURCE_DATE_EPOCH'] = str(get_source_date_epoch())
+        variables.update(self.__compiler_variables)
+
+        usage = get_children_usage()
+        start = time.time()
+        try:
+            return self.environment.execute(command, stdout=stdout,
+                                            stderr=stderr,
+                                            cwd=cwd or self.__cwd,
+                                            data=data, variables=variables),
+        finally:
+            if self.build_stats is not None:
+                self.__record_command(cmd, start, usage)
+
+    def __record_command(self, command, start, usage):
+        """Add the duration and resource usage of ``command`` to the
+           build stats.
+        """
+        stats = {'command': command, 'seconds': time.time() - start}
+        self.__add_phase_time(get_command_phase(command), stats['seconds'])
+
+        if usage is not None:
+            new_usage = get_children_usage()
+            stats['cpu_user'] = new_usage.ru_utime - usage.ru_utime
+            stats['cpu_system'] = new_usage.ru_stime - usage.ru_stime
+            # Only the maximum of all children is known: it is the one of
+            # this command if it increased
+            if new_usage.ru_maxrss > usage.ru_maxrss:
+                max_rss = new_usage.ru_maxrss
+                if sys.platform == 'darwin':
+                    # Bytes on OS X, kilobytes elsewhere
+                    max_rss //= 1024
+                stats['max_rss_kb'] = max_rss
+
+        self.build_stats['commands'].append(stats)
+
+    def __add_phase_time(self, phase, seconds):
+        phases = self.build_stats['phases']
+        phases[phase] = phases.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Add the duration of the ``with`` block to the build stats.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.build_stats is not None:
+                self.__add_phase_time(name, time.time() - start)
 
     def run_configure(self):
         """Run ``./configure``, using ``configure_args`` arguments.
@@ -137,81 +326,299 @@ class Formula(NameVersionRevisionComparable):
         else:
             raise AttributeError(attr)
 
+    def __get_dependency_checksum(self, dependency, repository):
+        """Returns the checksum of the package used to satisfy
+           ``dependency``, or the requirement if it is unknown.
+        """
+        package = None
+        if self.environment is not None:
+            package = self.environment.satisfies(dependency)
+        if package is None and repository is not None:
+            try:
+                package = repository[dependency]
+            except IpkgException:
+                pass
+        if package is not None and package.meta.get('checksum'):
+            return package.meta['checksum']
+        else:
+            return dependency
+
+    def get_build_key(self, repository=None):
+        """Returns a hash of everything the package depends on.
+
+        The formula file, sources and patches checksums, dependency
+        package checksums, build variables, configure arguments and
+        platform are hashed. Packages built with the same key are
+        identical, so they do not need to be built again.
+        """
+        if self.__build_key is None:
+            formula_hash = None
+            if self.formula_file is not None:
+                formula_hash = vopen(self.formula_file).update_hash(
+                    hashlib.sha256()).hexdigest()
+
+            items = {
+                'formula': formula_hash,
+                'name': self.name,
+                'version': self.version,
+                'revision': str(self.revision),
+                'platform': self.platform or str(Platform.current()),
+                'sources': self.sources.get_checksum(),
+                'patches': [patch.get_checksum() for patch in self.patches],
+                'dependencies': [
+                    self.__get_dependency_checksum(dependency, repository)
+                    for dependency in self.dependencies],
+                'build_envvars': self.build_envvars,
+                'configure_args': list(self.configure_args),
+            }
+            self.__build_key = hashlib.sha256(
+                json.dumps(items, sort_keys=True)).hexdigest()
+
+        return self.__build_key
+
+    def get_package_filename(self):
+        """Returns the file name of the package built by this formula.
+        """
+        return make_filename(name=self.name, version=self.version,
+                             revision=self.revision,
+                             platform=self.platform or Platform.current())
+
+    def __get_cached_build(self, build_key):
+        """Returns the directory of cached packages built with
+           ``build_key``, or ``None`` if the cache is not active.
+        """
+        if cache.is_active():
+            return os.path.join(cache.get_cache_dir(), BUILD_CACHE_DIR,
+                                build_key)
+
     def build(self, package_dir, remove_build_dir=True, repository=None):
-        """Build the formula."""
+        """Build the formula.
+
+        If the cache is active, packages are also stored in it, and a
+        package built with the same build key is reused.
+        """
         LOGGER.debug('%r.build(package_dir=%s, remove_build_dir=%s)',
                      self, package_dir, remove_build_dir)
 
+        build_key = self.get_build_key(repository)
+        cache_dir = self.__get_cached_build(build_key)
+        filename = self.get_package_filename()
+        if cache_dir is not None and \
+                os.path.isfile(os.path.join(cache_dir, filename)):
+            ipkg_file = os.path.join(package_dir, filename)
+            LOGGER.info('Reusing package built with the same sources, '
+                        'dependencies and formula: %s', filename)
+            shutil.copyfile(os.path.join(cache_dir, filename), ipkg_file)
+            return ipkg_file
+
+        self.build_stats = {'phases': {}, 'commands': []}
+        build_start = time.time()
+
+        with self.phase('fetch'):
+            sources = self.sources.open()
+            patches = [(patch, patch.open().read()) for patch in self.patches]
+
+        build_dir = self.__make_build_dir(build_key, sources)
+        try:
+            if self.parallel_make:
+                # Builds of other processes of the session share the jobs
+                with get_jobserver().build_token():
+                    ipkg_file = self.__build(build_dir, package_dir,
+                                             build_key, repository, sources,
+                                             patches)
+            else:
+                ipkg_file = self.__build(build_dir, package_dir, build_key,
+                                         repository, sources, patches)
+        except:
+            if remove_build_dir:
+                workspaces.remove(build_dir)
+            raise
+
+        if cache_dir is not None:
+            mkdir(os.path.dirname(cache_dir), False)
+            mkdir(cache_dir, False)
+            # Moved in place at once, as other processes may be building
+            # the same package
+            fd, tmp_file = tempfile.mkstemp(prefix='.', dir=cache_dir)
+            os.close(fd)
+            shutil.copy(ipkg_file, tmp_file)
+            os.rename(tmp_file,
+                      os.path.join(cache_dir, os.path.basename(ipkg_file)))
+
+        if remove_build_dir:
+            workspaces.remove(build_dir)
+
+        self.build_stats['seconds'] = time.time() - build_start
+        LOGGER.info('Build done in %.1f seconds',
+                    self.build_stats['seconds'])
+
+        if self.reproducible:
+            # Kept out of the package, which must not depend on them
+            with open(ipkg_file + BUILD_INFO_SUFFIX, 'w') as build_info:
+                json.dump({'hostname': gethostname().split('.')[0],
+                           'timestamp': build_start,
+                           'build_prefix': self.environment.prefix,
+                           'build_stats': self.build_stats},
+                          build_info, indent=4)
+
+        return ipkg_file
+
+    def __build(self, build_dir, package_dir, build_key, repository,
+                sources, patches):
+        """Build the formula in ``build_dir``, and returns the package
+           file.
+        """
         installed_dependencies = []
-        build_dir = tempfile.mkdtemp(prefix='ipkg-build-')
 
         # Create a temporary env if no env has been previously defined
-        if self.environment is None:
-            LOGGER.info('Creating temporary build environment')
-            prefix = os.path.join(build_dir, 'environment')
-            self.environment = Environment(prefix)
-            self.environment.directories.create()
-
-        if self.build_envvars:
-            self.environment.variables.add(self.build_envvars)
+        with self.phase('dependencies'):
+            if self.environment is None:
+                prefix = os.path.join(build_dir, 'environment')
+                if self.dependencies and cache.is_active():
+                    # Clone an environment which already contains
+                    # dependencies
+                    LOGGER.info('Cloning pooled build environment')
+                    try:
+                        self.environment = EnvironmentPool().clone(
+                            self.dependencies, prefix, repository,
+                            link=self.staged_install)
+                    except PoolException as exception:
+                        LOGGER.warning('Cannot clone pooled build '
+                                       'environment: %s', exception)
+                if self.environment is None:
+                    LOGGER.info('Creating temporary build environment')
+                    self.environment = Environment(prefix)
+                    self.environment.directories.create()
+
+            if self.build_envvars:
+                self.environment.variables.add(self.build_envvars)
+
+            compiler_cache = None
+            self.__compiler_variables = {}
+            if self.compiler_cache:
+                compiler_cache = CompilerCache.get(build_dir)
+            if compiler_cache is not None:
+                LOGGER.info('Compiling with %s', compiler_cache.name)
+                self.__compiler_variables = compiler_cache.get_variables(
+                    self.environment.variables.as_string_dict())
+                compiler_cache.start()
+
+            # Install dependencies in build environment
+            if self.dependencies:
+                LOGGER.info('Build dependencies: %s',
+                            ', '.join(self.dependencies))
+                for dependency in self.dependencies:
+                    if not self.environment.satisfies(dependency):
+                        self.environment.install(dependency, repository)
+                        installed_dependencies.append(dependency)
 
         env_prefix = self.environment.prefix
 
-        # Install dependencies in build environment
-        if self.dependencies:
-            LOGGER.info('Build dependencies: %s',
-                        ', '.join(self.dependencies))
-            for dependency in self.dependencies:
-                if dependency not in self.environment.packages:
-                    self.environment.install(dependency, repository)
-                    installed_dependencies.append(dependency)
-
         # Create the sources root directory
         self.src_root = src_root = os.path.join(build_dir, 'sources')
         mkdir(src_root, False)
 
         # Unarchive the sources file and store the sources directory as cwd
         # for use when running commands from now
-        self.__cwd = self.unarchive(self.sources)
+        with self.phase('unarchive'):
+            self.__cwd = self.unarchive(sources)
 
         # Apply patches
-        if self.patches:
-            strip = 0
-            for patch in self.patches:
-                LOGGER.info('Applying patch: %s', patch)
-                self.run_patch(['-p%d' % strip], data=patch.open().read())
-
-        # Create a list of the files contained in the environment before
-        # running "make install"
-        files_before_install = set(find_files(env_prefix))
-
-        # Compile and install the code
-        self.install()
-
-        # Compare the current environment file list with the previous one
-        package_files = set(find_files(env_prefix)) - files_before_install
-        # Use the list of new files to create a package
-        ipkg_file = self.__create_package(package_files,
-                                          env_prefix, package_dir)
-
-        # Cleanup
-        LOGGER.debug('Removing files installed in build environment')
-        for package_file in package_files:
-            package_file_path = os.path.join(env_prefix, package_file)
-            os.unlink(package_file_path)
-
-        if self.dependencies:
+        strip = 0
+        for patch, patch_data in patches:
+            LOGGER.info('Applying patch: %s', patch)
+            self.run_patch(['-p%d' % strip], data=patch_data)
+
+        if self.staged_install:
+            self.destdir = os.path.join(build_dir, 'stage')
+            mkdir(self.destdir, False)
+
+            # Compile and install the code in the staging directory
+            with self.phase('install'):
+                self.install()
+            self.__record_workspace_size(build_dir)
+
+            stage_prefix = self.stage_prefix
+            with self.phase('files'):
+                if os.path.isdir(stage_prefix):
+                    package_files = find_files(stage_prefix, True)
+                else:
+                    package_files = []
+            ipkg_file = self.__create_package(package_files, env_prefix,
+                                              package_dir, build_key,
+                                              stage_prefix)
+
+            LOGGER.debug('Removing staging directory')
+            shutil.rmtree(self.destdir)
+
+        else:
+            # Create a list of the files contained in the environment before
+            # running "make install"
+            with self.phase('files'):
+                files_before_install = set(find_files(env_prefix))
+
+            # Compile and install the code
+            with self.phase('install'):
+                self.install()
+            self.__record_workspace_size(build_dir)
+
+            # Compare the current environment file list with the previous one
+            with self.phase('files'):
+                package_files = set(find_files(env_prefix)) - \
+                    files_before_install
+            # Use the list of new files to create a package
+            ipkg_file = self.__create_package(package_files, env_prefix,
+                                              package_dir, build_key)
+
+            # Cleanup
+            LOGGER.debug('Removing files installed in build environment')
+            for package_file in package_files:
+                package_file_path = os.path.join(env_prefix, package_file)
+                os.unlink(package_file_path)
+
+        if compiler_cache is not None:
+            stats = self.build_stats['compiler_cache'] = \
+                compiler_cache.get_stats()
+            LOGGER.info('%s: %d hits, %d misses', compiler_cache.name,
+                        stats['hits'], stats['misses'])
+
+        if installed_dependencies:
             LOGGER.debug('Uninstalling dependencies from build environment')
-            for dependency in self.dependencies:
-                self.environment.uninstall(dependency)
+            for dependency in installed_dependencies:
+                self.environment.uninstall(Requirement(dependency).name)
 
-        if remove_build_dir:
-            LOGGER.debug('Removing build directory: %s', build_dir)
-            shutil.rmtree(build_dir)
+        return ipkg_file
 
-        LOGGER.info('Build done')
+    def __record_workspace_size(self, build_dir):
+        """Record the size of the build directory, to choose the
+           workspace of the next builds.
+        """
+        size = workspaces.get_size(build_dir)
+        self.build_stats['workspace']['size'] = size
+        workspaces.record_size(self.name, size)
 
-        return ipkg_file
+    def __make_build_dir(self, build_key, sources):
+        """Create the build directory, in memory or on disk depending on
+           the expected build size (see ``ipkg.workspaces``).
+
+        Reproducible builds use the same directory for a build key, as
+        the build prefix is stored in some built files.
+        """
+        sources.seek(0, os.SEEK_END)
+        size = workspaces.estimate_size(self.name, sources.tell())
+        sources.seek(0)
+
+        key = build_key[:16] if self.reproducible else None
+        backend, build_dir = workspaces.create(size, key)
+        if build_dir is None:
+            LOGGER.warning('%s%s already exists, the package will not be '
+                           'reproducible', workspaces.PREFIX, key)
+            backend, build_dir = workspaces.create(size)
+        LOGGER.debug('Building in %s (%s, %d bytes expected)',
+                     build_dir, backend, size)
+        self.build_stats['workspace'] = {'backend': backend,
+                                         'estimated_size': size}
+        return build_dir
 
     def install(self):
         """Run ``./configure``, ``make`` and ``make install``.
@@ -220,18 +627,29 @@ class Formula(NameVersionRevisionComparable):
         override this method in your formula.
         Do whatever needed to build your code.
         All new files found in the build environment prefix will be included
-        in the package.
+        in the package, or all files found in ``stage_prefix`` if
+        ``staged_install`` is true.
         """
         self.run_configure()
         self.run_make()
-        self.run_make(['install'])
+        if self.staged_install:
+            self.run_make(['install', 'DESTDIR=%s' % self.destdir])
+        else:
+            self.run_make(['install'])
 
-    def __create_package(self, files, build_dir, package_dir):
+    def __create_package(self, files, build_dir, package_dir, build_key=None,
+                         files_root=None):
         """Create a package.
+
+        ``files`` are relative to ``files_root``, which defaults to the
+        environment prefix.
         """
+        files_root = files_root or self.environment.prefix
         build_platform = str(Platform.current())
         platform = self.platform or build_platform
 
+        files = sorted(files)
+
         meta = {
             'name': self.name,
             'version': self.version,
@@ -239,18 +657,29 @@ class Formula(NameVersionRevisionComparable):
             'platform': platform,
             'dependencies': self.dependencies,
             'homepage': self.homepage,
-            'hostname': gethostname().split('.')[0],
-            'timestamp': time.time(),
             'files': tuple(files),
             'build_prefix': build_dir,
             'build_platform': build_platform,
             'envvars': self.envvars,
+            'build_key': build_key,
         }
 
+        if self.reproducible:
+            normalize = partial(normalize_tarinfo, get_source_date_epoch())
+        else:
+            normalize = None
+            # Stats of the packaging phase are not known yet: they are only
+            # kept in ``build_stats``
+            meta.update({
+                'hostname': gethostname().split('.')[0],
+                'timestamp': time.time(),
+                'build_stats': json.loads(json.dumps(self.build_stats)),
+            })
+
         filepath = os.path.join(package_dir, make_filename(**meta))
 
         meta_string = StringIO()
-        json.dump(meta, meta_string, indent=4)
+        json.dump(meta, meta_string, indent=4, sort_keys=True)
         meta_string_size = meta_string.tell()
         meta_string.seek(0)
 
@@ -258,22 +687,27 @@ class Formula(NameVersionRevisionComparable):
         meta_tarinfo.type = tarfile.REGTYPE
         meta_tarinfo.mode = 0644
         meta_tarinfo.size = meta_string_size
+        if normalize is not None:
+            normalize(meta_tarinfo)
 
-        pkg = tarfile.open(filepath, 'w:bz2')
-        pkg.addfile(meta_tarinfo, meta_string)
-        for pkg_file in files:
-            pkg.add(os.path.join(self.environment.prefix, pkg_file),
-                    pkg_file, recursive=False)
-        pkg.close()
+        with self.phase('package'):
+            pkg = tarfile.open(filepath, 'w:bz2')
+            pkg.addfile(meta_tarinfo, meta_string)
+            for pkg_file in files:
+                pkg.add(os.path.join(files_root, pkg_file),
+                        pkg_file, recursive=False, filter=normalize)
+            pkg.close()
 
         LOGGER.info('Package %s created', filepath)
 
         return filepath
 
     def unarchive(self, src_file):
-        """Unarchive ``src_file``.
+        """Unarchive ``src_file``, a ``File`` or a file-like object.
         """
-        return unarchive(src_file.open(), self.src_root)
+        if isinstance(src_file, File):
+            src_file = src_file.open()
+        return unarchive(src_file, self.src_root)
 
     @classmethod
     def from_file(cls, filepath):
@@ -289,7 +723,7 @@ class Formula(NameVersionRevisionComparable):
         module_name = filename.split('.py')[0].replace('.', '_')
 
         try:
-            module = imp.load_source(module_name, filepath)
+            module = load_module(module_name, filepath)
         except ImportError as err:
             raise IpkgException('Error when importing formula %s: %s' %
                                 (filepath, err))
@@ -316,6 +750,7 @@ class Formula(NameVersionRevisionComparable):
             raise IpkgException('No Formula class found')
 
         setattr(module, formula_class.__name__, formula_class)
+        formula_class.formula_file = filepath
 
         return formula_class
 
@@ -323,6 +758,166 @@ class Formula(NameVersionRevisionComparable):
         return '%s(%r)' % (self.__class__.__name__, self.environment)
 
 
+def load_module(module_name, filepath):
+    """Import the python file at ``filepath``.
+
+    If the cache is active, its bytecode is stored in the cache and reused
+    until the file is modified.
+    """
+    if not cache.is_active():
+        return imp.load_source(module_name, filepath)
+
+    cache_dir = os.path.join(cache.get_cache_dir(), FORMULA_CACHE_DIR)
+    mkdir(cache_dir, False)
+    bytecode_path = os.path.join(
+        cache_dir, hashlib.sha256(filepath).hexdigest() + '.pyc')
+    mtime = int(os.stat(filepath).st_mtime) & 0xFFFFFFFF
+
+    code = None
+    if os.path.isfile(bytecode_path):
+        with open(bytecode_path, 'rb') as bytecode_file:
+            header = bytecode_file.read(8)
+            if header == imp.get_magic() + struct.pack('<I', mtime):
+                code = marshal.load(bytecode_file)
+
+    if code is None:
+        # Compiled aside then moved in place at once, as other processes
+        # may be reading it
+        fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.pyc',
+                                        dir=cache_dir)
+        os.close(fd)
+        try:
+            py_compile.compile(filepath, tmp_path, doraise=True)
+            with open(tmp_path, 'rb') as bytecode_file:
+                bytecode_file.seek(8)
+                code = marshal.load(bytecode_file)
+            os.rename(tmp_path, bytecode_path)
+        except py_compile.PyCompileError as err:
+            os.unlink(tmp_path)
+            raise ImportError(err.msg)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    module = imp.new_module(module_name)
+    module.__file__ = filepath
+    sys.modules[module_name] = module
+    exec code in module.__dict__
+    return module
+
+
+def get_base_name(node):
+    """Returns the name of a class base in a python syntax tree.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        return node.attr
+
+
+def inspect_formula_file(filepath):
+    """Read the ``INDEXED_ATTRIBUTES`` of the formula defined in
+       ``filepath``, without importing it.
+
+    Returns ``None`` if they cannot be known without running the file: the
+    formula class does not directly inherit ``Formula``, or its attributes
+    are not literals.
+    """
+    with open(filepath) as formula_file:
+        try:
+            tree = ast.parse(formula_file.read(), filepath)
+        except SyntaxError:
+            return
+
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef)
+               and 'Formula' in map(get_base_name, node.bases)]
+    if len(classes) != 1:
+        return
+
+    meta = dict((attr, getattr(Formula, attr))
+                for attr in INDEXED_ATTRIBUTES)
+    for node in classes[0].body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and \
+                        target.id in INDEXED_ATTRIBUTES:
+                    try:
+                        meta[target.id] = ast.literal_eval(node.value)
+                    except ValueError:
+                        return
+
+    if meta['name'] is not None and meta['version'] is not None:
+        return meta
+
+
+class LazyFormula(NameVersionRevisionComparable):
+    """A formula whose file is only imported when needed.
+
+    ``name``, ``version``, ``revision``, ``platform`` and ``dependencies``
+    are read from ``meta``. Other attributes are read from the formula
+    class, and calling the object creates a formula instance.
+    """
+    def __init__(self, formula_file, meta):
+        self.formula_file = formula_file
+        self.__formula_class = None
+        for attr in INDEXED_ATTRIBUTES:
+            setattr(self, attr, meta[attr])
+
+    @classmethod
+    def from_file(cls, filepath):
+        """Returns a ``LazyFormula`` for ``filepath``, or the formula class
+           if its file must be imported to know its attributes.
+        """
+        meta = inspect_formula_file(filepath)
+        if meta is None:
+            return Formula.from_file(filepath)
+        else:
+            return cls(os.path.abspath(filepath), meta)
+
+    @property
+    def formula_class(self):
+        if self.__formula_class is None:
+            LOGGER.debug('Loading formula %s', self.formula_file)
+            self.__formula_class = Formula.from_file(self.formula_file)
+        return self.__formula_class
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.formula_class, attr)
+
+    def __call__(self, *args, **kw):
+        return self.formula_class(*args, **kw)
+
+    def __repr__(self):
+        return 'LazyFormula(%r)' % self.formula_file
+
+
+def fetch_sources(formulas, workers=FETCH_WORKERS):
+    """Download the sources and patches of ``formulas`` concurrently, to
+       the cache.
+
+    Files are verified against their checksum. Failures are logged, and
+    the files which could not be fetched are returned.
+    """
+    files = {}
+    for formula in formulas:
+        for resource in (formula.sources,) + tuple(formula.patches):
+            files[(resource.url, resource.expected_hash)] = resource
+
+    def fetch(resource):
+        try:
+            resource.fetch()
+        except IpkgException as exception:
+            LOGGER.error('Cannot fetch %s: %s', resource, exception)
+            return resource
+
+    LOGGER.info('Fetching %d source files', len(files))
+    return [resource for resource in parallel_map(fetch, files.values(),
+                                                  workers)
+            if resource is not None]
+
+
 class File(object):
     """A build resource.
 
@@ -379,6 +974,26 @@ class File(object):
         fileobj.verify_checksum()
         return fileobj
 
+    def fetch(self):
+        """Download the file to the cache, if it is remote and not cached
+           yet, and validate its checksum.
+        """
+        self.open().close()
+
+    def get_checksum(self):
+        """Returns the file checksum, as ``<hash name>:<hex digest>``.
+
+        It is computed from the file content if the file has no expected
+        checksum.
+        """
+        if self.expected_hash is None:
+            hash_obj = vopen(self.url).update_hash(hashlib.sha256())
+            checksum = hash_obj.hexdigest()
+        else:
+            hash_obj = self.hash_class()
+            checksum = self.expected_hash
+        return '%s:%s' % (hash_obj.name.lower(), checksum)
+
     def __repr__(self):
         return 'File("%s")' % self.url
 
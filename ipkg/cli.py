@@ -1,20 +1,83 @@
+"""ipkg command line tool.
+
+Commands are used as process wrappers, so starting ipkg must be fast:
+modules are only imported by the commands which need them.
+"""
 import os
 import sys
 import argparse
 import logging
 import types
-import pkg_resources
 
-from . import packages, repositories
-from .environments import current, Environment
 from .exceptions import IpkgException
-from .build import Formula
-from .files import vopen
 
 
 LOGGER = logging.getLogger(__name__)
 
 
+class Lazy(object):
+    """A ``module:attribute`` reference, imported when first called.
+
+    Used as command argument type, to avoid importing every ipkg module
+    when the command line is parsed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__name__ = path.split(':')[1]
+        self.__obj = None
+
+    def __call__(self, *args, **kw):
+        if self.__obj is None:
+            module_name, attr = self.path.split(':')
+            module = __import__(module_name, fromlist=[attr])
+            self.__obj = getattr(module, attr)
+        return self.__obj(*args, **kw)
+
+
+Environment = Lazy('ipkg.environments:Environment')
+PackageRepository = Lazy('ipkg.repositories:PackageRepository')
+LocalPackageRepository = Lazy('ipkg.repositories:LocalPackageRepository')
+FormulaRepository = Lazy('ipkg.repositories:FormulaRepository')
+vopen = Lazy('ipkg.files:vopen')
+
+
+def address(value):
+    """Parse a ``HOST:PORT`` argument.
+    """
+    host, _, port = value.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid address: %s' % value)
+
+
+class RepositoryAction(argparse.Action):
+    """Create a ``PackageRepository`` from the URLs of a repeated option,
+       which are its mirrors.
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        repository = getattr(namespace, self.dest)
+        urls = repository.mirrors.urls if repository is not None else []
+        setattr(namespace, self.dest, PackageRepository(urls + [values]))
+
+
+class VersionAction(argparse.Action):
+    """Show ipkg version.
+
+    ``pkg_resources`` is only imported when the version is asked.
+    """
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        super(VersionAction, self).__init__(option_strings=option_strings,
+                                            dest=dest, default=default,
+                                            nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        import pkg_resources
+        version = pkg_resources.require('ipkg')[0].version
+        parser.exit(message=version + '\n')
+
+
 class Ipkg(object):
     """ipkg CLI tool.
     """
@@ -23,8 +86,13 @@ class Ipkg(object):
         parser.add_argument('--debug', '-D',
                             action='store_true', default=False,
                             help='Show debug messages.')
-        parser.add_argument('--version', action='version',
-                            version=pkg_resources.require('ipkg')[0].version)
+        parser.add_argument('--version', action=VersionAction,
+                            help="show program's version number and exit")
+        parser.add_argument('--offline', action='store_true', default=False,
+                            help='Only read remote files from the cache.')
+        parser.add_argument('--metrics-file', metavar='PATH',
+                            help='Write download, extraction and other '
+                                 'metrics to a JSON file.')
         self.subparsers = parser.add_subparsers()
 
     def __call__(self):
@@ -33,6 +101,11 @@ class Ipkg(object):
         args = self.parser.parse_args().__dict__
         func = args.pop('func')
         debug = args.pop('debug')
+        metrics_file = args.pop('metrics_file')
+
+        if args.pop('offline'):
+            from .files.cache import OFFLINE_ENVVAR
+            os.environ[OFFLINE_ENVVAR] = '1'
 
         log_level = logging.DEBUG if debug else logging.INFO
         logger = logging.getLogger('ipkg')
@@ -49,6 +122,7 @@ class Ipkg(object):
         try:
             if func.func_name not in ('build', 'build_repository'):
                 if 'environment' in args and args['environment'] is None:
+                    from .environments import current
                     args['environment'] = current()
             func(**args)
         except IpkgException as exception:
@@ -57,6 +131,10 @@ class Ipkg(object):
             else:
                 LOGGER.error('Error: %s' % exception)
             raise SystemExit(-1)
+        finally:
+            if metrics_file:
+                from . import metrics
+                metrics.dump(metrics_file)
 
     def command(self, arg_or_func=None, *args):
         """Register an ipkg command.
@@ -154,8 +232,9 @@ def list_packages(environment):
              metavar='ENV', type=Environment,
              help='The environment in which the package will be installed.'),
     Argument('--repository', '-r',
-             metavar='URL', type=repositories.PackageRepository,
-             help='Use a repository to find the package'),
+             metavar='URL', action=RepositoryAction,
+             help='Use a repository to find the package. '
+                  'Repeat to add mirrors.'),
     Argument('package', metavar='PKG'),
 )
 def install(environment, package, repository):
@@ -178,8 +257,9 @@ def uninstall(environment, package):
 
 @ipkg.command(
     Argument('--repository', '-r',
-             metavar='URL', type=repositories.PackageRepository,
-             help='Package repository to use when installing requirements.'),
+             metavar='URL', action=RepositoryAction,
+             help='Package repository to use when installing requirements. '
+                  'Repeat to add mirrors.'),
     Argument('--requirements', '-R',
              type=vopen,
              help='Requirements file.'),
@@ -191,12 +271,47 @@ def mkenv(environment, repository, requirements):
     """Create an environment.
     """
     environment.directories.create()
+    environment.write_activation()
 
     if requirements:
         for requirement in requirements.read().splitlines():
             environment.install(requirement, repository)
 
 
+@ipkg.command(
+    Argument('--repository', '-r',
+             metavar='URL', action=RepositoryAction, required=True,
+             help='Package repository. Repeat to add mirrors.'),
+    Argument('--requirements', '-R',
+             type=vopen,
+             help='Requirements file.'),
+    Argument('requirement', nargs='*', metavar='PKG',
+             help='Package requirement.'),
+)
+def fetch(repository, requirements, requirement):
+    """Download packages and their dependencies to the cache.
+    """
+    if requirements:
+        requirement.extend(line for line in requirements.read().splitlines()
+                           if line.strip())
+    packages = repository.fetch(requirement)
+    LOGGER.info('%d packages fetched', len(packages))
+
+
+@ipkg.command(
+    'fetch-sources',
+    Argument('formula_repository',
+             metavar='PATH', type=FormulaRepository,
+             help='Path of the formulas.'),
+)
+def fetch_sources(formula_repository):
+    """Download the sources of all formulas to the cache.
+    """
+    failed = formula_repository.fetch_sources()
+    if failed:
+        raise IpkgException('Cannot fetch %d source files' % len(failed))
+
+
 @ipkg.command(
     Argument('--export', '-x', action='store_true', default=False,
              help='Prefix variables with the export keyword.'),
@@ -213,7 +328,7 @@ def printenv(environment, export):
 @ipkg.command(
     'exec',
     Argument('environment',
-             metavar='ENV', type=Environment,
+             metavar='ENV',
              help='Path of the environment.'),
     Argument('command', metavar='COMMAND', help='Path of the executable.'),
     Argument('arguments', metavar='ARG', nargs='*', help='Command arguments.'),
@@ -221,9 +336,10 @@ def printenv(environment, export):
 def execute(environment, command, arguments):
     """Run a command in an environment.
     """
+    from .activation import execute
     command = [command]
     command.extend(arguments)
-    environment.execute(command)
+    execute(environment, command)
 
 
 @ipkg.command(
@@ -231,12 +347,13 @@ def execute(environment, command, arguments):
              default='/bin/bash',
              help='Shell executable (Default: "%(default)s")'),
     Argument('environment',
-             metavar='ENV', type=Environment,
+             metavar='ENV',
              help='Path of the environment.'),
 )
 def shell(environment, shell):
     """Launch an interactive shell."""
-    environment.execute(shell)
+    from .activation import execute
+    execute(environment, [shell])
 
 
 @ipkg.command(
@@ -245,8 +362,9 @@ def shell(environment, shell):
              help='The environment in which the '
                   'package will be built.'),
     Argument('--repository', '-r',
-             metavar='URL', type=repositories.PackageRepository,
-             help='Use a repository to find the dependencies.'),
+             metavar='URL', action=RepositoryAction,
+             help='Use a repository to find the dependencies. '
+                  'Repeat to add mirrors.'),
     Argument('--package-dir', '-p',
              metavar='DIR', default=os.getcwd(),
              help='Where to store the package. Default: current directory.'),
@@ -260,31 +378,106 @@ def shell(environment, shell):
     Argument('--verbose', '-v',
              action='store_true', default=False,
              help='Show commands output.'),
+    Argument('--profile',
+             action='store_true', default=False,
+             help='Show the time spent in each build phase.'),
+    Argument('--reproducible',
+             action='store_true', default=False,
+             help='Create the same package file as other builds of the '
+                  'same sources, dependencies and formula.'),
+    Argument('--parallel-make', '-j',
+             action='store_true', default=False,
+             help='Run parallel make jobs, as many as processors '
+                  '(see IPKG_JOBS).'),
+    Argument('--compiler-cache',
+             action='store_true', default=False,
+             help='Compile through ccache or sccache, when installed and '
+                  'the cache is active.'),
     Argument('build_file',
              help='A python module which contains a Formula class.'),
 )
 def build(build_file, environment, verbose, repository, package_dir,
-          remove_build_dir, update_repository):
+          remove_build_dir, update_repository, profile, reproducible,
+          parallel_make, compiler_cache):
     """Build a package.
     """
+    from .build import Formula
     formula = Formula.from_file(build_file)(environment, verbose)
+    if reproducible:
+        formula.reproducible = True
+    if parallel_make:
+        formula.parallel_make = True
+    if compiler_cache:
+        formula.compiler_cache = True
 
     if update_repository:
-        repository = repositories.LocalPackageRepository(repository.base)
+        repository = LocalPackageRepository(repository.base)
         repository.build_formula(formula, remove_build_dir)
     else:
         formula.build(package_dir, remove_build_dir, repository)
 
+    if profile:
+        print_build_stats(formula.build_stats)
+
+
+def print_build_stats(build_stats, commands=10):
+    """Show the phases of a build, and its slowest ``commands``.
+    """
+    if not build_stats or 'seconds' not in build_stats:
+        print 'No build stats: the package was not built'
+        return
+
+    print 'Build time: %.2fs' % build_stats['seconds']
+    compiler_cache = build_stats.get('compiler_cache')
+    if compiler_cache:
+        print 'Compiler cache: %(tool)s, %(hits)d hits, %(misses)d misses' % \
+            compiler_cache
+    print
+    print '%-20s %10s' % ('Phase', 'Seconds')
+    for phase, seconds in sorted(build_stats['phases'].items(),
+                                 key=lambda item: item[1], reverse=True):
+        print '%-20s %10.2f' % (phase, seconds)
+
+    print
+    print '%10s %10s %10s  %s' % ('Seconds', 'CPU', 'Max RSS', 'Command')
+    slowest = sorted(build_stats['commands'], key=lambda c: c['seconds'],
+                     reverse=True)
+    for stats in slowest[:commands]:
+        cpu = stats.get('cpu_user', 0) + stats.get('cpu_system', 0)
+        max_rss = stats.get('max_rss_kb')
+        print '%10.2f %10.2f %10s  %s' % (
+            stats['seconds'], cpu,
+            '%dK' % max_rss if max_rss is not None else '-',
+            stats['command'])
+
 
 @ipkg.command(
     Argument('repository',
-             metavar='PATH', type=repositories.LocalPackageRepository,
+             metavar='PATH', type=LocalPackageRepository,
              help='Path of the repository.'),
 )
 def mkrepo(repository):
     repository.update_metadata()
 
 
+@ipkg.command(
+    Argument('--host',
+             default='127.0.0.1',
+             help='Address to listen on (Default: %(default)s).'),
+    Argument('--port', '-p',
+             type=int, default=8000,
+             help='Port to listen on (Default: %(default)s).'),
+    Argument('repository',
+             metavar='PATH',
+             help='Path of the repository.'),
+)
+def serve(host, port, repository):
+    """Serve a package repository over HTTP.
+    """
+    from .server import serve
+    serve(repository, host, port)
+
+
 @ipkg.command(
     'build-repository',
     Argument('--environment', '-e',
@@ -294,19 +487,26 @@ def mkrepo(repository):
     Argument('--verbose', '-v',
              action='store_true', default=False,
              help='Show commands output.'),
+    Argument('--listen', '-l',
+             metavar='HOST:PORT', type=address,
+             help='Let build workers connect to this address and build '
+                  'the formulas (see the build-worker command). HOST '
+                  'defaults to 127.0.0.1. Workers must have the token '
+                  'set in IPKG_BUILD_TOKEN, or logged if it is not set.'),
     Argument('package_repository',
-             type=repositories.LocalPackageRepository,
+             type=LocalPackageRepository,
              help='Path of the repository.'),
     Argument('formula_repository',
-             type=repositories.FormulaRepository,
+             type=FormulaRepository,
              help='Path of the formulas.'),
 )
-def build_repository(environment, verbose,
+def build_repository(environment, verbose, listen,
                      package_repository, formula_repository):
     """Build all formulas and store them in a repository.
     """
     new_packages = package_repository.build_formulas(formula_repository,
-                                                     environment, verbose)
+                                                     environment, verbose,
+                                                     listen)
     if new_packages:
         LOGGER.info('New packages:')
         for package_file in new_packages:
@@ -316,6 +516,37 @@ def build_repository(environment, verbose,
         LOGGER.info('Repository is up to date')
 
 
+@ipkg.command(
+    'build-worker',
+    Argument('--formulas', '-f',
+             metavar='PATH', dest='formula_root',
+             help='Path of the formulas, if it differs from the '
+                  'coordinator one.'),
+    Argument('--verbose', '-v',
+             action='store_true', default=False,
+             help='Show commands output.'),
+    Argument('--exit-when-done',
+             action='store_true', default=False,
+             help='Exit when the coordinator has no more formulas.'),
+    Argument('--poll-interval',
+             type=float, default=1,
+             help='Seconds to wait when no formula is ready '
+                  '(Default: %(default)s).'),
+    Argument('url',
+             help='URL of the build-repository --listen coordinator. '
+                  'Its token is read from IPKG_BUILD_TOKEN.'),
+)
+def build_worker(formula_root, verbose, exit_when_done, poll_interval, url):
+    """Build formulas of a distributed build-repository.
+    """
+    from .distributed import BuildWorker
+    worker = BuildWorker(url, formula_root, verbose, poll_interval)
+    try:
+        worker.run(exit_when_done)
+    except KeyboardInterrupt:
+        pass
+
+
 @ipkg.command(
     'config:get',
     Argument('--environment', '-e',
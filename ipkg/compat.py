@@ -13,3 +13,9 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from io import StringIO
+
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
@@ -0,0 +1,156 @@
+"""Compiler caches.
+
+When the ipkg cache is active, formulas with ``compiler_cache`` compile
+through ``ccache`` or ``sccache`` if one of them is installed, with a
+cache shared by all builds in the ipkg cache directory. Rebuilding a
+formula after a revision bump or a patch change then only compiles the
+files which changed.
+
+The ``IPKG_COMPILER_CACHE`` environment variable selects the tool:
+``ccache``, ``sccache``, or ``none`` to disable compiler caches.
+"""
+import os
+import json
+import logging
+from subprocess import Popen, PIPE
+
+from .exceptions import IpkgException
+from .files import cache
+from .utils import which
+
+
+LOGGER = logging.getLogger(__name__)
+#: Environment variable selecting the compiler cache
+ENVVAR = 'IPKG_COMPILER_CACHE'
+TOOLS = ('ccache', 'sccache')
+DISABLED = ('none', '0')
+#: Directory of the compiler caches, in the cache directory
+CACHE_DIR = 'compilers'
+#: ccache statistics of a build, in its build directory
+STATS_LOG = 'ccache-stats.log'
+
+
+class CompilerCacheException(IpkgException):
+    """Invalid compiler cache configuration."""
+
+
+def get_tool():
+    """Returns ``(name, path)`` of the compiler cache to use, or ``None``.
+    """
+    name = os.environ.get(ENVVAR)
+    if name in DISABLED or not cache.is_active():
+        return None
+    if name and name not in TOOLS:
+        raise CompilerCacheException('Invalid %s: %s' % (ENVVAR, name))
+
+    for tool in (name,) if name else TOOLS:
+        path = which(tool)
+        if path is not None:
+            return tool, path
+    if name:
+        LOGGER.warning('%s is not installed, builds will not use it', name)
+
+
+def parse_stats_log(path):
+    """Returns the ``(hits, misses)`` counts of a ccache statistics log.
+    """
+    hits = misses = 0
+    try:
+        with open(path) as stats_log:
+            for line in stats_log:
+                line = line.strip()
+                if line.endswith('_cache_hit'):
+                    hits += 1
+                elif line == 'cache_miss':
+                    misses += 1
+    except IOError:
+        pass
+    return hits, misses
+
+
+def get_sccache_stats(path):
+    """Returns the ``(hits, misses)`` counts of the sccache server.
+    """
+    process = Popen([path, '--show-stats', '--stats-format=json'],
+                    stdout=PIPE, stderr=PIPE)
+    stdout, _ = process.communicate()
+    try:
+        stats = json.loads(stdout)['stats']
+        return tuple(sum(stats[key]['counts'].values())
+                     for key in ('cache_hits', 'cache_misses'))
+    except (ValueError, KeyError, TypeError):
+        LOGGER.debug('Cannot read sccache statistics: %r', stdout)
+        return 0, 0
+
+
+class CompilerCache(object):
+    """The compiler cache ``name`` at ``path``, used by a build in
+       ``build_dir``.
+    """
+    def __init__(self, name, path, build_dir):
+        self.name = name
+        self.path = path
+        self.build_dir = build_dir
+        self.cache_dir = os.path.join(cache.get_cache_dir(), CACHE_DIR, name)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.__start_stats = None
+
+    @classmethod
+    def get(cls, build_dir):
+        """Returns the compiler cache of a build in ``build_dir``, or
+           ``None``.
+        """
+        tool = get_tool()
+        if tool is not None:
+            return cls(tool[0], tool[1], build_dir)
+
+    def get_variables(self, variables):
+        """Returns the environment variables making builds use the cache.
+
+        ``variables`` are the build variables: the compilers they define
+        are wrapped.
+        """
+        result = {}
+        for key, default in (('CC', 'cc'), ('CXX', 'c++')):
+            compiler = variables.get(key) or default
+            if not compiler.startswith(self.path) and \
+                    compiler.split()[0] not in TOOLS:
+                compiler = '%s %s' % (self.path, compiler)
+            result[key] = compiler
+
+        if self.name == 'ccache':
+            result.update({
+                'CCACHE_DIR': self.cache_dir,
+                # Paths in the build directory are hashed as relative paths,
+                # so that builds in other directories hit the cache. make
+                # runs in the real path of in memory build directories.
+                'CCACHE_BASEDIR': os.path.realpath(self.build_dir),
+                'CCACHE_NOHASHDIR': '1',
+                'CCACHE_STATSLOG': os.path.join(self.build_dir, STATS_LOG),
+            })
+        else:
+            result['SCCACHE_DIR'] = self.cache_dir
+        return result
+
+    def start(self):
+        """Called before the build starts compiling.
+        """
+        if self.name == 'sccache':
+            self.__start_stats = get_sccache_stats(self.path)
+
+    def get_stats(self):
+        """Returns the cache hits and misses of the build.
+
+        The sccache server is shared, so its counts include the
+        compilations of concurrent builds.
+        """
+        if self.name == 'ccache':
+            hits, misses = parse_stats_log(os.path.join(self.build_dir,
+                                                        STATS_LOG))
+        else:
+            hits, misses = get_sccache_stats(self.path)
+            if self.__start_stats is not None:
+                hits -= self.__start_stats[0]
+                misses -= self.__start_stats[1]
+        return {'tool': self.name, 'hits': hits, 'misses': misses}
@@ -1,15 +1,52 @@
 import logging
+import time
 from collections import defaultdict
+from functools import wraps
 
 from .requirements import Requirement
-from .exceptions import IpkgException
+from .exceptions import IpkgException, InvalidPackage
 from .platforms import Platform
 from .build import Formula
 from .packages import MetaPackage
+from .utils import parallel_map, make_package_key
 from . import versions
 
 
 LOGGER = logging.getLogger(__name__)
+#: Default maximum count of concurrent repository lookups
+REPOSITORY_WORKERS = 8
+
+
+def make_object_key(obj):
+    """Returns the key identifying ``obj`` in a :class:`Solver`: its type
+       and its package key, platform included.
+
+       A formula and a package sharing name, version and revision are
+       distinct solver objects, and so are two packages built for
+       different platforms.
+    """
+    return type(obj), make_package_key(obj)
+
+
+class ObjectIndex(dict):
+    """Dictionary of :class:`Node` by object, keyed by
+       :func:`make_object_key`.
+    """
+    def __contains__(self, obj):
+        try:
+            key = make_object_key(obj)
+        except InvalidPackage:
+            return False
+        return dict.__contains__(self, key)
+
+    def __getitem__(self, obj):
+        return dict.__getitem__(self, make_object_key(obj))
+
+    def __setitem__(self, obj, node):
+        dict.__setitem__(self, make_object_key(obj), node)
+
+    def get(self, obj, default=None):
+        return dict.get(self, make_object_key(obj), default)
 
 
 def select_most_recent_version(objects):
@@ -24,6 +61,21 @@ def select_most_recent_version(objects):
     return objects_by_version[most_recent_version]
 
 
+def timed(phase):
+    """Add the time spent in a :class:`Solver` method to its ``timings``.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kw):
+            start = time.time()
+            try:
+                return method(self, *args, **kw)
+            finally:
+                self.timings[phase] += time.time() - start
+        return wrapper
+    return decorator
+
+
 class SolverError(IpkgException):
     """An :py:class:`~Solver` error.
     """
@@ -86,9 +138,11 @@ class SolverRequirement(object):
     It merges requirements from multiple :class:`Node` objects.
     This object is used to find the best satisfying package.
     """
-    def __init__(self, name):
+    def __init__(self, name, stats=None):
         #: Package name
         self.name = name
+        #: Counters, shared with the :class:`Solver`
+        self.stats = defaultdict(int) if stats is None else stats
         #: Merged :class:`Requirement`
         self.merged = Requirement(name)
         #: Dictionary of requesting :class:`Node`: node :class:`Requirement`
@@ -112,6 +166,7 @@ class SolverRequirement(object):
         # requirement
         satisfiers = []
         for satisfier in self.satisfiers:
+            self.stats['satisfied_by'] += 1
             if self.merged.satisfied_by(satisfier.obj):
                 satisfiers.append(satisfier)
         self.satisfiers = set(satisfiers)
@@ -123,12 +178,14 @@ class SolverRequirement(object):
         """
         satisfied = 0
 
+        self.stats['satisfied_by'] += 1
         if self.merged.satisfied_by(node.obj):
             self.satisfiers.add(node)
             for requester, requester_req in self.requesters.items():
                 requester.requirements[requester_req].add(node)
                 node.dependents.append(requester)
                 satisfied += 1
+            self.stats['edges'] += satisfied
 
         return satisfied
 
@@ -141,8 +198,19 @@ class Solver(object):
         self.nodes = []
         #: Dictionary of :class:`SolverRequirement`
         self.requirements = {}
-        #: Dictionary using ``object`` as key and :class:`Node` as value
-        self.objects = {}
+        #: :class:`ObjectIndex` of :class:`Node` by ``object``
+        self.objects = ObjectIndex()
+        #: Counters: ``nodes``, ``edges``, ``satisfied_by`` and ``selector``
+        #: calls
+        self.stats = defaultdict(int)
+        #: Dictionary of phase name: time spent, in seconds
+        self.timings = defaultdict(float)
+
+    def __select(self, dependency_selector, nodes):
+        """Call ``dependency_selector``, keeping count of the calls.
+        """
+        self.stats['selector'] += 1
+        return dependency_selector(nodes)
 
     def add(self, obj, skip_dependencies=False):
         """Add a node to the solver.
@@ -168,7 +236,8 @@ class Solver(object):
         for new_node_req in new_node.requirements:
             req_name = new_node_req.name
             if req_name not in self.requirements:
-                self.requirements[req_name] = SolverRequirement(req_name)
+                self.requirements[req_name] = SolverRequirement(req_name,
+                                                                self.stats)
             self.requirements[req_name].merge(new_node_req, new_node)
 
         # Try to satisfy other node requirements with this node
@@ -177,6 +246,7 @@ class Solver(object):
 
         self.nodes.append(new_node)
         self.objects[obj] = new_node
+        self.stats['nodes'] += 1
 
         return new_node
 
@@ -188,7 +258,8 @@ class Solver(object):
                 if not sr.satisfiers]
 
     @classmethod
-    def from_obj(cls, obj, environment=None, repositories=None):
+    def from_obj(cls, obj, environment=None, repositories=None,
+                 workers=REPOSITORY_WORKERS):
         """Create a dependency solver from an ``obj``, which can be a
            ``Formula`` of a ``Package``.
 
@@ -201,63 +272,87 @@ class Solver(object):
         ``ipkg.repositories.FormulaRepository`` or
         ``ipkg.repositories.PackageRepository`` instances.
         They can be mixed.
-        """
 
+        Requirements are expanded breadth-first: all the repository
+        lookups needed by a level of the dependency graph are run
+        concurrently, using up to ``workers`` threads.
+        """
+        start = time.time()
+        repositories = list(repositories or [])
         solver = cls()
         node = solver.add(obj)
-        queue = set()
-
-        for requirement in node.requirements:
-            queue.add((node, requirement))
-
-        while queue:
-            requiring_node, requirement = queue.pop()
-            LOGGER.debug('Current: %r %r', requiring_node, requirement)
-
-            if requirement.name in solver.requirements:
-                LOGGER.debug('Requirement %s exists in solver: satisfiers=%r',
-                             requirement.name,
-                             solver.requirements[requirement.name].satisfiers)
-                if solver.requirements[requirement.name].satisfiers:
-                    LOGGER.debug('Satisfied requirement %s satisfied in solver',
-                                 requirement)
-                    requirement_node_set = solver.requirements[requirement.name].satisfiers.copy()
-                    requiring_node.requirements[requirement] = requirement_node_set
-                    for requirement_node in requirement_node_set:
-                        requirement_node.dependents.append(requiring_node)
-                    continue
-#                else:
-#                    LOGGER.debug('Requirement %s not satisfied by %r',
-#                                 requirement,
-#                                 solver.requirements[requirement.name])
-
-            if environment:
-                found = False
-                for package in environment.packages:
-                    if requirement.satisfied_by(package):
+        level = [(node, requirement) for requirement in node.requirements]
+
+        # Load all repositories meta data at once
+        parallel_map(lambda repository: repository.load(), repositories,
+                     workers)
+
+        while level:
+            lookups = []
+            seen = set()
+
+            for requiring_node, requirement in level:
+                LOGGER.debug('Current: %r %r', requiring_node, requirement)
+
+                if requirement.name in solver.requirements:
+                    solver_req = solver.requirements[requirement.name]
+                    LOGGER.debug('Requirement %s exists in solver: '
+                                 'satisfiers=%r', requirement.name,
+                                 solver_req.satisfiers)
+                    if solver_req.satisfiers:
+                        LOGGER.debug('Satisfied requirement %s satisfied '
+                                     'in solver', requirement)
+                        requirement_node_set = solver_req.satisfiers.copy()
+                        requiring_node.requirements[requirement] = \
+                            requirement_node_set
+                        for requirement_node in requirement_node_set:
+                            requirement_node.dependents.append(
+                                requiring_node)
+                        solver.stats['edges'] += len(requirement_node_set)
+                        continue
+
+                if environment:
+                    package = environment.satisfies(requirement)
+                    if package is not None:
                         LOGGER.debug('Satisfied by environment package %s',
                                      package)
-                        solver.add(package)
-                        found = True
-                        break
-                if found is True:
-                    continue
+                        if package not in solver.objects:
+                            solver.add(package)
+                        continue
+
+                for repository in repositories:
+                    lookup = repository, requirement
+                    if lookup not in seen:
+                        seen.add(lookup)
+                        lookups.append(lookup)
+
+            level = []
 
-            for repository in repositories or []:
-                satisfiers = repository.find(requirement)
+            if not lookups:
+                continue
+
+            results = parallel_map(
+                lambda lookup: lookup[0].find(lookup[1]), lookups, workers)
 
+            for (repository, requirement), satisfiers in zip(lookups,
+                                                             results):
                 for satisfier in satisfiers:
+                    if satisfier in solver.objects:
+                        # Already found by a previous requirement
+                        continue
                     LOGGER.debug('Satisfied by %s found in %s',
                                  satisfiers, repository)
                     new_node = solver.add(satisfier)
                     for satisfier_req in new_node.requirements:
-                        queue.add((new_node, satisfier_req))
+                        level.append((new_node, satisfier_req))
+
+        solver.timings['from_obj'] += time.time() - start
 
         return solver
 
     def __from_target(self, target):
         if isinstance(target, Node):
-            if target in self.nodes:
+            if self.objects.get(target.obj) is target:
                 return target
             else:
                 raise IpkgException('Unknown target: %r' % target)
@@ -267,6 +362,7 @@ class Solver(object):
             else:
                 raise IpkgException('Unknown target: %r' % target)
 
+    @timed('find_best_dependencies')
     def find_best_dependencies(self, target,
                                dependency_selector=select_most_recent_version):
         target = self.__from_target(target)
@@ -293,7 +389,8 @@ class Solver(object):
                 raise IpkgException('No satisfier found for requirement %s, '
                                     'asked by %s' % (cur_req, cr_owner))
 
-            satisfier = dependency_selector(solver_req.satisfiers)
+            satisfier = self.__select(dependency_selector,
+                                      solver_req.satisfiers)
 
             for satisfier_req in self.objects[satisfier].requirements:
                 req_queue.append((satisfier, satisfier_req))
@@ -302,6 +399,7 @@ class Solver(object):
 
         return dependencies.values()
 
+    @timed('solve')
     def solve(self, target=None, dependency_selector=select_most_recent_version,
               ignore_installed_packages=True):
         """Returns a list of nodes sorted by their mutual dependencies.
@@ -358,7 +456,8 @@ class Solver(object):
                 elif node_set_len == 1:
                     dependency = list(node_set)[0]
                 else:
-                    dependency = self.objects[dependency_selector(node_set)]
+                    dependency = self.objects[
+                        self.__select(dependency_selector, node_set)]
 
                 LOGGER.debug(' Best satisfier for requirement %s: %s (%i)',
                              requirement, dependency, id(dependency))
@@ -0,0 +1,545 @@
+"""Distributed builds.
+
+A coordinator serves the package repository over HTTP (see
+``ipkg.server``), and hands out the formulas to build to workers:
+
+* ``POST /_build/claim`` returns the next formula to build, as JSON. The
+  response is ``204 No Content`` if no formula can be built until others
+  are done, and ``410 Gone`` when all formulas are done.
+* ``PUT /_build/<job id>`` uploads the built package. The ``X-Filename``
+  and ``X-Checksum`` (sha256) headers are required.
+* ``POST /_build/<job id>/failed`` reports a build failure.
+* ``POST /_build/<job id>/heartbeat`` extends the lease of a job. Jobs
+  whose lease expires, e.g. because their worker was killed, are given to
+  other workers.
+
+The coordinator listens on localhost unless told otherwise. Build
+requests must have an ``X-Ipkg-Token`` header holding the coordinator
+token, read from the ``IPKG_BUILD_TOKEN`` environment variable, or
+generated and logged when it is not set. Other requests are answered like
+``ipkg serve`` does: the package repository is readable without token.
+
+Workers install build dependencies from the coordinator repository. They
+read formulas from the coordinator formula repository path, or from their
+own copy of it.
+"""
+import os
+import hmac
+import json
+import time
+import socket
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import itertools
+from urlparse import urlparse
+
+import requests
+
+from .exceptions import IpkgException
+from .packages import PackageFile, PackageIndex
+from .server import RepositoryServer, RepositoryRequestHandler
+from .utils import make_package_spec, mkdir
+
+
+LOGGER = logging.getLogger(__name__)
+BUILD_PATH = '/_build/'
+CLAIM_PATH = BUILD_PATH + 'claim'
+FAILED_SUFFIX = '/failed'
+HEARTBEAT_SUFFIX = '/heartbeat'
+#: Header holding the coordinator token in build requests
+TOKEN_HEADER = 'X-Ipkg-Token'
+#: Environment variable defining the coordinator token
+TOKEN_ENVVAR = 'IPKG_BUILD_TOKEN'
+CHUNK_SIZE = 1024 * 1024
+#: Seconds a worker waits before claiming again when no formula is ready
+POLL_INTERVAL = 1
+#: Seconds after which a job without heartbeat is given to another worker
+LEASE = 60
+#: How many times a formula is built before it is considered failed, when
+#: its workers stop
+MAX_ATTEMPTS = 3
+
+
+class DistributedBuildException(IpkgException):
+    """An error occurred while distributing builds."""
+
+
+def hash_file(path):
+    """Returns the sha256 of the file at ``path``.
+    """
+    hash_obj = hashlib.sha256()
+    with open(path, 'rb') as fileobj:
+        for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), ''):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest()
+
+
+def get_token():
+    """Returns the token defined by ``IPKG_BUILD_TOKEN``, or ``None``.
+    """
+    return os.environ.get(TOKEN_ENVVAR) or None
+
+
+class CoordinatorRequestHandler(RepositoryRequestHandler):
+
+    def __is_authorized(self):
+        """Returns true if the request has the coordinator token, or sends
+           a ``403 Forbidden`` response.
+        """
+        token = self.headers.get(TOKEN_HEADER) or ''
+        if hmac.compare_digest(token, self.server.coordinator.token):
+            return True
+        LOGGER.warning('Invalid token in request from %s',
+                       self.address_string())
+        # The body is not read, so the connection cannot be reused
+        self.close_connection = 1
+        self.__send_json(403)
+        return False
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        coordinator = self.server.coordinator
+        if not self.__is_authorized():
+            return
+
+        if path == CLAIM_PATH:
+            job = coordinator.claim(self.address_string())
+            if job is not None:
+                self.__send_json(200, job)
+            elif coordinator.done:
+                self.__send_json(410)
+            else:
+                self.__send_json(204)
+
+        elif path.startswith(BUILD_PATH) and path.endswith(FAILED_SUFFIX):
+            coordinator.fail(path[len(BUILD_PATH):-len(FAILED_SUFFIX)])
+            self.__send_json(204)
+
+        elif path.startswith(BUILD_PATH) and \
+                path.endswith(HEARTBEAT_SUFFIX):
+            job_id = path[len(BUILD_PATH):-len(HEARTBEAT_SUFFIX)]
+            self.__send_json(204 if coordinator.heartbeat(job_id) else 410)
+
+        else:
+            self.__send_json(404)
+
+    def do_PUT(self):
+        path = urlparse(self.path).path
+        if not self.__is_authorized():
+            return
+        filename = self.headers.get('X-Filename', '')
+        checksum = self.headers.get('X-Checksum')
+        try:
+            size = int(self.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return self.__send_json(411)
+
+        if not path.startswith(BUILD_PATH) or not checksum or \
+                not filename.endswith('.ipkg') or \
+                filename != os.path.basename(filename):
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = 1
+            return self.__send_json(400)
+
+        try:
+            self.server.coordinator.complete(path[len(BUILD_PATH):],
+                                             filename, checksum,
+                                             self.rfile, size)
+        except DistributedBuildException as exception:
+            LOGGER.error(str(exception))
+            self.close_connection = 1
+            self.__send_json(400, {'error': str(exception)})
+        else:
+            self.__send_json(204)
+
+    def __send_json(self, code, obj=None):
+        content = json.dumps(obj) if obj is not None else ''
+        self.send_response(code)
+        if content:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class CoordinatorServer(RepositoryServer):
+    """Serves the package repository of a ``BuildCoordinator``, and its
+       builds.
+    """
+    handler_class = CoordinatorRequestHandler
+
+    def __init__(self, coordinator, address):
+        self.coordinator = coordinator
+        RepositoryServer.__init__(self, coordinator.repository.base, address)
+
+
+class BuildCoordinator(object):
+    """Dispatches the builds of ``formulas`` to workers, and adds the
+       packages they build to the local ``repository``.
+
+    A formula is built once its dependencies are ``available`` (a
+    ``PackageIndex``) or built. ``is_up_to_date(formula)`` returns true if
+    a formula does not need to be built. Workers must send a heartbeat
+    every ``lease`` seconds, or their job is given to another worker.
+
+    Workers must send ``token``, which defaults to ``IPKG_BUILD_TOKEN``
+    or to a random token.
+    """
+    def __init__(self, repository, formula_repository, formulas,
+                 available=None, is_up_to_date=None,
+                 address=('127.0.0.1', 0), lease=LEASE, token=None):
+        self.token = token or get_token()
+        self.__generated_token = self.token is None
+        if self.__generated_token:
+            self.token = os.urandom(16).encode('hex')
+        self.repository = repository
+        self.formula_root = os.path.abspath(formula_repository.base)
+        self.formulas = list(formulas)
+        self.available = available or PackageIndex()
+        self.is_up_to_date = is_up_to_date or (lambda formula: False)
+        self.pending = PackageIndex(self.formulas)
+        self.running = {}  # job id: formula
+        self.lease = lease
+        self.__deadlines = {}  # job id: lease end time
+        self.__attempts = {}  # formula file: number of builds
+        self.built = PackageIndex()
+        self.built_packages = []
+        self.failed = []
+        self.__job_ids = itertools.count(1)
+        self.__lock = threading.Condition()
+        try:
+            self.server = CoordinatorServer(self, address)
+        except socket.error as exception:
+            raise DistributedBuildException('Cannot listen on %s:%d: %s' %
+                                            (address + (exception,)))
+
+    @property
+    def url(self):
+        return self.server.url
+
+    @property
+    def done(self):
+        return not self.formulas and not self.running
+
+    def __is_ready(self, formula):
+        """Returns ``True`` if ``formula`` can be built, ``False`` if it
+           must wait for other builds, or ``None`` if a dependency is
+           missing.
+        """
+        running = PackageIndex(self.running.values())
+        ready = True
+        for dependency in formula.dependencies:
+            if dependency in self.pending or dependency in running:
+                ready = False
+            elif dependency not in self.available and \
+                    dependency not in self.built:
+                LOGGER.error('Cannot build %s: Missing dependency: %s' %
+                             (formula, dependency))
+                return None
+        return ready
+
+    def claim(self, worker=None):
+        """Returns the next build job, or ``None`` if no formula can be
+           built now.
+        """
+        with self.__lock:
+            try:
+                self.__expire()
+                for formula in list(self.formulas):
+                    ready = self.__is_ready(formula)
+                    if ready is False:
+                        continue
+
+                    self.formulas.remove(formula)
+                    self.pending.discard(formula)
+
+                    if ready is None:
+                        self.failed.append(formula)
+                    elif self.is_up_to_date(formula):
+                        LOGGER.debug('%s is up to date',
+                                     make_package_spec(formula))
+                    else:
+                        return self.__start(formula, worker)
+
+                if self.formulas and not self.running:
+                    # They all wait for each other
+                    LOGGER.error('Cannot build %s: Dependency loop' %
+                                 ', '.join(map(str, self.formulas)))
+                    self.failed.extend(self.formulas)
+                    del self.formulas[:]
+            finally:
+                self.__lock.notify_all()
+
+    def __start(self, formula, worker):
+        job_id = str(next(self.__job_ids))
+        self.running[job_id] = formula
+        self.__deadlines[job_id] = time.time() + self.lease
+        self.__attempts[formula.formula_file] = \
+            self.__attempts.get(formula.formula_file, 0) + 1
+        LOGGER.info('Building %s on %s', make_package_spec(formula), worker)
+        return {
+            'id': job_id,
+            'lease': self.lease,
+            'name': formula.name,
+            'formula': os.path.relpath(formula.formula_file,
+                                       self.formula_root),
+            'formula_root': self.formula_root,
+            'formula_checksum': hash_file(formula.formula_file),
+        }
+
+    def __expire(self):
+        """Build again the formulas of the jobs whose lease expired.
+        """
+        now = time.time()
+        for job_id, deadline in self.__deadlines.items():
+            if deadline > now:
+                continue
+            formula = self.running.pop(job_id)
+            del self.__deadlines[job_id]
+            if self.__attempts[formula.formula_file] >= MAX_ATTEMPTS:
+                LOGGER.error('Failed to build %s: its workers stopped '
+                             'responding', make_package_spec(formula))
+                self.failed.append(formula)
+            else:
+                LOGGER.warning('Lease of %s expired, building it again',
+                               make_package_spec(formula))
+                self.formulas.insert(0, formula)
+                self.pending.add(formula)
+
+    def heartbeat(self, job_id):
+        """Extend the lease of ``job_id``. Returns ``False`` if the job is
+           not running anymore.
+        """
+        with self.__lock:
+            if job_id in self.__deadlines:
+                self.__deadlines[job_id] = time.time() + self.lease
+                return True
+            return False
+
+    def fail(self, job_id):
+        """A worker could not build the formula of ``job_id``.
+        """
+        with self.__lock:
+            formula = self.running.pop(job_id, None)
+            self.__deadlines.pop(job_id, None)
+            if formula is not None:
+                LOGGER.error('Failed to build %s',
+                             make_package_spec(formula))
+                self.failed.append(formula)
+            self.__lock.notify_all()
+
+    def complete(self, job_id, filename, checksum, fileobj, size):
+        """Store the package built by ``job_id``, reading ``size`` bytes
+           from ``fileobj``.
+
+        The package is only added to the repository if its sha256 is
+        ``checksum``.
+        """
+        with self.__lock:
+            formula = self.running.get(job_id)
+        if formula is None:
+            raise DistributedBuildException('Unknown build job: %s' % job_id)
+
+        package_dir = os.path.join(self.repository.base, formula.name)
+        mkdir(package_dir, False)
+        # Written next to its final path, so that it is renamed atomically
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=package_dir, prefix='.')
+        hash_obj = hashlib.sha256()
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                while size > 0:
+                    chunk = fileobj.read(min(size, CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    hash_obj.update(chunk)
+                    tmp_file.write(chunk)
+                    size -= len(chunk)
+            if size or hash_obj.hexdigest() != checksum:
+                raise DistributedBuildException(
+                    'Invalid checksum of %s built by job %s' %
+                    (filename, job_id))
+        except:
+            os.unlink(tmp_path)
+            self.fail(job_id)
+            raise
+
+        with self.__lock:
+            if self.running.pop(job_id, None) is None:
+                # Its lease expired while uploading
+                os.unlink(tmp_path)
+                raise DistributedBuildException('Build job %s expired' %
+                                                job_id)
+            del self.__deadlines[job_id]
+            path = os.path.join(package_dir, filename)
+            os.rename(tmp_path, path)
+            package = PackageFile(path)
+            self.repository.add(package)
+            self.repository.meta.save()
+            self.built.add(package)
+            self.built_packages.append(path)
+            self.__lock.notify_all()
+
+    def run(self):
+        """Serve the workers until all formulas are done, and returns the
+           new package files.
+        """
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        LOGGER.info('Waiting for build workers on %s', self.url)
+        if self.__generated_token:
+            LOGGER.info('Set %s=%s in the environment of the workers',
+                        TOKEN_ENVVAR, self.token)
+        try:
+            with self.__lock:
+                while not self.done:
+                    self.__lock.wait(POLL_INTERVAL)
+                    self.__expire()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+        return self.built_packages
+
+
+class BuildWorker(object):
+    """Builds the formulas of the coordinator at ``url``.
+
+    If ``formula_root`` is given, formulas are read from this directory
+    instead of the coordinator one. Their checksum must match. ``token``
+    is the coordinator token, and defaults to ``IPKG_BUILD_TOKEN``.
+    """
+    def __init__(self, url, formula_root=None, verbose=False,
+                 poll_interval=POLL_INTERVAL, token=None):
+        self.url = url.rstrip('/')
+        self.formula_root = formula_root
+        self.verbose = verbose
+        self.poll_interval = poll_interval
+        token = token or get_token()
+        if token is None:
+            raise DistributedBuildException('No coordinator token: set %s' %
+                                            TOKEN_ENVVAR)
+        self.headers = {TOKEN_HEADER: token}
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+    def claim(self):
+        """Returns the next job, ``None`` if no formula is ready, or
+           raises ``StopIteration`` when the coordinator is done.
+        """
+        response = self.session.post(self.url + CLAIM_PATH)
+        if response.status_code == 410:
+            raise StopIteration
+        elif response.status_code == 204:
+            return None
+        elif response.status_code == 403:
+            raise DistributedBuildException('Cannot claim a build: invalid '
+                                            'token, check %s' % TOKEN_ENVVAR)
+        elif response.status_code != 200:
+            raise DistributedBuildException('Cannot claim a build: HTTP %d' %
+                                            response.status_code)
+        return response.json()
+
+    def build(self, job):
+        """Build the formula of ``job``, and returns the package file.
+        """
+        from .build import Formula
+        from .repositories import PackageRepository
+
+        formula_root = self.formula_root or job['formula_root']
+        formula_file = os.path.join(formula_root, job['formula'])
+        if hash_file(formula_file) != job['formula_checksum']:
+            raise DistributedBuildException('Formula %s differs from the '
+                                            'coordinator one' % formula_file)
+
+        formula_cls = Formula.from_file(formula_file)
+        formula = formula_cls(verbose=self.verbose)
+        package_dir = tempfile.mkdtemp(prefix='ipkg-worker-')
+        try:
+            # Repository meta data are loaded for each build, to get the
+            # packages built by other workers
+            return formula.build(package_dir,
+                                 repository=PackageRepository(self.url))
+        except:
+            shutil.rmtree(package_dir)
+            raise
+
+    def upload(self, job, package_file):
+        checksum = hash_file(package_file)
+        with open(package_file, 'rb') as fileobj:
+            response = self.session.put(
+                self.url + BUILD_PATH + job['id'], data=fileobj,
+                headers={'X-Filename': os.path.basename(package_file),
+                         'X-Checksum': checksum})
+        if response.status_code != 204:
+            raise DistributedBuildException('Cannot upload %s: HTTP %d' %
+                                            (package_file,
+                                             response.status_code))
+
+    def heartbeat(self, job, stop):
+        """Extend the lease of ``job`` until ``stop`` is set.
+        """
+        url = self.url + BUILD_PATH + job['id'] + HEARTBEAT_SUFFIX
+        while not stop.wait(job['lease'] / 3.0):
+            try:
+                requests.post(url, headers=self.headers)
+            except requests.RequestException as exception:
+                LOGGER.debug('Heartbeat of job %s failed: %s', job['id'],
+                             exception)
+
+    def run_job(self, job):
+        LOGGER.info('Building %s', job['formula'])
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.heartbeat, args=(job, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            package_file = self.build(job)
+            try:
+                self.upload(job, package_file)
+            finally:
+                shutil.rmtree(os.path.dirname(package_file))
+        except Exception as exception:
+            LOGGER.exception('Failed to build %s: %s', job['formula'],
+                             exception)
+            try:
+                self.session.post(self.url + BUILD_PATH + job['id'] +
+                                  FAILED_SUFFIX)
+            except requests.RequestException:
+                # The job is given to another worker when its lease ends
+                pass
+        else:
+            LOGGER.info('%s built', os.path.basename(package_file))
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def run(self, exit_when_done=False):
+        """Build formulas until interrupted.
+
+        If ``exit_when_done`` is true, returns when the coordinator has no
+        more formulas to build, or when it stopped.
+        """
+        connected = False
+        while True:
+            try:
+                job = self.claim()
+            except StopIteration:
+                if exit_when_done:
+                    return
+                job = None
+            except requests.ConnectionError as exception:
+                if exit_when_done and connected:
+                    # The coordinator stopped once its builds were done
+                    return
+                LOGGER.debug('Cannot connect to %s: %s', self.url, exception)
+                job = None
+            else:
+                connected = True
+
+            if job is None:
+                time.sleep(self.poll_interval)
+            else:
+                self.run_job(job)
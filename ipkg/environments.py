@@ -10,7 +10,8 @@ from .prefix_rewriters import rewrite_prefix
 from .utils import DictFile, execute, make_package_spec, mkdir
 from .compat import basestring
 from .files.exceptions import FilesException
-from .platforms import Platform
+from .requirements import Requirement
+from . import activation
 
 
 LOGGER = logging.getLogger(__name__)
@@ -164,48 +165,17 @@ class EnvironmentVariables(dict):
         else:
             defaults = {}
 
-        if 'MANPATH' not in defaults:
-            defaults['MANPATH'] = '/usr/share/man'
-
-        var_models = {
-            PathListVariable: ['PATH', 'PKG_CONFIG_PATH',
-                               'MANPATH', 'C_INCLUDE_PATH'],
-            #ArgumentListVariable: ['LDFLAGS', 'CFLAGS', 'CXXFLAGS'],
-        }
-
-        if Platform.current().os_name == 'osx':
-            dyn_lib_var_name = 'DYLD_LIBRARY_PATH'
-        else:
-            dyn_lib_var_name = 'LD_LIBRARY_PATH'
-        var_models[PathListVariable].append(dyn_lib_var_name)
+        env_activation = activation.make(directories)
+        path_names = set(name for name, _ in env_activation['paths'])
+        values = activation.apply(env_activation, defaults)
 
         variables = {}
-        for baseclass, names in var_models.items():
-            for name in names:
-                default = defaults.get(name)
-                variables[name] = baseclass(name, default)
-
-        # Scan default variables for variables we don't have
-        for name, value in defaults.items():
-            if name not in variables:
+        for name, value in values.items():
+            if name in path_names:
+                variables[name] = PathListVariable(name, value)
+            else:
                 variables[name] = Variable(name, value)
 
-        variables['IPKG_ENVIRONMENT'] = Variable('IPKG_ENVIRONMENT',
-                                                 directories['prefix'])
-        variables['TMPDIR'] = Variable('TMPDIR', directories['tmp'])
-        variables['HOME'] = Variable('HOME', os.environ.get('HOME', '/'))
-        shortname = os.path.split(os.path.realpath(directories['prefix']))[1]
-        variables['PS1'] = Variable('PS1', '(%s)\h:\w\$ ' % shortname)
-        variables['PATH'].insert(directories['bin'])
-        variables['PATH'].insert(directories['sbin'])
-        variables['C_INCLUDE_PATH'].insert(directories['include'])
-        variables[dyn_lib_var_name].insert(directories['lib'])
-        variables['MANPATH'].insert(directories['man'])
-        variables['PKG_CONFIG_PATH'].insert(directories['pkgconfig'])
-        #variables['LDFLAGS'].insert('-L%s' % directories['lib'])
-        #variables['CFLAGS'].insert('-I%s' % directories['include'])
-        #variables['CXXFLAGS'].insert('-I%s' % directories['include'])
-
         self.update(variables)
 
     def as_string_dict(self):
@@ -265,16 +235,39 @@ class Environment(object):
         if 'config' not in self.meta:
             self.meta['config'] = {}
 
+        # Installed packages, by name. Built on first use.
+        self.__packages = None
+
     def __repr__(self):
         return 'Environment("%s")' % self.prefix
 
     def execute(self, command,
                 stdin=sys.stdin, stdout=sys.stdout, stderr=sys.stderr,
-                cwd=None, data=None):
+                cwd=None, data=None, variables=None):
         """Execute a command in the environment.
+
+        ``variables`` is a dictionary of additional environment variables.
+        """
+        env = self.variables.as_string_dict()
+        if variables:
+            env.update(variables)
+        return execute(command, stdin, stdout, stderr, cwd, data, env)
+
+    def write_activation(self):
+        """Write the environment activation file, used by ``ipkg exec``.
+
+        Returns the activation.
         """
-        return execute(command, stdin, stdout, stderr, cwd, data,
-                       self.variables.as_string_dict())
+        directories = EnvironmentDirectories(os.path.abspath(self.prefix))
+        envvars = [data['envvars'] for data in self.meta['packages'].values()
+                   if data.get('envvars') is not None]
+        env_activation = activation.make(directories, envvars)
+        try:
+            activation.write(self.prefix, env_activation)
+        except (IOError, OSError) as exception:
+            LOGGER.debug('Cannot write activation file of %s: %s',
+                         self.prefix, exception)
+        return env_activation
 
     def mktmpdir(self, prefix=None):
         """Create a temporary directory.
@@ -315,6 +308,8 @@ class Environment(object):
         # Remove package from environment meta data
         self.meta['packages'].pop(package)
         self.meta.save()
+        self.__packages = None
+        self.write_activation()
 
         LOGGER.info('Package %s uninstalled', package)
 
@@ -340,26 +335,25 @@ class Environment(object):
             raise IpkgException('Invalid package: %r' % package)
 
         # Check if the package is already installed
-        for installed_package in self.meta['packages'].values():
-            if installed_package['name'] == package.name:
-                # Package already installed
-                if installed_package['version'] == package.version and \
-                   installed_package['revision'] == package.revision:
-                    # Same version/revision, just warn
-                    LOGGER.warning('Package %(name)s %(version)s %(revision)s'
-                                   ' is already installed' % package.meta)
-                    return
-                else:
-                    # Different version/revision, uninstall it
-                    LOGGER.debug('Another version of %r is installed, '
-                                 'uninstalling it first' % package)
-                    self.uninstall(package)
-                break
+        installed_package = self.meta['packages'].get(package.name)
+        if installed_package is not None:
+            # Package already installed
+            if installed_package['version'] == package.version and \
+               installed_package['revision'] == package.revision:
+                # Same version/revision, just warn
+                LOGGER.warning('Package %(name)s %(version)s %(revision)s'
+                               ' is already installed' % package.meta)
+                return
+            else:
+                # Different version/revision, uninstall it
+                LOGGER.debug('Another version of %r is installed, '
+                             'uninstalling it first' % package)
+                self.uninstall(package.name)
 
         # Install dependencies
         if package.dependencies:
             for dependency in package.dependencies:
-                if dependency not in self.meta['packages']:
+                if not self.satisfies(dependency):
                     LOGGER.info('Installing dependency: %s', dependency)
                     self.install(dependency, repository)
 
@@ -381,16 +375,54 @@ class Environment(object):
         # Write package meta data in environment
         self.meta['packages'][package.name] = package.meta
         self.meta.save()
+        self.__packages = None
 
         # Load package custom environment variables
         if package.envvars is not None:
             self.variables.add(package.envvars)
 
+        self.write_activation()
+
         LOGGER.info('Package %s installed', make_package_spec(package))
 
+    def install_async(self, package, repository=None,
+                      loop=None, executor=None):
+        """Like ``install()``, but returns an asyncio future.
+
+        See ``ipkg.aio``.
+        """
+        from . import aio
+        return aio.install(self, package, repository, loop, executor)
+
+    def __get_packages(self):
+        """Returns a dictionary of installed packages, by name.
+        """
+        if self.__packages is None:
+            self.__packages = dict(
+                (name, MetaPackage(meta))
+                for name, meta in self.meta['packages'].items())
+        return self.__packages
+
     @property
     def packages(self):
-        return map(MetaPackage, self.meta['packages'].values())
+        return self.__get_packages().values()
+
+    def get_package(self, name):
+        """Returns the installed package named ``name``, or ``None``.
+        """
+        return self.__get_packages().get(name)
+
+    def satisfies(self, requirement):
+        """Returns the installed package which satisfies ``requirement``,
+           or ``None``.
+
+        ``requirement`` can be a ``Requirement`` or a string.
+        """
+        if isinstance(requirement, basestring):
+            requirement = Requirement(requirement)
+        package = self.get_package(requirement.name)
+        if package is not None and requirement.satisfied_by(package):
+            return package
 
     def get_config(self, key):
         return self.meta['config'].get(key)
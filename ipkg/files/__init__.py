@@ -3,12 +3,67 @@ try:
 except ImportError:  # Python 3
     from urllib.parse import urlparse
 
-from pkg_resources import iter_entry_points
 from .exceptions import UnknownScheme
 
 
 __all__ = ['vopen']
 DEFAULT_SCHEME = 'file'
+ENTRY_POINT_GROUP = 'ipkg.files.backend'
+
+#: Backends shipped with ipkg, by scheme.
+#: Their entry points don't need to be scanned to find them.
+BUILTIN_BACKENDS = {
+    'file': 'ipkg.files.backends.filesystem:LocalFile',
+    'http': 'ipkg.files.backends.http:HttpFile',
+    'https': 'ipkg.files.backends.http:HttpFile',
+}
+
+# Backend classes, by scheme
+BACKENDS = {}
+# Other backends entry points, by scheme. None until they are scanned.
+ENTRY_POINTS = None
+
+
+def import_backend(path):
+    """Import a backend class from its ``module:class`` path.
+    """
+    module_name, class_name = path.split(':')
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+def register_backend(scheme, backend_cls):
+    """Use ``backend_cls`` to open files of ``scheme``.
+    """
+    BACKENDS[scheme] = backend_cls
+
+
+def get_backend(scheme):
+    """Returns the backend class which handles ``scheme``.
+
+    Backends are looked up once: among the builtin backends first,
+    then among the ``ipkg.files.backend`` entry points.
+    """
+    global ENTRY_POINTS
+
+    if scheme not in BACKENDS:
+
+        if scheme in BUILTIN_BACKENDS:
+            register_backend(scheme, import_backend(BUILTIN_BACKENDS[scheme]))
+
+        else:
+            if ENTRY_POINTS is None:
+                from pkg_resources import iter_entry_points
+                ENTRY_POINTS = dict(
+                    (entry_point.name, entry_point) for entry_point in
+                    iter_entry_points(group=ENTRY_POINT_GROUP))
+
+            if scheme in ENTRY_POINTS:
+                register_backend(scheme, ENTRY_POINTS[scheme].load())
+            else:
+                raise UnknownScheme('No backend found for scheme: %s' % scheme)
+
+    return BACKENDS[scheme]
 
 
 def vopen(url, **kw):
@@ -19,11 +74,4 @@ def vopen(url, **kw):
     """
     info = urlparse(url)
     scheme = info.scheme or DEFAULT_SCHEME
-
-    for backend_ep in iter_entry_points(group='ipkg.files.backend'):
-        if backend_ep.name == scheme:
-            backend_cls = backend_ep.load()
-            backend = backend_cls(url, **kw)
-            return backend
-    else:
-        raise UnknownScheme('No backend found for scheme: %s' % scheme)
+    return get_backend(scheme)(url, **kw)
@@ -7,6 +7,7 @@ from ..exceptions import FilesException
 
 
 LOGGER = logging.getLogger(__name__)
+CHUNK_SIZE = 1024 * 1024
 
 
 class BackendException(FilesException):
@@ -19,11 +20,17 @@ class InvalidChecksum(BackendException):
 
 class BaseFile(object):
     """Base class for virtual files.
+
+    Remote files are read from the cache when it has them. If
+    ``use_cache`` is false, they are downloaded again, unless ipkg is
+    offline.
     """
-    def __init__(self, name, expected_hash=None, hash_class=hashlib.sha256):
+    def __init__(self, name, expected_hash=None, hash_class=hashlib.sha256,
+                 use_cache=True):
         self.name = name
         self.expected_hash = expected_hash
         self.hash_class = hash_class
+        self.use_cache = use_cache
 
     def __str__(self):
         return self.name
@@ -36,11 +43,7 @@ class BaseFile(object):
             return
 
         else:
-            hash_obj = self.hash_class()
-            current_position = self.tell()
-            file_content = self.read()
-            self.seek(current_position)
-            hash_obj.update(file_content)
+            hash_obj = self.update_hash(self.hash_class())
             file_hash = hash_obj.hexdigest()
 
             if file_hash != self.expected_hash:
@@ -51,6 +54,20 @@ class BaseFile(object):
             else:
                 LOGGER.debug('Checksum ok for %s', self.name)
 
+    def update_hash(self, hash_obj):
+        """Update ``hash_obj`` with the file content, from the current
+           position, and returns it. The file position is not changed.
+        """
+        current_position = self.tell()
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if data:
+                hash_obj.update(data)
+            else:
+                break
+        self.seek(current_position)
+        return hash_obj
+
     def seek(self, *args):
         pass
 
@@ -59,3 +76,14 @@ class BaseFile(object):
 
     def read(self, *args):
         raise NotImplentedError
+
+    def close(self):
+        pass
+
+    def readinto(self, buf):
+        """Read up to ``len(buf)`` bytes into ``buf``, and returns the
+           number of bytes read.
+        """
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
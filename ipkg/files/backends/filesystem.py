@@ -1,4 +1,5 @@
 import os
+import mmap
 
 try:
     from urlparse import urlparse
@@ -6,6 +7,7 @@ except ImportError:  # Python 3
     from urllib.parse import urlparse
 
 from . import BaseFile, BackendException
+from ... import metrics
 
 
 class LocalFileException(BackendException):
@@ -14,14 +16,49 @@ class LocalFileException(BackendException):
 
 class LocalFile(BaseFile):
     """A file on the local filesystem.
+
+    The file is opened in binary mode. Its content can also be accessed
+    without copy through a memory map, using ``view()``.
     """
     def __init__(self, *args, **kw):
         super(LocalFile, self).__init__(*args, **kw)
         filepath = urlparse(self.name).path
         if os.path.isfile(filepath):
-            self.__file = open(filepath)
+            self.__file = open(filepath, 'rb')
         else:
             raise LocalFileException('Not a file: %s' % filepath)
+        self.__mmap = None
+
+    @property
+    def mmap(self):
+        """Read-only memory map of the file, or ``None`` if it is empty.
+        """
+        if self.__mmap is None and os.fstat(self.__file.fileno()).st_size:
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        return self.__mmap
+
+    def view(self, offset=0):
+        """Returns a read-only view of the file content from ``offset``,
+           without copying it.
+        """
+        if self.mmap is None:
+            return memoryview(b'')
+        try:
+            return memoryview(self.mmap)[offset:]
+        except TypeError:
+            # Python 2 mmap objects only have the old buffer interface
+            return buffer(self.mmap, offset)
+
+    def update_hash(self, hash_obj):
+        hash_obj.update(self.view(self.tell()))
+        return hash_obj
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+        self.__file.close()
 
     def seek(self, *args):
         self.__file.seek(*args)
@@ -30,4 +67,11 @@ class LocalFile(BaseFile):
         return self.__file.tell()
 
     def read(self, *args):
-        return self.__file.read(*args)
+        data = self.__file.read(*args)
+        metrics.increment('files.file.bytes', len(data))
+        return data
+
+    def readinto(self, buf):
+        size = self.__file.readinto(buf)
+        metrics.increment('files.file.bytes', size)
+        return size
@@ -1,61 +1,341 @@
+import os
+import time
+import socket
 import logging
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 import requests
+from requests.packages.urllib3.exceptions import HTTPError as Urllib3Error
 
-from . import BaseFile, BackendException
+from . import BaseFile, BackendException, InvalidChecksum
 from .. import cache
-from ...compat import StringIO
+from ... import metrics
+from ...compat import Queue, Empty
 
 
 LOGGER = logging.getLogger(__name__)
+CHUNK_SIZE = 1024 * 1024
+
+#: Seconds to wait for the server to send data
+DEFAULT_TIMEOUT = 30
+#: How many times a failed download is resumed
+DEFAULT_RETRIES = 3
+#: Seconds to wait before the first retry, doubled after each retry
+DEFAULT_BACKOFF = 0.5
+#: If the server did not answer after this many seconds, send a second
+#: request and use the first answer. ``None`` to disable.
+DEFAULT_HEDGE_AFTER = None
 
 
 class HttpFileException(BackendException):
     """An error occurred while accessing a file over HTTP/s."""
 
 
+class IncompleteDownload(HttpFileException):
+    """The connection was closed before the end of the file."""
+
+
+class NotCached(HttpFileException):
+    """ipkg is offline, and the file is not in the cache."""
+
+
+def get_setting(name, default, type_=float):
+    """Read a setting from the ``IPKG_HTTP_<NAME>`` environment variable.
+    """
+    value = os.environ.get('IPKG_HTTP_' + name)
+    if value is None or value == '':
+        return default
+    try:
+        return type_(value)
+    except ValueError:
+        raise HttpFileException('Invalid value for IPKG_HTTP_%s: %s' %
+                                (name, value))
+
+
 class HttpFile(BaseFile):
     """A file on a remote HTTP server.
+
+    Downloads are retried with an exponential backoff, and resumed from
+    where they stopped using HTTP ``Range`` requests. When the cache is
+    active, partial downloads are kept in the cache directory, so they are
+    also resumed by the next ipkg run.
+
+    Files with an expected checksum are cached by checksum, and verified
+    while they are downloaded.
+
+    ``timeout``, ``retries``, ``backoff`` and ``hedge_after`` default to
+    the ``IPKG_HTTP_TIMEOUT``, ``IPKG_HTTP_RETRIES``, ``IPKG_HTTP_BACKOFF``
+    and ``IPKG_HTTP_HEDGE_AFTER`` environment variables.
     """
     def __init__(self, *args, **kw):
+        self.timeout = kw.pop('timeout', None) or \
+            get_setting('TIMEOUT', DEFAULT_TIMEOUT)
+        self.retries = kw.pop('retries', None)
+        if self.retries is None:
+            self.retries = get_setting('RETRIES', DEFAULT_RETRIES, int)
+        self.backoff = kw.pop('backoff', None)
+        if self.backoff is None:
+            self.backoff = get_setting('BACKOFF', DEFAULT_BACKOFF)
+        self.hedge_after = kw.pop('hedge_after', None) or \
+            get_setting('HEDGE_AFTER', DEFAULT_HEDGE_AFTER)
         super(HttpFile, self).__init__(*args, **kw)
         self.__file = None
+        self.__cache_key = cache.make_key(self.name, self.expected_hash,
+                                          self.hash_class)
+        self.__hash_obj = None
+        self.__verified = False
+        self.__received = 0
 
-    def __download(self):
-        LOGGER.info('Downloading: %s', self.name)
+    def __get(self, headers):
+        response = requests.get(self.name, stream=True, headers=headers,
+                                timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def __request(self, headers):
+        """Send a GET request.
+
+        If the server does not answer within ``hedge_after`` seconds,
+        a second request is sent and the first response is used.
+        """
+        if not self.hedge_after:
+            return self.__get(headers)
+
+        responses = Queue()
+
+        def send():
+            try:
+                responses.put((True, self.__get(headers)))
+            except requests.RequestException as exc:
+                responses.put((False, exc))
+
+        def close_other():
+            success, response = responses.get()
+            if success:
+                response.close()
+
+        threading.Thread(target=send).start()
         try:
-            response = requests.get(self.name, stream=True)
+            success, result = responses.get(timeout=self.hedge_after)
+            requests_sent = 1
+        except Empty:
+            LOGGER.debug('No answer after %ss, sending a second request '
+                         'for %s', self.hedge_after, self.name)
+            metrics.increment('files.http.hedged_requests')
+            threading.Thread(target=send).start()
+            success, result = responses.get()
+            requests_sent = 2
+            if not success:
+                # The other request may still succeed
+                success, result = responses.get()
+                requests_sent = 1
 
-        except requests.RequestException as exc:
-            raise HttpFileException(str(exc))
+        if requests_sent == 2:
+            closer = threading.Thread(target=close_other)
+            closer.daemon = True
+            closer.start()
 
+        if success:
+            return result
         else:
-            content = StringIO()
+            raise result
+
+    def __make_hash(self, fileobj=None):
+        """Returns the hash object used to verify the file while it is
+           downloaded, updated with the partial download in ``fileobj``.
+        """
+        if self.expected_hash is None:
+            return None
+        hash_obj = self.hash_class()
+        if fileobj is not None and fileobj.tell():
+            fileobj.seek(0)
+            while True:
+                data = fileobj.read(CHUNK_SIZE)
+                if data:
+                    hash_obj.update(data)
+                else:
+                    break
+        return hash_obj
+
+    def __fetch(self, fileobj):
+        """Download the file to ``fileobj``, resuming from its current
+           position.
+        """
+        offset = fileobj.tell()
+        # Ranges and checksums apply to the file itself
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            LOGGER.info('Resuming download of %s at byte %d',
+                        self.name, offset)
+            headers['Range'] = 'bytes=%d-' % offset
+
+        try:
+            response = self.__request(headers)
+        except requests.HTTPError as exc:
+            if offset and exc.response is not None and \
+                    exc.response.status_code == 416:
+                # Range not satisfiable: start over
+                fileobj.seek(0)
+                fileobj.truncate()
+                self.__hash_obj = self.__make_hash()
+            raise
+
+        if response.status_code != 206 and offset:
+            # The server does not support ranges
+            LOGGER.debug('Cannot resume download of %s', self.name)
+            fileobj.seek(0)
+            fileobj.truncate()
+            self.__hash_obj = self.__make_hash()
+            offset = 0
 
+        expected_size = response.headers.get('content-length')
+        received = 0
+        try:
             while True:
-                data = response.raw.read(1024 * 1024)
+                data = response.raw.read(CHUNK_SIZE)
                 if data:
-                    content.write(data)
+                    fileobj.write(data)
+                    if self.__hash_obj is not None:
+                        self.__hash_obj.update(data)
+                    received += len(data)
+                    self.__received += len(data)
                 else:
                     break
+        except (Urllib3Error, socket.error) as exc:
+            raise IncompleteDownload(str(exc))
+        finally:
+            response.close()
+            fileobj.flush()
+
+        metrics.increment('files.http.bytes', received)
+
+        if expected_size is not None and received < int(expected_size):
+            raise IncompleteDownload('Received %d of %s bytes' %
+                                     (received, expected_size))
+
+    def __open_partial(self, partial_filepath, filepath):
+        """Open the partial download of the file in the cache, locked so
+           that other threads and processes do not download it at the same
+           time.
+
+        Returns ``None`` if another download of the file completed while
+        waiting for the lock.
+        """
+        while True:
+            fileobj = open(partial_filepath, 'a+b')
+            if fcntl is None:
+                return fileobj
+            fcntl.flock(fileobj.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.stat(partial_filepath).st_ino
+            except OSError:
+                current = None
+            if current == os.fstat(fileobj.fileno()).st_ino:
+                return fileobj
+            # Renamed to the cache file, or removed, by the download which
+            # held the lock
+            fileobj.close()
+            if self.use_cache and os.path.exists(filepath):
+                return None
+
+    def __download(self):
+        LOGGER.info('Downloading: %s', self.name)
+        start = time.time()
+        self.__received = 0
+
+        if cache.is_active():
+            filepath = cache.get_cache_filepath(self.__cache_key)
+            partial_filepath = cache.get_partial_filepath(self.__cache_key)
+            fileobj = self.__open_partial(partial_filepath, filepath)
+            if fileobj is None:
+                LOGGER.info('Downloaded by another process: %s', self.name)
+                self.__file = open(filepath, 'rb')
+                self.__verified = self.expected_hash is not None
+                return
+            if not self.use_cache:
+                # May be a part of a previous version of the file
+                fileobj.truncate(0)
+            fileobj.seek(0, os.SEEK_END)
+        else:
+            filepath = partial_filepath = None
+            fileobj = tempfile.TemporaryFile(prefix='ipkg-download-')
+        self.__hash_obj = self.__make_hash(fileobj)
+
+        attempt = 0
+        while True:
+            try:
+                self.__fetch(fileobj)
+            except (requests.RequestException, IncompleteDownload) as exc:
+                if attempt >= self.retries:
+                    fileobj.close()
+                    raise HttpFileException(str(exc))
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                metrics.increment('files.http.retries')
+                LOGGER.warning('Download of %s failed (%s), retrying in '
+                               '%.1fs', self.name, exc, delay)
+                time.sleep(delay)
+            else:
+                break
+
+        elapsed = time.time() - start
+        if elapsed > 0:
+            # Bytes of a resumed partial download are not counted
+            metrics.observe('files.http.throughput',
+                            self.__received / elapsed)
 
-            content.seek(0)
+        if self.__hash_obj is not None:
+            file_hash = self.__hash_obj.hexdigest()
+            if file_hash != self.expected_hash:
+                if partial_filepath is not None:
+                    os.unlink(partial_filepath)
+                fileobj.close()
+                LOGGER.error('File checksum is %s, expected %s (%s)',
+                             file_hash, self.expected_hash,
+                             self.__hash_obj.name)
+                raise InvalidChecksum()
+            self.__verified = True
 
-            if cache.is_active():
-                cache.set(self.name, content.read())
-                content.seek(0)
+        if filepath is None:
+            fileobj.seek(0)
+            self.__file = fileobj
+        else:
+            # Renamed before the lock is released by closing it
+            os.rename(partial_filepath, filepath)
+            fileobj.close()
+            LOGGER.debug('Added %s to cache', self.name)
+            self.__file = open(filepath, 'rb')
 
-            self.__file = content
-            LOGGER.info('Downloaded: %s', self.name)
+        LOGGER.info('Downloaded: %s', self.name)
 
     def __get_file(self):
         if self.__file is None:
-            if cache.has(self.name):
-                self.__file = cache.get(self.name)
-            else:
+            offline = cache.is_offline()
+            if self.use_cache or offline:
+                self.__file = cache.get(self.__cache_key)
+            if self.__file is None:
+                if offline:
+                    raise NotCached('Cannot download %s: ipkg is offline' %
+                                    self.name)
                 self.__download()
+            elif self.expected_hash is not None:
+                # Verified before being added to the cache
+                self.__verified = True
         return self.__file
 
+    def verify_checksum(self):
+        self.__get_file()
+        if self.__verified:
+            LOGGER.debug('Checksum ok for %s', self.name)
+        else:
+            super(HttpFile, self).verify_checksum()
+
     def seek(self, *args):
         self.__get_file().seek(*args)
 
@@ -64,3 +344,11 @@ class HttpFile(BaseFile):
 
     def read(self, *args):
         return self.__get_file().read(*args)
+
+    def readinto(self, buf):
+        return self.__get_file().readinto(buf)
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
@@ -3,10 +3,15 @@ from os import path, environ
 from hashlib import sha256
 
 from .exceptions import FilesException
+from .. import metrics
 
 
 LOGGER = getLogger(__name__)
 ENVVAR_NAME = 'IPKG_CACHE_DIR'
+#: When this variable is set, remote files are only read from the cache
+OFFLINE_ENVVAR = 'IPKG_OFFLINE'
+#: Suffix of files being downloaded to the cache
+PARTIAL_SUFFIX = '.part'
 
 
 class CacheException(FilesException):
@@ -33,11 +38,32 @@ def is_active():
         return True
 
 
+def make_key(name, expected_hash=None, hash_class=None):
+    """Returns the cache key of a file.
+
+    Files with a known checksum are cached by checksum, whatever their
+    name, so that identical files from different URLs are only downloaded
+    once. Other files are cached by name.
+    """
+    if expected_hash is None:
+        return name
+    else:
+        return '%s:%s' % ((hash_class or sha256)().name, expected_hash)
+
+
+def is_offline():
+    return environ.get(OFFLINE_ENVVAR, '') not in ('', '0')
+
+
 def get_cache_filepath(name):
     filename = sha256(name).hexdigest()
     return path.join(get_cache_dir(), filename)
 
 
+def get_partial_filepath(name):
+    return get_cache_filepath(name) + PARTIAL_SUFFIX
+
+
 def has(name):
     if is_active():
         return path.exists(get_cache_filepath(name))
@@ -56,7 +82,14 @@ def set(name, content):
 
 
 def get(name):
+    """Returns the cached file of ``name``, or ``None`` if it is not
+       cached.
+    """
     if is_active():
         filepath = get_cache_filepath(name)
-        LOGGER.debug('Found %s in cache', name)
-        return open(filepath)
+        if path.exists(filepath):
+            LOGGER.debug('Found %s in cache', name)
+            metrics.increment('files.cache.hits')
+            return open(filepath, 'rb')
+        else:
+            metrics.increment('files.cache.misses')
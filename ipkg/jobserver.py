@@ -0,0 +1,240 @@
+"""GNU make jobserver.
+
+Builds of formulas with ``parallel_make`` share a pool of job tokens sized
+to the machine, and pass it to their ``make`` commands through
+``MAKEFLAGS``. They then share the same cores, whether one large formula
+or many small ones are built.
+
+The pool belongs to the ipkg process, unless ``IPKG_JOBSERVER`` names a
+pipe shared by the processes of a build session (e.g. build workers of a
+host). The first process which opens the pipe fills it, and it is filled
+again when a process opens it while no other process uses it, so tokens
+lost by processes killed while holding them are restored once the
+session ends.
+
+A token is a byte in a pipe: ``make`` reads one before starting a job
+and writes it back when the job is done. Each build holds a token while
+it runs, which pays for the job ``make`` runs without a token.
+"""
+import os
+import re
+import stat
+import errno
+import select
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .exceptions import IpkgException
+
+
+LOGGER = logging.getLogger(__name__)
+#: Environment variable defining the number of jobs
+JOBS_ENVVAR = 'IPKG_JOBS'
+#: Environment variable defining the path of the named pipe shared by the
+#: ipkg processes of a build session
+PATH_ENVVAR = 'IPKG_JOBSERVER'
+MAKEFLAGS_FDS = re.compile(r'--jobserver-(?:fds|auth)=(\d+),(\d+)')
+#: ``MAKEFLAGS`` words replaced by the ones of the jobserver
+MAKEFLAGS_JOBS = re.compile(r'^(-j\d*|--jobs(=\d+)?|--jobserver-\w+=.*)$')
+TOKEN = '+'
+
+#: The jobserver of this process, see ``get_jobserver()``
+JOBSERVER = None
+LOCK = threading.Lock()
+
+
+class JobServerException(IpkgException):
+    """An error occurred while setting up the jobserver."""
+
+
+def get_jobs():
+    """Returns the number of jobs which can run at once.
+
+    It defaults to the number of processors.
+    """
+    if os.environ.get(JOBS_ENVVAR):
+        try:
+            jobs = int(os.environ[JOBS_ENVVAR])
+        except ValueError:
+            jobs = 0
+        if jobs < 1:
+            raise JobServerException('Invalid %s: %s' % (
+                JOBS_ENVVAR, os.environ[JOBS_ENVVAR]))
+        return jobs
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_path():
+    """Returns the path of the named pipe of the build session jobserver,
+       or ``None`` if the process has its own jobserver.
+    """
+    return os.environ.get(PATH_ENVVAR) or None
+
+
+def merge_makeflags(makeflags, jobserver_flags):
+    """Returns ``makeflags`` with its job options replaced by
+       ``jobserver_flags``.
+
+    Other options and variable definitions of ``makeflags`` are kept.
+    """
+    words = [word for word in (makeflags or '').split()
+             if not MAKEFLAGS_JOBS.match(word)]
+    # Variable definitions follow ``--``
+    index = words.index('--') if '--' in words else len(words)
+    words[index:index] = jobserver_flags.split()
+    return ' '.join(words)
+
+
+class JobServer(object):
+    """A pool of ``jobs`` tokens, in a pipe of this process.
+
+    If ``fds`` are given, they are the ``(read, write)`` file descriptors
+    of an existing jobserver, like the one of a parent ``make``. Builds do
+    not hold tokens of such a jobserver, as it already counted the ipkg
+    process as a job.
+    """
+    def __init__(self, jobs=None, fds=None):
+        self.jobs = jobs
+        self.build_tokens = fds is None
+        if fds is None:
+            self.jobs = jobs or get_jobs()
+            fds = os.pipe()
+            os.write(fds[1], TOKEN * self.jobs)
+        self.read_fd, self.write_fd = fds
+        for fd in set(fds):
+            # File descriptors are not inherited by default on Python 3
+            if hasattr(os, 'set_inheritable'):
+                os.set_inheritable(fd, True)
+
+    @classmethod
+    def from_makeflags(cls, makeflags):
+        """Returns the jobserver defined in ``makeflags``, or ``None``.
+        """
+        match = MAKEFLAGS_FDS.search(makeflags or '')
+        if match:
+            fds = tuple(int(fd) for fd in match.groups())
+            try:
+                for fd in fds:
+                    os.fstat(fd)
+            except OSError:
+                LOGGER.debug('Jobserver of MAKEFLAGS is not available')
+            else:
+                return cls(fds=fds)
+
+    @classmethod
+    def open(cls, path, jobs=None):
+        """Returns the jobserver of the named pipe at ``path``, shared with
+           other processes.
+
+        The process which opens it first fills it with ``jobs`` tokens.
+        Tokens are lost when all processes using it have closed it.
+        """
+        if fcntl is None:
+            raise JobServerException('Named pipes are not supported')
+        try:
+            os.mkfifo(path, 0600)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise JobServerException('Cannot create %s: %s' %
+                                         (path, exception.strerror))
+        if not stat.S_ISFIFO(os.stat(path).st_mode):
+            raise JobServerException('%s is not a named pipe' % path)
+
+        # Held in shared mode while the pipe is open: if it can be locked
+        # in exclusive mode, no other process uses the pipe
+        users_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0600)
+        # Not inherited, so that commands of builds cannot keep it locked
+        fcntl.fcntl(users_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        # Read-write, so that opening does not wait for another process
+        fifo_fd = os.open(path, os.O_RDWR)
+        jobserver = cls(fds=(fifo_fd, fifo_fd))
+        jobserver.build_tokens = True
+        jobserver.users_fd = users_fd
+
+        try:
+            fcntl.flock(users_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as exception:
+            if exception.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            # Waits until the process filling the pipe is done
+            fcntl.flock(users_fd, fcntl.LOCK_SH)
+            LOGGER.debug('Using jobserver %s', path)
+        else:
+            jobserver.jobs = jobs or get_jobs()
+            # Tokens of the processes which closed it are discarded
+            while select.select([fifo_fd], [], [], 0)[0]:
+                os.read(fifo_fd, 4096)
+            os.write(fifo_fd, TOKEN * jobserver.jobs)
+            fcntl.flock(users_fd, fcntl.LOCK_SH)
+            LOGGER.debug('Jobserver %s started with %d jobs', path,
+                         jobserver.jobs)
+        return jobserver
+
+    @property
+    def makeflags(self):
+        """``MAKEFLAGS`` value which makes ``make`` use this jobserver.
+        """
+        return '-j --jobserver-fds=%d,%d' % (self.read_fd, self.write_fd)
+
+    def acquire(self):
+        """Wait for a token, and returns it.
+        """
+        return os.read(self.read_fd, 1)
+
+    def release(self, token=TOKEN):
+        os.write(self.write_fd, token)
+
+    @contextmanager
+    def token(self):
+        """Hold a token while running the ``with`` block.
+        """
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    @contextmanager
+    def build_token(self):
+        """Hold a token while a build runs, unless the jobserver belongs to
+           a parent ``make``.
+        """
+        if self.build_tokens:
+            with self.token():
+                yield
+        else:
+            yield
+
+
+def get_jobserver():
+    """Returns the jobserver shared by the builds of this process.
+
+    If ipkg itself runs from ``make``, the jobserver of ``make`` is used.
+    Otherwise, it is the jobserver of the build session if there is one
+    (see ``get_path()``), or a jobserver of this process.
+    """
+    global JOBSERVER
+    with LOCK:
+        if JOBSERVER is None:
+            JOBSERVER = JobServer.from_makeflags(os.environ.get('MAKEFLAGS'))
+            path = get_path()
+            if JOBSERVER is None and path is not None:
+                try:
+                    JOBSERVER = JobServer.open(path)
+                except (OSError, JobServerException) as exception:
+                    LOGGER.warning('Cannot use the jobserver %s, builds of '
+                                   'other processes are not counted: %s',
+                                   path, exception)
+            if JOBSERVER is None:
+                JOBSERVER = JobServer()
+    return JOBSERVER
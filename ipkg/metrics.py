@@ -0,0 +1,134 @@
+"""Process wide metrics.
+
+Counters count events or bytes, histograms record distributions of
+values such as durations or throughputs. Metric names are dotted
+strings, e.g. ``files.http.bytes``.
+
+Usage::
+
+    from ipkg import metrics
+
+    metrics.increment('files.cache.hits')
+    with metrics.timer('dictfile.load.seconds'):
+        load()
+    metrics.snapshot()
+
+``ipkg --metrics-file PATH`` writes a snapshot to ``PATH`` as JSON when
+the command ends.
+"""
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+LOCK = threading.Lock()
+COUNTERS = {}
+HISTOGRAMS = {}
+
+
+class Histogram(object):
+    """Distribution of observed values.
+
+    Values are counted in buckets, by power of 2 upper bound.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value > 0:
+            bound = 2.0 ** math.ceil(math.log(value, 2))
+        else:
+            bound = 0
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / float(self.count) if self.count else None,
+            'buckets': dict(('%g' % bound, count)
+                            for bound, count in self.buckets.items()),
+        }
+
+
+def increment(name, value=1):
+    """Add ``value`` to the ``name`` counter.
+    """
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def observe(name, value):
+    """Record ``value`` in the ``name`` histogram.
+    """
+    with LOCK:
+        if name not in HISTOGRAMS:
+            HISTOGRAMS[name] = Histogram()
+        HISTOGRAMS[name].observe(value)
+
+
+@contextmanager
+def timer(name):
+    """Record the duration of a block, in seconds, in the ``name``
+       histogram.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start)
+
+
+def observe_throughput(name, size, elapsed):
+    """Record ``size`` bytes processed in ``elapsed`` seconds: adds them
+       to the ``<name>.bytes`` counter, and records the bytes per second
+       in the ``<name>.throughput`` histogram.
+    """
+    increment(name + '.bytes', size)
+    if elapsed > 0:
+        observe(name + '.throughput', size / elapsed)
+
+
+def snapshot():
+    """Returns the current metrics, as a JSON serializable ``dict``.
+    """
+    with LOCK:
+        counters = dict(COUNTERS)
+        histograms = dict((name, histogram.as_dict())
+                          for name, histogram in HISTOGRAMS.items())
+
+    hits = counters.get('files.cache.hits', 0)
+    misses = counters.get('files.cache.misses', 0)
+    if hits + misses:
+        counters['files.cache.hit_ratio'] = hits / float(hits + misses)
+
+    return {'counters': counters, 'histograms': histograms}
+
+
+def reset():
+    """Forget all metrics.
+    """
+    with LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+
+
+def dump(path):
+    """Write a snapshot to the ``path`` JSON file.
+    """
+    with open(path, 'w') as fileobj:
+        json.dump(snapshot(), fileobj, indent=4, sort_keys=True)
@@ -0,0 +1,267 @@
+"""Repository mirrors.
+
+A ``MirrorList`` ranks the mirrors of a repository by the speed they
+showed in previous downloads, opens files on the best ones and fails over
+to the next mirror when a download fails.
+
+Mirror speeds are measured on the downloads ipkg needs anyway. Their
+statistics are stored in the ipkg cache directory when it is active, so
+that they are kept between ipkg runs. Mirrors are probed when their
+statistics are missing or stale.
+"""
+import os
+import time
+import logging
+import threading
+
+from .exceptions import IpkgException
+from .files import vopen, cache
+from .files.exceptions import FilesException
+from .utils import DictFile, parallel_map
+
+
+LOGGER = logging.getLogger(__name__)
+#: Name of the mirror statistics file, in the cache directory
+STATS_FILE = 'mirrors.json'
+#: Weight of the last measure in the statistics moving averages
+SMOOTHING = 0.3
+#: Downloads smaller than this are only used to measure latency
+MIN_THROUGHPUT_SIZE = 64 * 1024
+#: Size of the file used to compare mirror speeds
+REFERENCE_SIZE = 1024 * 1024
+#: Number of mirrors concurrent downloads are spread across
+SPREAD = 2
+#: Mirrors are probed again when their statistics are older than this many
+#: seconds
+STATS_MAX_AGE = 7 * 24 * 3600
+
+
+class NoMirrorAvailable(IpkgException):
+
+    MESSAGE = 'Cannot get %s from any mirror'
+
+
+def average(previous, value):
+    """Exponential moving average."""
+    if previous is None:
+        return value
+    else:
+        return previous + SMOOTHING * (value - previous)
+
+
+class MirrorList(object):
+    """Mirrors of a repository, ranked by speed.
+
+    ``urls`` are the mirror base URLs. Mirrors without statistics are
+    tried first, in ``urls`` order.
+    """
+    def __init__(self, urls, stats=None):
+        if not urls:
+            raise ValueError('No mirror')
+        self.urls = list(urls)
+        if stats is None:
+            stats = self.load_stats()
+        self.stats = stats
+        self.__active = dict((url, 0) for url in self.urls)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def load_stats():
+        """Returns the statistics stored in the cache directory, or an
+           empty ``dict`` if the cache is not active.
+        """
+        if cache.is_active():
+            return DictFile(os.path.join(cache.get_cache_dir(), STATS_FILE))
+        else:
+            return {}
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __iter__(self):
+        return iter(self.urls)
+
+    def __repr__(self):
+        return 'MirrorList(%r)' % self.urls
+
+    def score(self, url):
+        """Returns the expected time to download a ``REFERENCE_SIZE`` file
+           from the mirror at ``url``, or ``None`` if it is unknown.
+        """
+        stats = self.stats.get(url)
+        if not stats or stats.get('latency') is None:
+            return None
+        score = stats['latency']
+        if stats.get('throughput'):
+            score += REFERENCE_SIZE / stats['throughput']
+        return score
+
+    def is_stale(self):
+        """Returns ``True`` if the statistics of a mirror are missing or
+           older than ``STATS_MAX_AGE``, and mirrors should be probed.
+        """
+        if len(self.urls) < 2:
+            return False
+        limit = time.time() - STATS_MAX_AGE
+        for url in self.urls:
+            if self.score(url) is None or \
+                    self.stats[url].get('updated', 0) < limit:
+                return True
+        return False
+
+    def ranked(self):
+        """Returns the mirror URLs, best first.
+
+        Mirrors which failed since their last successful download come
+        last.
+        """
+        def key(index_url):
+            index, url = index_url
+            score = self.score(url)
+            failures = (self.stats.get(url) or {}).get('failures', 0)
+            return (score is not None, failures, score, index)
+        return [url for _, url in sorted(enumerate(self.urls), key=key)]
+
+    def record(self, url, elapsed, size):
+        """Record a successful download of ``size`` bytes from ``url``.
+        """
+        with self.__lock:
+            stats = dict(self.stats.get(url) or {})
+            if size < MIN_THROUGHPUT_SIZE or elapsed <= 0:
+                stats['latency'] = average(stats.get('latency'), elapsed)
+            else:
+                stats['throughput'] = average(stats.get('throughput'),
+                                              size / elapsed)
+                stats.setdefault('latency', 0)
+            stats['failures'] = 0
+            stats['updated'] = time.time()
+            self.stats[url] = stats
+            self.__save()
+
+    def record_failure(self, url):
+        """Record a failed download from ``url``.
+        """
+        with self.__lock:
+            stats = dict(self.stats.get(url) or {})
+            stats['failures'] = stats.get('failures', 0) + 1
+            stats.setdefault('latency', 0)
+            stats['updated'] = time.time()
+            self.stats[url] = stats
+            self.__save()
+
+    def __save(self):
+        if isinstance(self.stats, DictFile):
+            try:
+                self.stats.save()
+            except (IOError, OSError) as exception:
+                LOGGER.debug('Cannot save mirror statistics: %s', exception)
+
+    @staticmethod
+    def __is_cached(file_url, kw):
+        """Returns ``True`` if ``vopen(file_url, **kw)`` reads the cache.
+        """
+        if not kw.get('use_cache', True) and not cache.is_offline():
+            return False
+        return cache.has(cache.make_key(file_url, kw.get('expected_hash'),
+                                        kw.get('hash_class')))
+
+    def __choose(self):
+        """Returns the mirrors to try, in order.
+
+        The first one is the least busy of the ``SPREAD`` best mirrors.
+        """
+        with self.__lock:
+            ranked = self.ranked()
+            best = ranked[:SPREAD]
+            first = min(best, key=lambda url: (self.__active[url],
+                                               best.index(url)))
+            ranked.remove(first)
+            return [first] + ranked
+
+    @staticmethod
+    def __fetch(file_url, kw):
+        """Open ``file_url`` with ``kw``, and returns the file object with
+           the seconds spent getting it and its size.
+
+        Remote files are downloaded when first accessed, so only that
+        download is timed. The checksum is then verified, when ``kw`` has
+        an ``expected_hash``.
+        """
+        start = time.time()
+        fileobj = vopen(file_url, **kw)
+        try:
+            fileobj.tell()
+            elapsed = time.time() - start
+            fileobj.seek(0, os.SEEK_END)
+            size = fileobj.tell()
+            fileobj.seek(0)
+            fileobj.verify_checksum()
+        except:
+            fileobj.close()
+            raise
+        return fileobj, elapsed, size
+
+    def open(self, path, **kw):
+        """Open the file at ``path`` on the best available mirror.
+
+        The mirror speed is measured on the download of the returned file.
+        """
+        for url in self.__choose():
+            file_url = os.path.join(url, path)
+            # Reading a cached file says nothing about the mirror speed
+            cached = self.__is_cached(file_url, kw)
+
+            with self.__lock:
+                self.__active[url] += 1
+            try:
+                fileobj, elapsed, size = self.__fetch(file_url, kw)
+            except (FilesException, IOError, OSError) as exception:
+                LOGGER.warning('Cannot get %s: %s', file_url, exception)
+                # Offline, files missing from the cache are not the fault
+                # of the mirror
+                if not cache.is_offline():
+                    self.record_failure(url)
+            else:
+                if not cached:
+                    self.record(url, elapsed, size)
+                return fileobj
+            finally:
+                with self.__lock:
+                    self.__active[url] -= 1
+
+        raise NoMirrorAvailable(path)
+
+    def probe(self, path, workers=8, **kw):
+        """Measure the speed of every mirror by opening ``path`` with
+           ``kw``, like ``open()`` does.
+
+        Returns the file opened on the fastest mirror, so that it is not
+        downloaded again, or ``None``. Nothing is measured offline, or
+        for mirrors whose file is cached.
+        """
+        if cache.is_offline():
+            return None
+
+        def measure(url):
+            file_url = os.path.join(url, path)
+            if self.__is_cached(file_url, kw):
+                return None
+            try:
+                fileobj, elapsed, size = self.__fetch(file_url, kw)
+            except (FilesException, IOError, OSError) as exception:
+                LOGGER.warning('Cannot probe %s: %s', file_url, exception)
+                self.record_failure(url)
+                return None
+            self.record(url, elapsed, size)
+            return elapsed, fileobj
+
+        results = [result for result in parallel_map(measure, self.urls,
+                                                     workers)
+                   if result is not None]
+        if not results:
+            return None
+        fastest = min(results, key=lambda result: result[0])[1]
+        for _, fileobj in results:
+            if fileobj is not fastest:
+                fileobj.close()
+        return fastest
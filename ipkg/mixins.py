@@ -1,22 +1,37 @@
 import operator
 
-from pkg_resources import parse_version
-
-from .utils import is_package_like, parse_package_spec
+from .utils import is_package_like, parse_package_spec, make_package_key
 from .compat import basestring
+from . import versions
 
 
 class NameVersionRevisionComparable(object):
     """This mixin assumes sub classes has the ``name``, ``version`` and
        ``revision`` attributes and make them comparables using the
        standard operators.
+
+       Package-like objects are equal if they have the same name, version
+       and revision, whatever their platform: a formula equals the
+       packages built from it. They are hashed the same way, so they can
+       be stored in sets or used as dictionary keys.
+
+       Objects also equal the package spec strings they match, but do not
+       hash like them: sets and dictionaries must not mix objects and
+       strings. ``PackageIndex`` supports lookups by spec string.
     """
+    @property
+    def key(self):
+        """The ``(name, version, revision, platform)`` identity tuple.
+        """
+        return make_package_key(self)
+
+    def __hash__(self):
+        return hash(self.key[:3])
+
     def __eq__(self, other):
 
         if is_package_like(other):
-            return self.name == other.name and \
-                self.version == other.version and \
-                str(self.revision) == str(other.revision)
+            return self.key[:3] == make_package_key(other)[:3]
 
         elif isinstance(other, basestring):
             spec = parse_package_spec(other)
@@ -53,8 +68,8 @@ class NameVersionRevisionComparable(object):
 
     def __compare(self, other, op):
 
-        cmp_func = lambda a, b: op(parse_version(str(a)),
-                                   parse_version(str(b)))
+        cmp_func = lambda a, b: op(versions.parse(str(a)),
+                                   versions.parse(str(b)))
 
         if is_package_like(other):
             if self.name == other.name:
@@ -1,11 +1,15 @@
 import os
 import json
-import tarfile
+import time
 import logging
+from collections import defaultdict
 
 from .files import vopen
-from .exceptions import IpkgException
+from .exceptions import IpkgException, InvalidPackage
 from .mixins import NameVersionRevisionComparable
+from .utils import make_package_key, parse_package_spec
+from .compat import basestring
+from . import metrics
 
 
 LOGGER = logging.getLogger(__name__)
@@ -36,6 +40,10 @@ class MetaPackage(NameVersionRevisionComparable):
         else:
             raise UnknownMeta(attr)
 
+    @property
+    def key(self):
+        return make_package_key(self.meta)
+
     def as_requirement(self):
         return '%(name)s==%(version)s' % self.meta
 
@@ -48,11 +56,15 @@ class MetaPackage(NameVersionRevisionComparable):
 
 class PackageFile(MetaPackage):
     """An ipkg package file.
+
+    ``opener`` is called without argument to open the file, instead of
+    ``vopen(path)``.
     """
-    def __init__(self, path, meta=None):
+    def __init__(self, path, meta=None, opener=None):
         self.path = path
         self.__tarfile = None
         self.__meta = meta
+        self.__opener = opener
 
     @property
     def meta(self):
@@ -60,18 +72,103 @@ class PackageFile(MetaPackage):
             self.__meta = json.load(self._tarfile.extractfile(META_FILE))
         return self.__meta
 
+    def open(self):
+        """Returns the package file object.
+        """
+        if self.__opener is None:
+            return vopen(self.path)
+        else:
+            return self.__opener()
+
     @property
     def _tarfile(self):
         if self.__tarfile is None:
-            self.__tarfile = tarfile.open(fileobj=vopen(self.path))
+            # Imported here to keep ipkg startup fast
+            import tarfile
+            self.__tarfile = tarfile.open(fileobj=self.open())
         return self.__tarfile
 
     def extract(self, path):
         """Extract the package to ``path``.
         """
         LOGGER.debug('Extracting %s in %s', self, path)
+        start = time.time()
         files = [m for m in self._tarfile.getmembers() if m.path != META_FILE]
         self._tarfile.extractall(path, files)
+        metrics.observe_throughput('packages.extract',
+                                   sum(member.size for member in files),
+                                   time.time() - start)
+
+
+class PackageIndex(object):
+    """A set of package-like objects, indexed by name and by key.
+
+    Membership tests accept package keys, package-like objects and
+    package spec strings, without scanning every package.
+    """
+    def __init__(self, packages=()):
+        self.__keys = set()
+        # package name: list of (key, package)
+        self.__names = defaultdict(list)
+        for package in packages:
+            self.add(package)
+
+    def add(self, package):
+        """Add a ``package`` to the index.
+        """
+        key = make_package_key(package)
+        if key not in self.__keys:
+            self.__keys.add(key)
+            self.__names[key[0]].append((key, package))
+
+    def discard(self, package):
+        """Remove a ``package`` from the index, if present.
+        """
+        key = make_package_key(package)
+        if key in self.__keys:
+            self.__keys.remove(key)
+            items = self.__names[key[0]]
+            items[:] = [item for item in items if item[0] != key]
+            if not items:
+                del self.__names[key[0]]
+
+    def get(self, key, default=None):
+        """Returns the package of ``key``, or ``default``.
+        """
+        if key in self.__keys:
+            for item_key, package in self.__names[key[0]]:
+                if item_key == key:
+                    return package
+        return default
+
+    def find(self, spec):
+        """Returns the packages matching a package ``spec`` string.
+        """
+        spec = parse_package_spec(spec)
+        version = spec.get('version')
+        revision = spec.get('revision')
+        return [package for key, package in self.__names.get(spec['name'], ())
+                if (version is None or key[1] == version) and
+                (revision is None or key[2] == str(revision))]
+
+    def __contains__(self, item):
+        if isinstance(item, tuple):
+            return item in self.__keys
+        elif isinstance(item, basestring):
+            return bool(self.find(item))
+        else:
+            try:
+                return make_package_key(item) in self.__keys
+            except InvalidPackage:
+                return False
+
+    def __iter__(self):
+        for items in self.__names.values():
+            for _, package in items:
+                yield package
+
+    def __len__(self):
+        return len(self.__keys)
 
 
 def make_filename(**meta):
@@ -0,0 +1,368 @@
+"""Pool of pre-built build environments.
+
+Formulas often share the same dependencies. Instead of installing them in
+a new environment for every build, environments with a given dependency
+closure are created once in the cache directory, then cloned for each
+build.
+
+Environments are locked while they are cloned, so that other processes do
+not remove them meanwhile.
+
+The prefix of pooled environments is rewritten in the clones like it is
+when installing packages. ELF files are not rewritten, so their RPATH or
+RUNPATH would still point to the pooled environment: environments whose
+ELF files contain their prefix are not cloned.
+"""
+import os
+import json
+import stat
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .environments import Environment
+from .exceptions import IpkgException
+from .requirements import Requirement
+from .prefix_rewriters import rewrite_prefix
+from .files import cache
+from .utils import mkdir
+from . import metrics, activation
+
+
+LOGGER = logging.getLogger(__name__)
+#: Directory of the pooled environments, in the cache directory
+POOL_DIR = 'environments'
+#: Environment variable defining the maximum number of pooled environments
+SIZE_ENVVAR = 'IPKG_BUILD_POOL_SIZE'
+DEFAULT_SIZE = 8
+#: Environment configuration key storing the prefix files were installed for
+PREFIX_CONFIG_KEY = 'pool_prefix'
+#: Environment configuration key storing the files containing the prefix
+REWRITE_CONFIG_KEY = 'pool_rewrite'
+#: Files rewritten in every cloned environment
+METADATA_FILES = ('.ipkg.meta', activation.ACTIVATION_FILE)
+
+
+class PoolException(IpkgException):
+    """An error occurred while using the build environment pool."""
+
+
+def resolve(requirements, repository=None):
+    """Returns the packages needed by ``requirements``, and all their
+       dependencies, by name.
+
+    The requirements of a package name are merged: a package is looked up
+    again when it does not satisfy all of them.
+    """
+    merged = {}
+    packages = {}
+    pending = list(requirements)
+    while pending:
+        requirement = pending.pop()
+        if not isinstance(requirement, Requirement):
+            requirement = Requirement(requirement)
+        name = requirement.name
+        if name in merged:
+            requirement = merged[name] + requirement
+        merged[name] = requirement
+
+        package = packages.get(name)
+        if package is None or not requirement.satisfied_by(package):
+            if repository is None:
+                raise PoolException('Cannot find package %s' % requirement)
+            package = repository[requirement]
+            packages[name] = package
+            pending.extend(package.dependencies or [])
+    return packages
+
+
+def install(environment, packages):
+    """Install ``packages``, as returned by ``resolve()``, in
+       ``environment``.
+
+    Dependencies are installed first, so that the exact resolved packages
+    are installed instead of looking their requirements up again.
+    """
+    installed = set()
+
+    def install_package(name):
+        if name in installed:
+            return
+        installed.add(name)
+        package = packages[name]
+        for dependency in package.dependencies or []:
+            if not isinstance(dependency, Requirement):
+                dependency = Requirement(dependency)
+            install_package(dependency.name)
+        environment.install(package)
+
+    for name in sorted(packages):
+        install_package(name)
+
+
+def make_key(packages):
+    """Returns the pool key of an environment containing ``packages``.
+    """
+    items = sorted((name, package.version, str(package.revision),
+                    package.meta.get('checksum'))
+                   for name, package in packages.items())
+    return hashlib.sha256(json.dumps(items)).hexdigest()
+
+
+def contains(path, data, chunk_size=1024 * 1024):
+    """Returns true if the file at ``path`` contains ``data``.
+    """
+    with open(path, 'rb') as fileobj:
+        previous = ''
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                return False
+            if data in previous + chunk:
+                return True
+            previous = (previous + chunk)[len(previous + chunk) -
+                                          len(data) + 1:]
+
+
+def find_rewritten(directory, prefix):
+    """Returns the paths (relative to ``directory``) of the regular files
+       containing ``prefix``, which are rewritten in clones.
+    """
+    rewritten = []
+    for parent, _, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(parent, filename)
+            rel_path = os.path.relpath(path, directory)
+            if rel_path not in METADATA_FILES and \
+                    not os.path.islink(path) and os.path.isfile(path) and \
+                    contains(path, prefix):
+                rewritten.append(rel_path)
+    return rewritten
+
+
+def is_elf(path):
+    """Returns true if the file at ``path`` is an ELF binary.
+    """
+    with open(path, 'rb') as fileobj:
+        return fileobj.read(4) == '\x7fELF'
+
+
+def rewrite(path, source_prefix, prefix):
+    """Rewrite ``source_prefix`` to ``prefix`` in the environment file at
+       ``path`` (relative to ``prefix``).
+
+    Every occurrence is replaced in text files. Binaries are handled by
+    ``rewrite_prefix()``.
+    """
+    file_path = os.path.join(prefix, path)
+    with open(file_path, 'rb') as fileobj:
+        content = fileobj.read()
+    if '\0' in content:
+        rewrite_prefix(path, source_prefix, prefix)
+        return
+
+    mode = os.stat(file_path).st_mode
+    if not mode & stat.S_IWUSR:
+        os.chmod(file_path, mode | stat.S_IWUSR)
+    with open(file_path, 'wb') as fileobj:
+        fileobj.write(content.replace(source_prefix, prefix))
+    if not mode & stat.S_IWUSR:
+        os.chmod(file_path, mode)
+    metrics.increment('pool.rewritten')
+
+
+def lock(path, exclusive=False):
+    """Lock the pooled environment at ``path``, and returns the open lock
+       file.
+
+    The lock is shared, unless ``exclusive`` is true: then ``None`` is
+    returned instead of waiting if the environment is locked. ``None`` is
+    also returned if the environment was removed.
+    """
+    lock_path = os.path.join(os.path.dirname(path),
+                             '.%s.lock' % os.path.basename(path))
+    lock_file = open(lock_path, 'a')
+    if fcntl is None:
+        return lock_file
+
+    try:
+        if exclusive:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+    except IOError as exception:
+        lock_file.close()
+        if exception.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+
+    # The lock file is removed with the environment
+    try:
+        current = os.stat(lock_path).st_ino
+    except OSError:
+        current = None
+    if current != os.fstat(lock_file.fileno()).st_ino or \
+            not os.path.isdir(path):
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class EnvironmentPool(object):
+    """Build environments, keyed by their dependency closure.
+
+    Least recently used environments are removed when there are more
+    than ``size`` of them.
+    """
+    def __init__(self, directory=None, size=None):
+        if directory is None:
+            directory = os.path.join(cache.get_cache_dir(), POOL_DIR)
+            mkdir(directory, False)
+        if size is None:
+            try:
+                size = int(os.environ.get(SIZE_ENVVAR, DEFAULT_SIZE))
+            except ValueError:
+                raise PoolException('Invalid %s: %s' % (
+                    SIZE_ENVVAR, os.environ[SIZE_ENVVAR]))
+        self.directory = directory
+        self.size = size
+
+    def __iter__(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.startswith('.') and os.path.isdir(path):
+                yield path
+
+    def get(self, requirements, repository=None):
+        """Returns the path of a pooled environment satisfying
+           ``requirements``, creating it if needed.
+        """
+        packages = resolve(requirements, repository)
+        path = os.path.join(self.directory, make_key(packages))
+
+        if os.path.isdir(path):
+            LOGGER.info('Using pooled build environment %s', path)
+            metrics.increment('pool.hits')
+            # Mark it as recently used
+            os.utime(path, None)
+            return path
+
+        metrics.increment('pool.misses')
+        LOGGER.info('Creating pooled build environment %s', path)
+        # Created aside then moved in place at once, as other processes
+        # may be creating the same environment
+        tmp_path = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        environment = Environment(tmp_path)
+        environment.directories.create(False)
+        install(environment, packages)
+        environment.set_config(PREFIX_CONFIG_KEY, tmp_path)
+        environment.set_config(REWRITE_CONFIG_KEY,
+                               find_rewritten(tmp_path, tmp_path))
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path)
+
+        self.evict()
+        return path
+
+    def evict(self):
+        """Remove least recently used environments.
+
+        Environments being cloned are kept.
+        """
+        paths = sorted(self, key=os.path.getmtime, reverse=True)
+        for path in paths[self.size:]:
+            lock_file = lock(path, exclusive=True)
+            if lock_file is None:
+                LOGGER.debug('Pooled build environment %s is in use', path)
+                continue
+            try:
+                LOGGER.info('Removing pooled build environment %s', path)
+                shutil.rmtree(path, ignore_errors=True)
+                os.unlink(lock_file.name)
+            finally:
+                lock_file.close()
+
+    def clone(self, requirements, prefix, repository=None, link=True):
+        """Create an environment at ``prefix`` satisfying ``requirements``.
+
+        If ``link`` is true, files are hard-linked from the pooled
+        environment, except the ones that are modified when cloning.
+        Builds must then not modify existing files of the environment.
+
+        Raises ``PoolException`` if the pooled environment contains ELF
+        files referencing its prefix, e.g. in their RPATH.
+        """
+        while True:
+            source = self.get(requirements, repository)
+            lock_file = lock(source)
+            if lock_file is not None:
+                break
+            LOGGER.debug('Pooled build environment %s was removed', source)
+
+        try:
+            return self.__clone(source, prefix, link)
+        finally:
+            lock_file.close()
+
+    def __clone(self, source, prefix, link):
+        source_environment = Environment(source)
+        source_prefix = source_environment.get_config(PREFIX_CONFIG_KEY)
+        rewritten = source_environment.get_config(REWRITE_CONFIG_KEY)
+        if rewritten is None:
+            # Pooled by an earlier ipkg version
+            rewritten = find_rewritten(source, source_prefix)
+        rewritten = set(rewritten)
+
+        if source_prefix != prefix:
+            elf_files = sorted(path for path in rewritten
+                               if is_elf(os.path.join(source, path)))
+            if elf_files:
+                raise PoolException(
+                    'Cannot rewrite the prefix of ELF files: %s' %
+                    ', '.join(elf_files))
+
+        if link and os.stat(source).st_dev != \
+                os.stat(os.path.dirname(prefix)).st_dev:
+            # Hard links cannot cross filesystems, e.g. to an in memory
+            # build directory
+            link = False
+
+        with metrics.timer('pool.clone.seconds'):
+            for parent, directories, files in os.walk(source):
+                rel_dir = os.path.relpath(parent, source)
+                target_dir = os.path.normpath(os.path.join(prefix, rel_dir))
+                os.mkdir(target_dir)
+                for filename in files:
+                    path = os.path.normpath(os.path.join(rel_dir, filename))
+                    source_path = os.path.join(parent, filename)
+                    target_path = os.path.join(target_dir, filename)
+                    if os.path.islink(source_path):
+                        os.symlink(os.readlink(source_path), target_path)
+                    elif link and path not in rewritten and \
+                            path not in METADATA_FILES:
+                        os.link(source_path, target_path)
+                    else:
+                        shutil.copy2(source_path, target_path)
+                for name in directories:
+                    source_path = os.path.join(parent, name)
+                    if os.path.islink(source_path):
+                        os.symlink(os.readlink(source_path),
+                                   os.path.join(target_dir, name))
+
+        environment = Environment(prefix)
+        if source_prefix != prefix:
+            for path in rewritten:
+                rewrite(path, source_prefix, prefix)
+        environment.set_config(PREFIX_CONFIG_KEY, prefix)
+        environment.write_activation()
+        return environment
@@ -4,6 +4,7 @@ import logging
 
 from .utils import execute, PIPE
 from .regex import PKGCONFIG_FILE, LIBTOOL_FILE
+from . import metrics
 
 
 LOGGER = logging.getLogger(__name__)
@@ -15,9 +16,11 @@ def rewrite_prefix(package_file, build_prefix, install_prefix):
 
     if PKGCONFIG_FILE.match(package_file):
         rewrite_pkgconfig(file_path, build_prefix, install_prefix)
+        metrics.increment('prefix_rewriters.pkgconfig')
 
     elif LIBTOOL_FILE.match(package_file):
         rewrite_libtool(file_path, build_prefix, install_prefix)
+        metrics.increment('prefix_rewriters.libtool')
 
     else:
         with open(file_path) as f:
@@ -25,9 +28,14 @@ def rewrite_prefix(package_file, build_prefix, install_prefix):
 
         if first_bytes[:2] == '#!':
             rewrite_text_first_line(file_path, build_prefix, install_prefix)
+            metrics.increment('prefix_rewriters.script')
 
         elif first_bytes in ('\xce\xfa\xed\xfe', '\xcf\xfa\xed\xfe'):
             rewrite_osx_bin(file_path, build_prefix, install_prefix)
+            metrics.increment('prefix_rewriters.osx_bin')
+
+        else:
+            metrics.increment('prefix_rewriters.skipped')
 
         #else:
             #LOGGER.debug('Cannot rewrite prefix of file %s: '
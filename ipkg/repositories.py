@@ -1,13 +1,21 @@
 import logging
 import hashlib
+import json
 import os
+import threading
+from functools import partial
 from collections import defaultdict
 
-from .packages import PackageFile, make_filename
+from .packages import PackageFile, PackageIndex, make_filename
 from .exceptions import IpkgException, InvalidPackage
-from .utils import DictFile, make_package_spec, mkdir
-from .build import Formula
+from .utils import DictFile, make_package_spec, make_package_key, mkdir, \
+    parallel_map
+from .platforms import Platform
+from .build import LazyFormula, INDEXED_ATTRIBUTES, FORMULA_CACHE_DIR, \
+    FETCH_WORKERS, BUILD_INFO_SUFFIX, fetch_sources
 from .regex import FORMULA_FILE
+from .mirrors import MirrorList
+from .files import vopen, cache
 from .compat import basestring
 from .requirements import Requirement
 from . import versions
@@ -25,7 +33,30 @@ class BaseRepository(object):
 
     def __init__(self, base):
         self.base = base
-        self.meta = {}
+        self.__meta = None
+        self.__meta_lock = threading.Lock()
+
+    @property
+    def meta(self):
+        """Repository meta data, loaded on first access.
+        """
+        if self.__meta is None:
+            with self.__meta_lock:
+                if self.__meta is None:
+                    self.__meta = self.load_meta()
+        return self.__meta
+
+    def load_meta(self):
+        """Returns the repository meta data.
+
+        Sub classes override this method to read their own meta data.
+        """
+        return {}
+
+    def load(self):
+        """Load the repository meta data now, instead of when first needed.
+        """
+        self.meta
 
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__, self.base)
@@ -42,6 +73,12 @@ class BaseRepository(object):
         else:
             raise RequirementNotFound(requirement)
 
+    def find_async(self, requirement, loop=None, executor=None):
+        """Like ``find()``, but returns an asyncio future.
+        """
+        from . import aio
+        return aio.find(self, requirement, loop, executor)
+
     def find(self, requirement):
         if isinstance(requirement, basestring):
             requirement = Requirement(requirement)
@@ -62,20 +99,42 @@ class BaseRepository(object):
 
 
 class PackageRepository(BaseRepository):
+    """A repository of package files.
 
+    ``base`` is the repository URL, or a list of mirror URLs.
+    Files are downloaded from the fastest mirrors, package files being
+    verified against the checksums of the repository meta data.
+    """
     META_FILE_NAME = 'repository.json'
 
     # easier to catch the exception when raised by find()
     RequirementNotFound = RequirementNotFound
 
     def __init__(self, base):
-        super(PackageRepository, self).__init__(base)
-        self.meta = DictFile(os.path.join(base, self.META_FILE_NAME))
+        if isinstance(base, basestring):
+            base = [base]
+        self.mirrors = MirrorList(base)
+        super(PackageRepository, self).__init__(self.mirrors.urls[0])
+
+    def load_meta(self):
+        # Meta data are read from a single mirror, to be consistent.
+        # They are downloaded every time, the cache is used offline.
+        fileobj = None
+        if self.mirrors.is_stale():
+            fileobj = self.mirrors.probe(self.META_FILE_NAME,
+                                         use_cache=False)
+        if fileobj is None:
+            fileobj = self.mirrors.open(self.META_FILE_NAME, use_cache=False)
+        try:
+            return json.loads(fileobj.read())
+        finally:
+            fileobj.close()
 
     def __make_package_file(self, meta):
-        filepath = os.path.join(self.base, meta['name'],
-                                make_filename(**meta))
-        return PackageFile(filepath, meta)
+        path = os.path.join(meta['name'], make_filename(**meta))
+        opener = partial(self.mirrors.open, path,
+                         expected_hash=meta.get('checksum'))
+        return PackageFile(os.path.join(self.base, path), meta, opener)
 
     def __iter__(self):
         for meta_list in self.meta.values():
@@ -86,10 +145,45 @@ class PackageRepository(BaseRepository):
         results = super(PackageRepository, self).find(requirement)
         return map(self.__make_package_file, results)
 
+    def fetch(self, requirements, workers=8):
+        """Download the packages matching ``requirements``, and their
+           dependencies, to the cache.
+
+        Packages are looked up like ``Environment.install`` does, so that
+        installing them works offline. Returns the packages.
+        """
+        if not cache.is_active():
+            raise IpkgException('Cannot fetch packages: '
+                                '%s is not set' % cache.ENVVAR_NAME)
+
+        fetched = PackageIndex()
+        requirements = set(requirements)
+
+        while requirements:
+            packages = []
+            for requirement in requirements:
+                package = self[requirement]
+                if package not in fetched:
+                    fetched.add(package)
+                    packages.append(package)
+
+            if packages:
+                LOGGER.info('Fetching %s', ', '.join(map(str, packages)))
+            parallel_map(lambda package: package.open().close(),
+                         packages, workers)
+
+            requirements = set(dependency for package in packages
+                               for dependency in package.dependencies or ())
+
+        return list(fetched)
+
 
 class LocalPackageRepository(PackageRepository):
     """A Repository stored on the local filesystem.
     """
+    def load_meta(self):
+        return DictFile(os.path.join(self.base, self.META_FILE_NAME))
+
     def update_metadata(self):
         """Update the repository meta data file."""
         LOGGER.info('Updating metadata of %r', self)
@@ -117,6 +211,9 @@ class LocalPackageRepository(PackageRepository):
                     #             filepath)
                     continue
 
+                if filename.endswith(BUILD_INFO_SUFFIX):
+                    continue
+
                 self.add(filepath)
 
         if not names or not meta.keys():
@@ -137,28 +234,70 @@ class LocalPackageRepository(PackageRepository):
         return package_file
 
     def build_formulas(self, formula_repository,
-                       environment=None, verbose=False):
+                       environment=None, verbose=False, listen=None):
         """Build all formulas and store them in this repository.
+
+        Packages already in the repository are built again when their
+        build key changed (see ``Formula.get_build_key``). Packages built
+        before build keys existed are kept.
+
+        If ``listen`` is a ``(host, port)`` address, formulas are built by
+        the workers connecting to it (see ``ipkg.distributed``).
         """
         formulas = []  # formulas not already built
         built_packages = []  # new packages
+        built = PackageIndex()
 
         LOGGER.debug('Building repository packages list...')
-        repo_packages = list(self)
+        repo_packages = PackageIndex(self)
+        # Formulas without platform are built for the current one
+        build_platform = str(Platform.current())
+
+        def get_repo_package(formula):
+            name, version, revision, platform = make_package_key(formula)
+            return repo_packages.get((name, version, revision,
+                                      platform or build_platform))
 
         for formula_cls in formula_repository:
-            if formula_cls not in repo_packages:
+            package = get_repo_package(formula_cls)
+            if package is None or package.meta.get('build_key'):
                 formulas.append(formula_cls(environment, verbose))
         LOGGER.debug('Formulas: %r', formulas)
 
+        # Download all sources before building, so builds do not wait for
+        # the network
+        if cache.is_active():
+            fetch_sources(formulas)
+
+        pending = PackageIndex(formulas)
+        if environment is not None:
+            installed = PackageIndex(environment.packages)
+        else:
+            installed = PackageIndex()
+
+        def is_up_to_date(formula):
+            package = get_repo_package(formula)
+            return package is not None and \
+                package.meta.get('build_key') == formula.get_build_key(self)
+
+        if listen is not None:
+            from .distributed import BuildCoordinator
+            available = PackageIndex(list(installed) + list(repo_packages))
+            coordinator = BuildCoordinator(self, formula_repository,
+                                           formulas, available,
+                                           is_up_to_date, listen)
+            return coordinator.run()
+
         while formulas:
             build_later = False
             formula = formulas.pop(0)
+            pending.discard(formula)
 
             for dependency in formula.dependencies:
 
-                if dependency in formulas:
+                if dependency in pending:
                     formulas.append(formula)
+                    pending.add(formula)
                     build_later = True
                     LOGGER.debug('Delaying build of %s because it requires '
                                  '%s which will be built later' %
@@ -167,10 +306,9 @@ class LocalPackageRepository(PackageRepository):
 
                 # If the dependency is installed in the environment or present
                 # in this repository, it is satisfied.
-                if ((environment is not None and
-                     dependency in environment.packages)
+                if (dependency in installed
                         or dependency in repo_packages
-                        or dependency in built_packages):
+                        or dependency in built):
                     continue
 
                 else:
@@ -180,6 +318,12 @@ class LocalPackageRepository(PackageRepository):
 
             if not build_later:
 
+                # Its dependencies are up to date now
+                if is_up_to_date(formula):
+                    LOGGER.debug('%s is up to date',
+                                 make_package_spec(formula))
+                    continue
+
                 try:
                     package_file = self.build_formula(formula)
 
@@ -189,6 +333,7 @@ class LocalPackageRepository(PackageRepository):
 
                 else:
                     built_packages.append(package_file)
+                    built.add(PackageFile(package_file))
 
         return built_packages
 
@@ -213,12 +358,15 @@ class LocalPackageRepository(PackageRepository):
             meta[package.name] = []
 
         package_meta = dict(package.meta)
+        # Replace the package if it was built again
+        key = make_package_key(package_meta)
+        meta[package.name] = [item for item in meta[package.name]
+                              if make_package_key(item) != key]
 
         if compute_checksum:
-            hashobj = hashlib.sha256()
-            with open(package.path) as fileobj:
-                hashobj.update(fileobj.read())
-            checksum = hashobj.hexdigest()
+            fileobj = vopen(package.path)
+            checksum = fileobj.update_hash(hashlib.sha256()).hexdigest()
+            fileobj.close()
             LOGGER.debug('sha256: %s', checksum)
             package_meta['checksum'] = checksum
 
@@ -229,10 +377,26 @@ class LocalPackageRepository(PackageRepository):
 
 class FormulaRepository(BaseRepository):
     """A Formula repository.
+
+    Formula files are not imported until a formula is built: their
+    name, version and dependencies are read from their syntax tree (see
+    ``ipkg.build.LazyFormula``). If the cache is active, these are stored
+    in an index, and only read again from modified files.
     """
-    def __init__(self, base):
-        super(FormulaRepository, self).__init__(base)
-        self.meta = defaultdict(list)
+    def __get_index(self):
+        """Returns the cached formula index, or ``None``.
+        """
+        if cache.is_active():
+            index_dir = os.path.join(cache.get_cache_dir(), FORMULA_CACHE_DIR)
+            mkdir(index_dir, False)
+            base_hash = hashlib.sha256(os.path.abspath(self.base)).hexdigest()
+            return DictFile(os.path.join(index_dir,
+                                         'index-%s.json' % base_hash))
+
+    def load_meta(self):
+        meta = defaultdict(list)
+        index = self.__get_index()
+        entries = {}
 
         for name in os.listdir(self.base):
             name_dir = os.path.join(self.base, name)
@@ -242,11 +406,50 @@ class FormulaRepository(BaseRepository):
 
             for formula_file in os.listdir(name_dir):
                 if FORMULA_FILE.match(formula_file):
-                    formula_filepath = os.path.join(name_dir, formula_file)
-                    formula = Formula.from_file(formula_filepath)
-                    self.meta[formula.name].append(formula)
+                    formula_filepath = os.path.abspath(
+                        os.path.join(name_dir, formula_file))
+                    stat = os.stat(formula_filepath)
+                    entry = {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+                    cached = index and index.get(formula_filepath)
+                    if cached and cached['mtime'] == entry['mtime'] and \
+                            cached['size'] == entry['size']:
+                        formula = LazyFormula(formula_filepath,
+                                              cached['meta'])
+                    else:
+                        formula = LazyFormula.from_file(formula_filepath)
+
+                    entry['meta'] = dict((attr, getattr(formula, attr))
+                                         for attr in INDEXED_ATTRIBUTES)
+                    entries[formula_filepath] = entry
+                    meta[formula.name].append(formula)
+
+        if index is not None:
+            try:
+                # Compared as stored, tuples being stored as lists
+                changed = json.loads(json.dumps(entries)) != index
+            except TypeError:
+                # Attributes of an imported formula are not serializable
+                LOGGER.debug('Cannot store index of %s', self.base)
+            else:
+                if changed:
+                    index.clear()
+                    index.update(entries)
+                    index.save()
+
+        return meta
 
     def __iter__(self):
         for formula_list in self.meta.values():
             for formula in formula_list:
                 yield formula
+
+    def fetch_sources(self, workers=FETCH_WORKERS):
+        """Download the sources and patches of all formulas to the cache.
+
+        Returns the files which could not be fetched.
+        """
+        if not cache.is_active():
+            raise IpkgException('Cannot fetch sources: %s is not set' %
+                                cache.ENVVAR_NAME)
+        return fetch_sources(self, workers)
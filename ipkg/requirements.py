@@ -17,11 +17,10 @@ import re
 import operator
 from collections import defaultdict
 
-import pkg_resources as pkgres
-
 from .exceptions import IpkgException
 from .platforms import Platform, InvalidPlatform
 from .compat import basestring
+from . import versions
 
 
 class InvalidRequirement(IpkgException):
@@ -109,7 +108,7 @@ class Requirement(object):
 
     def satisfied_by_version(self, version):
         if isinstance(version, basestring):
-            version = pkgres.parse_version(version)
+            version = versions.parse(version)
         return all(op(version, v) for op, v in self.versions)
 
     def satisfied_by(self, obj):
@@ -176,7 +175,7 @@ def parse_version(version_string):
         raise InvalidRequirementVersionOperator(version_dict['operator'])
 
     return OPERATORS[version_dict['operator']], \
-        pkgres.parse_version(version_dict['version'])
+        versions.parse(version_dict['version'])
 
 
 def parse(requirement):
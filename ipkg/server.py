@@ -0,0 +1,301 @@
+"""HTTP server for package repositories.
+
+Serves the files of a ``LocalPackageRepository`` directory:
+
+* package files are sent with ``sendfile`` when available, which needs
+  ``pysendfile`` on Python 2 (the ``server`` extra); they are copied
+  through user space otherwise,
+* ``Range`` requests and ``ETag`` validation are supported,
+* ``repository.json`` is kept in memory, compressed once, and reloaded
+  when it changes on disk (e.g. after ``ipkg mkrepo``),
+* ``/_batch?names=foo,bar`` returns the meta data of several packages in
+  a single request.
+"""
+import os
+import gzip
+import json
+import socket
+import logging
+import posixpath
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urllib import unquote
+from urlparse import urlparse, parse_qs
+
+try:
+    sendfile = os.sendfile
+except AttributeError:  # Python 2
+    try:
+        from sendfile import sendfile  # pysendfile
+    except ImportError:
+        sendfile = None
+
+from .exceptions import IpkgException
+from .compat import StringIO
+from .repositories import PackageRepository
+
+
+LOGGER = logging.getLogger(__name__)
+INDEX_FILE = PackageRepository.META_FILE_NAME
+BATCH_PATH = '/_batch'
+CHUNK_SIZE = 1024 * 1024
+
+
+def make_etag(stat):
+    return '"%x-%x-%x"' % (stat.st_ino, stat.st_size,
+                           int(stat.st_mtime * 1000))
+
+
+def parse_range(header, size):
+    """Parse a ``Range`` header.
+
+    Returns ``(start, end)``, ``end`` included, or ``None`` if the whole
+    content must be sent. Raises ``ValueError`` if the range cannot be
+    satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        # Multiple ranges are not supported
+        return None
+
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else size - 1
+        else:
+            # Last bytes
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise ValueError(header)
+
+    return start, min(end, size - 1)
+
+
+class RepositoryIndex(object):
+    """The repository meta data file, cached in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__stat = None
+        self.__lock = threading.Lock()
+        self.content = self.compressed = self.etag = None
+        self.meta = {}
+
+    def __load(self, stat):
+        with open(self.path, 'rb') as fileobj:
+            content = fileobj.read()
+        meta = json.loads(content)
+        compressed = StringIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gz:
+            gz.write(content)
+        self.content, self.compressed = content, compressed.getvalue()
+        self.meta, self.etag = meta, make_etag(stat)
+        LOGGER.info('Loaded %s', self.path)
+
+    def refresh(self):
+        """Reload the meta data file if it changed.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # Being rewritten by mkrepo?
+            return
+        key = (stat.st_ino, stat.st_size, stat.st_mtime)
+        with self.__lock:
+            if key != self.__stat:
+                try:
+                    self.__load(stat)
+                except (IOError, ValueError) as exception:
+                    LOGGER.warning('Cannot load %s: %s', self.path, exception)
+                else:
+                    self.__stat = key
+
+
+class RepositoryRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = 'ipkg'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        LOGGER.info('%s %s', self.address_string(), format % args)
+
+    def do_GET(self):
+        self.__handle(send_body=True)
+
+    def do_HEAD(self):
+        self.__handle(send_body=False)
+
+    def __handle(self, send_body):
+        url = urlparse(self.path)
+        path = posixpath.normpath(unquote(url.path)).lstrip('/')
+
+        if url.path == BATCH_PATH:
+            self.__send_batch(parse_qs(url.query), send_body)
+        elif path == INDEX_FILE:
+            self.__send_index(send_body)
+        else:
+            self.__send_file(path, send_body)
+
+    def __send_error(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def __not_modified(self, etag):
+        """Send a 304 response if the client has this version.
+        """
+        if etag in self.headers.get('If-None-Match', '').split(', '):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return True
+        return False
+
+    def __send_headers(self, size, etag, content_type, encoding=None):
+        """Send response headers, and returns the range of content to
+           send, or ``None`` if the request is invalid.
+        """
+        try:
+            content_range = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        if content_range is None:
+            start, end = 0, size - 1
+            self.send_response(200)
+        else:
+            start, end = content_range
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, size))
+
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return start, end
+
+    def __send_content(self, content, etag, content_type, send_body,
+                       encoding=None):
+        if self.__not_modified(etag):
+            return
+        content_range = self.__send_headers(len(content), etag,
+                                            content_type, encoding)
+        if content_range is not None and send_body:
+            start, end = content_range
+            self.wfile.write(content[start:end + 1])
+
+    def __send_index(self, send_body):
+        index = self.server.index
+        index.refresh()
+        if index.content is None:
+            return self.__send_error(404)
+
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        if 'gzip' in accept_encoding and not self.headers.get('Range'):
+            self.__send_content(index.compressed, index.etag[:-1] + '-gz"',
+                                'application/json', send_body, 'gzip')
+        else:
+            self.__send_content(index.content, index.etag,
+                                'application/json', send_body)
+
+    def __send_batch(self, query, send_body):
+        index = self.server.index
+        index.refresh()
+        names = set()
+        for value in query.get('names', ()):
+            names.update(name for name in value.split(',') if name)
+        result = dict((name, index.meta[name]) for name in names
+                      if name in index.meta)
+        content = json.dumps(result)
+        self.__send_content(content, '"%x"' % hash(content),
+                            'application/json', send_body)
+
+    def __send_file(self, path, send_body):
+        root = self.server.root
+        filepath = os.path.realpath(os.path.join(root, path))
+        if not filepath.startswith(root + os.sep) or \
+                not os.path.isfile(filepath):
+            return self.__send_error(404)
+
+        with open(filepath, 'rb') as fileobj:
+            stat = os.fstat(fileobj.fileno())
+            etag = make_etag(stat)
+            if self.__not_modified(etag):
+                return
+            content_range = self.__send_headers(stat.st_size, etag,
+                                                'application/octet-stream')
+            if content_range is not None and send_body:
+                start, end = content_range
+                self.__copy(fileobj, start, end - start + 1)
+
+    def __copy(self, fileobj, offset, count):
+        """Send ``count`` bytes of ``fileobj`` from ``offset``.
+        """
+        self.wfile.flush()
+
+        if sendfile is not None:
+            socket_fd = self.connection.fileno()
+            while count > 0:
+                sent = sendfile(socket_fd, fileobj.fileno(), offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+
+        else:
+            fileobj.seek(offset)
+            while count > 0:
+                data = fileobj.read(min(count, CHUNK_SIZE))
+                if not data:
+                    break
+                self.wfile.write(data)
+                count -= len(data)
+
+
+class RepositoryServer(ThreadingMixIn, HTTPServer):
+    """Serves the package repository at ``root``.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    handler_class = RepositoryRequestHandler
+
+    def __init__(self, root, address=('127.0.0.1', 8000)):
+        self.root = os.path.realpath(root)
+        self.index = RepositoryIndex(os.path.join(self.root, INDEX_FILE))
+        HTTPServer.__init__(self, address, self.handler_class)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+
+def serve(root, host='127.0.0.1', port=8000):
+    """Serve the package repository at ``root`` until interrupted.
+    """
+    try:
+        server = RepositoryServer(root, (host, port))
+    except socket.error as exception:
+        raise IpkgException('Cannot listen on %s:%d: %s' %
+                            (host, port, exception))
+    LOGGER.info('Serving %s on %s', root, server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -3,19 +3,25 @@ import sys
 import json
 import logging
 import subprocess
-import tarfile
-import zipfile
 import errno
 import shlex
+import threading
+from collections import OrderedDict
 
 from .files import vopen
 from .exceptions import IpkgException, InvalidPackage
 from .compat import basestring, StringIO
 from .regex import PACKAGE_SPEC
+from . import metrics
 
 
 LOGGER = logging.getLogger(__name__)
 PIPE = subprocess.PIPE
+# Parsed package specs, by spec string, least recently used first
+PACKAGE_SPECS = OrderedDict()
+PACKAGE_SPECS_LOCK = threading.Lock()
+# Maximum count of parsed package specs kept in PACKAGE_SPECS
+PACKAGE_SPECS_SIZE = 1024
 
 
 class ExecutionFailed(IpkgException):
@@ -62,14 +68,15 @@ class DictFile(dict):
     def reload(self):
         if os.path.isfile(self.__file_path):
             LOGGER.debug('Loading %s', self.__file_path)
-            raw = vopen(self.__file_path).read()
-            if raw:
-                try:
-                    data = json.loads(raw)
-                except ValueError:
-                    raise InvalidDictFileContent(self.__file_path)
-                else:
-                    self.update(data)
+            with metrics.timer('dictfile.load.seconds'):
+                raw = vopen(self.__file_path).read()
+                if raw:
+                    try:
+                        data = json.loads(raw)
+                    except ValueError:
+                        raise InvalidDictFileContent(self.__file_path)
+                    else:
+                        self.update(data)
 
     def clear(self):
         """Force the dictionary to be empty.
@@ -81,8 +88,9 @@ class DictFile(dict):
     def save(self):
         LOGGER.debug('Writing %s', self.__file_path)
         # This will break if trying to call save() on a remote DictFile
-        with open(self.__file_path, 'w') as f:
-            json.dump(self, f, indent=4)
+        with metrics.timer('dictfile.save.seconds'):
+            with open(self.__file_path, 'w') as f:
+                json.dump(self, f, indent=4)
 
 
 def execute(command,
@@ -172,14 +180,51 @@ def make_package_spec(obj):
     raise InvalidPackage(obj)
 
 
+def make_package_key(obj):
+    """Returns the ``(name, version, revision, platform)`` tuple which
+       identifies a package.
+
+       Accepts package-like objects and dicts. ``revision`` is always a
+       string and ``platform`` is ``None`` when undefined.
+    """
+    if isinstance(obj, dict):
+        if 'name' not in obj:
+            raise InvalidPackage(obj)
+        name = obj['name']
+        version = obj.get('version')
+        revision = obj.get('revision')
+        platform = obj.get('platform')
+
+    elif is_package_like(obj):
+        name, version, revision = obj.name, obj.version, obj.revision
+        platform = obj.platform if hasattr(obj, 'platform') else None
+
+    else:
+        raise InvalidPackage(obj)
+
+    return (name, version,
+            None if revision is None else str(revision),
+            str(platform) if platform else None)
+
+
 def parse_package_spec(spec):
     """Parse a package ``spec``.
+
+    Results are cached, as the same specs are parsed over and over when
+    comparing packages. The cache keeps the ``PACKAGE_SPECS_SIZE`` most
+    recently used specs, and each call returns a new dictionary.
     """
-    match = PACKAGE_SPEC.match(spec)
-    if match:
-        return match.groupdict()
-    else:
-        raise InvalidPackage(spec)
+    with PACKAGE_SPECS_LOCK:
+        parsed = PACKAGE_SPECS.pop(spec, None)
+        if parsed is None:
+            match = PACKAGE_SPEC.match(spec)
+            if not match:
+                raise InvalidPackage(spec)
+            parsed = match.groupdict()
+            if len(PACKAGE_SPECS) >= PACKAGE_SPECS_SIZE:
+                PACKAGE_SPECS.popitem(last=False)
+        PACKAGE_SPECS[spec] = parsed
+    return dict(parsed)
 
 
 def which(command):
@@ -196,6 +241,10 @@ def unarchive(fileobj, target):
 
     Supports: tar.bz2, tar.gz, tar.xz, zip
     """
+    # Imported here to keep ipkg startup fast
+    import tarfile
+    import zipfile
+
     LOGGER.debug('unarchive(%r, %r)', fileobj, target)
 
     filename = fileobj.name
@@ -234,6 +283,47 @@ def unarchive(fileobj, target):
     return os.path.join(target, root_items.pop())
 
 
+def parallel_map(func, items, workers=8):
+    """Like ``map(func, items)``, but runs ``func`` concurrently in up to
+       ``workers`` threads.
+
+    Results are returned in ``items`` order. If a call fails, the first
+    exception is raised once all threads are done.
+    """
+    items = list(items)
+    workers = min(workers, len(items))
+
+    if workers < 2:
+        return map(func, items)
+
+    results = [None] * len(items)
+    errors = []
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(indexes, None)
+            if index is None or errors:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception as exception:
+                errors.append(exception)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
+
+
 def mkdir(directory, fail_if_it_exist=True):
     """Create a directory"""
     LOGGER.debug('Creating directory %s', directory)
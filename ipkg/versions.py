@@ -1,7 +1,5 @@
 import __builtin__  # because we override sorted in this module
 
-import pkg_resources
-
 
 def compare(a, b):
     if a < b:
@@ -27,8 +25,12 @@ def parse(version):
 
     Currently a simple wrapper around ``pkg_resources.parse_version()``,
     for API purpose. Parsing could change later.
+
+    ``pkg_resources`` is slow to import, so it is only imported when
+    versions are actually parsed.
     """
-    return pkg_resources.parse_version(version)
+    from pkg_resources import parse_version
+    return parse_version(version)
 
 
 def sorted(versions, parser=parse, reverse=False):
@@ -0,0 +1,302 @@
+"""Build workspaces.
+
+Formulas are built in a directory created for each build, in memory
+(``/dev/shm``) when the build is expected to fit, or on disk otherwise.
+The ``IPKG_BUILD_WORKSPACE`` environment variable selects the backend:
+``auto`` (default), ``memory`` or ``disk``.
+
+The size of a build is estimated from the size of the sources archive, or
+from the size of the earlier builds of the formula, recorded in the cache.
+
+Workspaces are locked until they are removed, so that stale workspaces of
+other builds can be removed without removing the ones still in use.
+"""
+import os
+import time
+import errno
+import shutil
+import logging
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .exceptions import IpkgException
+from .files import cache
+from .utils import mkdir
+
+
+LOGGER = logging.getLogger(__name__)
+#: Environment variable selecting the workspace backend
+BACKEND_ENVVAR = 'IPKG_BUILD_WORKSPACE'
+BACKENDS = ('auto', 'memory', 'disk')
+#: Environment variable defining the directory of in-memory workspaces
+MEMORY_DIR_ENVVAR = 'IPKG_BUILD_MEMORY_DIR'
+DEFAULT_MEMORY_DIR = '/dev/shm'
+#: Environment variable defining how many megabytes of disk space builds
+#: must leave free
+MIN_FREE_ENVVAR = 'IPKG_BUILD_MIN_FREE'
+DEFAULT_MIN_FREE = 512
+#: Part of the available memory a build can use
+MEMORY_RATIO = 0.5
+#: Extracted sources and objects size, compared to the archive size
+EXPANSION_RATIO = 10
+#: Build directories left by other builds are removed after this many
+#: seconds
+STALE_AGE = 24 * 3600
+#: Directory of the recorded build sizes, in the cache directory
+SIZES_DIR = 'workspaces'
+PREFIX = 'ipkg-build-'
+#: Lock file of the workspaces, locked while they are used
+LOCK_FILE = '.ipkg-lock'
+# Open lock files of the workspaces created by this process, by path
+LOCKS = {}
+
+
+class WorkspaceException(IpkgException):
+    """Cannot create a build workspace."""
+
+
+def get_backend():
+    backend = os.environ.get(BACKEND_ENVVAR) or 'auto'
+    if backend not in BACKENDS:
+        raise WorkspaceException('Invalid %s: %s' % (BACKEND_ENVVAR,
+                                                     backend))
+    return backend
+
+
+def get_min_free():
+    """Returns the disk space builds must leave free, in bytes.
+    """
+    value = os.environ.get(MIN_FREE_ENVVAR)
+    if not value:
+        return DEFAULT_MIN_FREE * 1024 * 1024
+    try:
+        return int(value) * 1024 * 1024
+    except ValueError:
+        raise WorkspaceException('Invalid %s: %s' % (MIN_FREE_ENVVAR, value))
+
+
+def get_free_space(directory):
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_available_memory():
+    """Returns the memory available without swapping, in bytes, or
+       ``None`` if unknown.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+
+
+def get_size(directory):
+    """Returns the size of the files in ``directory``, in bytes.
+    """
+    size = 0
+    for parent, _, files in os.walk(directory):
+        for filename in files:
+            try:
+                size += os.lstat(os.path.join(parent, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def get_sizes_dir():
+    if cache.is_active():
+        sizes_dir = os.path.join(cache.get_cache_dir(), SIZES_DIR)
+        mkdir(sizes_dir, False)
+        return sizes_dir
+
+
+def get_recorded_size(name):
+    """Returns the size of the last build of formula ``name``, or
+       ``None``.
+    """
+    sizes_dir = get_sizes_dir()
+    if sizes_dir is not None:
+        try:
+            with open(os.path.join(sizes_dir, name)) as size_file:
+                return int(size_file.read())
+        except (IOError, ValueError):
+            pass
+
+
+def record_size(name, size):
+    """Record the build size of formula ``name``, if the cache is active.
+    """
+    sizes_dir = get_sizes_dir()
+    if sizes_dir is not None:
+        fd, tmp_path = tempfile.mkstemp(dir=sizes_dir)
+        with os.fdopen(fd, 'w') as size_file:
+            size_file.write(str(size))
+        os.rename(tmp_path, os.path.join(sizes_dir, name))
+
+
+def estimate_size(name, archive_size):
+    """Returns the expected size of a build of formula ``name``, whose
+       sources archive is ``archive_size`` bytes.
+    """
+    recorded = get_recorded_size(name)
+    if recorded is not None:
+        return recorded
+    return archive_size * EXPANSION_RATIO
+
+
+def lock(path):
+    """Lock the workspace at ``path`` until it is removed.
+    """
+    lock_file = open(os.path.join(path, LOCK_FILE), 'w')
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    LOCKS[path] = lock_file
+
+
+def is_locked(path):
+    """Returns true if the workspace at ``path`` is locked by a build.
+    """
+    if fcntl is None:
+        return False
+    try:
+        lock_file = open(os.path.join(path, LOCK_FILE))
+    except IOError:
+        return False
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as exception:
+        if exception.errno in (errno.EAGAIN, errno.EACCES):
+            return True
+        raise
+    finally:
+        lock_file.close()
+    return False
+
+
+def remove_stale(root):
+    """Remove the build directories of ``root`` not modified since
+       ``STALE_AGE`` seconds, and returns how many were removed.
+
+    Directories locked by a build are kept.
+    """
+    removed = 0
+    limit = time.time() - STALE_AGE
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            continue
+        if stat.st_mtime < limit and stat.st_uid == os.getuid():
+            if is_locked(path):
+                LOGGER.debug('Build directory in use: %s', path)
+                continue
+            LOGGER.info('Removing stale build directory: %s', path)
+            remove(path)
+            removed += 1
+    return removed
+
+
+def get_memory_dir():
+    """Returns the directory of in memory builds, or ``None`` if it is not
+       usable.
+    """
+    memory_dir = os.environ.get(MEMORY_DIR_ENVVAR) or DEFAULT_MEMORY_DIR
+    if os.path.isdir(memory_dir) and os.access(memory_dir, os.W_OK):
+        return memory_dir
+
+
+def fits_in_memory(memory_dir, size):
+    available = get_free_space(memory_dir)
+    memory = get_available_memory()
+    if memory is not None:
+        # tmpfs files use memory, even if the filesystem is larger
+        available = min(available, memory)
+    return size <= available * MEMORY_RATIO
+
+
+def get_root(size):
+    """Returns ``(backend, directory)``, the directory in which a build
+       of ``size`` bytes must be created.
+
+    Raises ``WorkspaceException`` if there is not enough disk space, even
+    after removing stale build directories.
+    """
+    backend = get_backend()
+    if backend != 'disk':
+        memory_dir = get_memory_dir()
+        if memory_dir is not None:
+            if fits_in_memory(memory_dir, size) or \
+                    remove_stale(memory_dir) and \
+                    fits_in_memory(memory_dir, size):
+                return 'memory', memory_dir
+        if backend == 'memory':
+            LOGGER.warning('Build does not fit in memory, using disk')
+
+    disk_dir = tempfile.gettempdir()
+    needed = size + get_min_free()
+    free = get_free_space(disk_dir)
+    if free < needed and remove_stale(disk_dir):
+        free = get_free_space(disk_dir)
+    if free < needed:
+        raise WorkspaceException(
+            'Not enough space in %s: %d MB free, %d MB needed' %
+            (disk_dir, free / 1024 / 1024, needed / 1024 / 1024))
+    return 'disk', disk_dir
+
+
+def create(size, key=None):
+    """Create a build directory for ``size`` bytes, and returns
+       ``(backend, path)``.
+
+    If ``key`` is given, the path only depends on it: in memory builds
+    are linked from the temporary directory. ``None`` is returned as path
+    if it already exists.
+    """
+    backend, root = get_root(size)
+    if key is None:
+        path = tempfile.mkdtemp(prefix=PREFIX, dir=root)
+        lock(path)
+        return backend, path
+
+    name = PREFIX + key
+    path = os.path.join(tempfile.gettempdir(), name)
+    if os.path.lexists(path):
+        return backend, None
+    target = os.path.join(root, name)
+    try:
+        os.mkdir(target, 0700)
+    except OSError:
+        return backend, None
+    if target != path:
+        try:
+            os.symlink(target, path)
+        except OSError:
+            # Created meanwhile by another build
+            os.rmdir(target)
+            return backend, None
+    lock(path)
+    return backend, path
+
+
+def remove(path):
+    """Remove a build directory, and the in memory directory it links to.
+    """
+    LOGGER.debug('Removing build directory: %s', path)
+    lock_file = LOCKS.pop(path, None)
+    if os.path.islink(path):
+        target = os.readlink(path)
+        os.unlink(path)
+        path = target
+    shutil.rmtree(path, ignore_errors=True)
+    if lock_file is not None:
+        lock_file.close()
@@ -10,8 +10,10 @@ setup(
     author='Philippe Muller',
     url='http://ipkg.org',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=('benchmarks',)),
     install_requires=('requests>=2.0.0',),
+    extras_require={'async': ('trollius', 'futures'),
+                    'server': ('pysendfile',)},
     entry_points="""
 
         [console_scripts]
@@ -0,0 +1,106 @@
+import os
+import sys
+from os.path import join, exists
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from ipkg.activation import make, apply, load, write, ACTIVATION_FILE
+from ipkg.environments import EnvironmentDirectories, Environment
+
+
+class TestApply(TestCase):
+
+    def setUp(self):
+        self.activation = make(EnvironmentDirectories('/foo'),
+                               [{'BAR': '%(prefix)s/bar'}])
+        self.environ = os.environ.copy()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_paths(self):
+        environ = apply(self.activation, {'PATH': '/bin:/foo/bin'})
+        self.assertEqual(environ['PATH'], '/foo/sbin:/foo/bin:/bin')
+        self.assertEqual(environ['MANPATH'],
+                         '/foo/share/man:/usr/share/man')
+
+    def test_variables(self):
+        environ = apply(self.activation, {'BAR': '1'})
+        self.assertEqual(environ['IPKG_ENVIRONMENT'], '/foo')
+        self.assertEqual(environ['BAR'], '/foo/bar')
+
+    def test_home(self):
+        # HOME is the one of the ipkg process, like environment variables
+        os.environ['HOME'] = '/home/foo'
+        self.assertEqual(apply(self.activation, {'HOME': '/'})['HOME'],
+                         '/home/foo')
+        del os.environ['HOME']
+        self.assertEqual(apply(self.activation, {'HOME': '/home/bar'})['HOME'],
+                         '/')
+
+    def test_package_variables_last(self):
+        activation = make(EnvironmentDirectories('/foo'),
+                          [{'PATH': '%(bin)s', 'TMPDIR': '/tmp'}])
+        environ = apply(activation, {'PATH': '/bin'})
+        self.assertEqual(environ['PATH'], '/foo/bin')
+        self.assertEqual(environ['TMPDIR'], '/tmp')
+
+
+class TestLoad(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_missing(self):
+        self.assertEqual(load(self.tmpdir), None)
+
+    def test(self):
+        activation = make(EnvironmentDirectories(self.tmpdir))
+        write(self.tmpdir, activation)
+        self.assertEqual(load(self.tmpdir)['prefix'], self.tmpdir)
+
+    def test_moved(self):
+        write(self.tmpdir, make(EnvironmentDirectories('/foo')))
+        self.assertEqual(load(self.tmpdir), None)
+
+    def test_previous_version(self):
+        activation = make(EnvironmentDirectories(self.tmpdir))
+        del activation['envvars']
+        write(self.tmpdir, activation)
+        self.assertEqual(load(self.tmpdir), None)
+
+
+class TestExecute(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.prefix = join(self.tmpdir, 'env')
+        environment = Environment(self.prefix)
+        environment.directories.create()
+        environment.write_activation()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def _execute(self):
+        code = 'import sys; from ipkg.activation import execute; ' \
+               'execute(sys.argv[1], ["sh", "-c", "echo $IPKG_ENVIRONMENT"])'
+        process = Popen([sys.executable, '-c', code, self.prefix],
+                        stdout=PIPE)
+        return process.communicate()[0]
+
+    def test(self):
+        self.assertTrue(exists(join(self.prefix, ACTIVATION_FILE)))
+        self.assertEqual(self._execute(), self.prefix + '\n')
+
+    def test_without_activation_file(self):
+        rmtree(self.prefix)
+        Environment(self.prefix).directories.create()
+        self.assertEqual(self._execute(), self.prefix + '\n')
+        self.assertTrue(exists(join(self.prefix, ACTIVATION_FILE)))
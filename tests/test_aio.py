@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+from unittest import TestCase
+from os.path import join, dirname, isfile
+
+from ipkg import aio
+from ipkg.environments import Environment
+from ipkg.repositories import PackageRepository
+
+
+PACKAGE_DIR = join(dirname(__file__), 'data', 'packages')
+
+
+class TestAio(TestCase):
+
+    def setUp(self):
+        if aio.asyncio is None:
+            self.skipTest('asyncio is not available')
+        self.loop = aio.asyncio.new_event_loop()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.tmpdir)
+
+    def run_until_complete(self, *futures):
+        return self.loop.run_until_complete(
+            aio.asyncio.gather(*futures, loop=self.loop))
+
+    def test_vopen(self):
+        filepath = join(PACKAGE_DIR, 'repository.json')
+        fileobj, = self.run_until_complete(aio.vopen(filepath,
+                                                     loop=self.loop))
+        self.assertEqual(fileobj.read(), open(filepath).read())
+
+    def test_find(self):
+        repository = PackageRepository(PACKAGE_DIR)
+        packages, = self.run_until_complete(
+            repository.find_async('foo', loop=self.loop))
+        self.assertEqual(packages[0].name, 'foo')
+
+    def test_install(self):
+        repository = PackageRepository(PACKAGE_DIR)
+        environments = [Environment(join(self.tmpdir, str(index)))
+                        for index in range(10)]
+        futures = []
+        for environment in environments:
+            environment.directories.create()
+            for name in ('foo', 'bar'):
+                futures.append(environment.install_async(name, repository,
+                                                         loop=self.loop))
+        self.run_until_complete(*futures)
+
+        for environment in environments:
+            reloaded = Environment(environment.prefix)
+            self.assertEqual(sorted(p.name for p in reloaded.packages),
+                             ['bar', 'foo'])
+            self.assertTrue(isfile(join(environment.prefix, 'foo.README')))
@@ -0,0 +1,35 @@
+from unittest import TestCase
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from benchmarks.synthetic import Graph, ROOT
+from benchmarks.solver import run
+
+
+class TestGraph(TestCase):
+
+    def test(self):
+        graph = Graph(size=12, depth=3, fanout=2, versions=2)
+        self.assertEqual(len(graph.dependencies), 13)
+        self.assertEqual(len(graph.dependencies[ROOT]), 4)
+        self.assertEqual(len(list(graph)), 25)
+
+
+class TestRun(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test(self):
+        results = run(Graph(size=12, depth=3, fanout=2), self.tmpdir, 1)
+        self.assertEqual(results['package_repository.stats']['nodes'], 13)
+        self.assertTrue('best' in results['environment.install'])
+
+    def test_loops(self):
+        results = run(Graph(size=12, depth=3, fanout=2, loops=1),
+                      self.tmpdir, 1)
+        self.assertEqual(results['package_repository.solve'],
+                         'DependencyLoop')
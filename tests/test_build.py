@@ -1,12 +1,16 @@
+import os
 from unittest import TestCase
-from os.path import isdir, join, dirname, exists
+from os.path import isdir, join, dirname, exists, isfile, basename
 from shutil import rmtree
 from tempfile import mkdtemp
 from tarfile import open as taropen
 import json
 
 from ipkg.repositories import PackageRepository
-from ipkg.build import Formula
+from ipkg.build import Formula, File, LazyFormula, find_files, \
+    inspect_formula_file, fetch_sources, load_module, BUILD_CACHE_DIR
+from ipkg.environments import Environment
+from ipkg.files import cache
 
 
 DATA_DIR = join(dirname(__file__), 'data')
@@ -35,6 +39,133 @@ class TestFormula(TestCase):
         f = taropen(package_file)
         meta = json.load(f.extractfile('.ipkg.meta'))
         self.assertEqual(meta['name'], 'foo')
+        self.assertEqual(meta['build_key'], formula.get_build_key())
+
+    def test_build_stats(self):
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+        formula = formula_cls()
+        package_file = formula.build(self.tmpdir)
+        meta = json.load(taropen(package_file).extractfile('.ipkg.meta'))
+        build_stats = meta['build_stats']
+        phases = build_stats['phases']
+        for phase in ('dependencies', 'fetch', 'unarchive', 'install', 'cp',
+                      'files'):
+            self.assertTrue(phase in phases, phase)
+        command = build_stats['commands'][0]
+        self.assertTrue(command['command'].startswith('cp README'))
+        self.assertTrue('cpu_user' in command)
+        self.assertTrue('package' in formula.build_stats['phases'])
+        self.assertTrue(formula.build_stats['seconds'] > 0)
+        self.assertTrue(build_stats['workspace']['backend'] in
+                        ('memory', 'disk'))
+        self.assertTrue(build_stats['workspace']['size'] > 0)
+
+    def test_build_reproducible(self):
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+
+        class foo(formula_cls):
+            reproducible = True
+
+        package_files = []
+        for name in ('a', 'b'):
+            package_dir = join(self.tmpdir, name)
+            os.mkdir(package_dir)
+            package_files.append(foo().build(package_dir))
+        contents = [open(path, 'rb').read() for path in package_files]
+        self.assertEqual(contents[0], contents[1])
+
+        package = taropen(package_files[0])
+        meta = json.load(package.extractfile('.ipkg.meta'))
+        self.assertFalse('timestamp' in meta)
+        self.assertEqual(package.getmember('foo.README').mtime, 0)
+        build_info = json.load(open(package_files[0] + '.build.json'))
+        self.assertEqual(build_info['build_prefix'], meta['build_prefix'])
+
+    def test_build_not_reproducible(self):
+        # The default
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+        package_file = formula_cls().build(self.tmpdir)
+        meta = json.load(taropen(package_file).extractfile('.ipkg.meta'))
+        self.assertTrue('hostname' in meta)
+        self.assertTrue('timestamp' in meta)
+        self.assertTrue('build_stats' in meta)
+        self.assertFalse(exists(package_file + '.build.json'))
+
+    def test_build_key(self):
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+        key = formula_cls().get_build_key()
+        self.assertEqual(formula_cls().get_build_key(), key)
+
+        class foo(formula_cls):
+            build_envvars = {'CFLAGS': '-O3'}
+
+        self.assertNotEqual(foo().get_build_key(), key)
+
+    def test_build_key_dependencies(self):
+        formula_cls = Formula.from_file(
+            join(FORMULA_DIR, 'foo-bar/foo-bar-1.0.py'))
+        key = formula_cls().get_build_key()
+        repository = PackageRepository(PACKAGE_DIR)
+        self.assertNotEqual(formula_cls().get_build_key(repository), key)
+
+    def test_build_cache(self):
+        environ = os.environ.copy()
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        try:
+            formula_cls = Formula.from_file(join(FORMULA_DIR,
+                                                 'foo/foo-1.0.py'))
+            package_dir = join(self.tmpdir, 'packages')
+            os.mkdir(package_dir)
+            formula_cls().build(package_dir)
+
+            class foo(formula_cls):
+                def install(self):
+                    raise AssertionError('Should not be built')
+
+            package_file = foo().build(self.tmpdir)
+            self.assertTrue(isfile(package_file))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_build_cache_miss(self):
+        environ = os.environ.copy()
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        try:
+            formula_cls = Formula.from_file(join(FORMULA_DIR,
+                                                 'foo/foo-1.0.py'))
+            formula = formula_cls()
+            # The cached build directory does not contain the package
+            cache_dir = join(self.tmpdir, BUILD_CACHE_DIR,
+                             formula.get_build_key())
+            os.makedirs(cache_dir)
+            open(join(cache_dir, 'foo-0.1-1-any.ipkg'), 'w').close()
+
+            package_dir = join(self.tmpdir, 'packages')
+            os.mkdir(package_dir)
+            package_file = formula.build(package_dir)
+            self.assertEqual(basename(package_file), 'foo-1.0-1-any.ipkg')
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             ['foo-0.1-1-any.ipkg', 'foo-1.0-1-any.ipkg'])
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_build_staged(self):
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+        environment = Environment(join(self.tmpdir, 'env'))
+        environment.directories.create()
+
+        class foo(formula_cls):
+            staged_install = True
+            def install(self):
+                self.run_mkdir(['-p', self.stage_prefix + '/share/foo'])
+                self.run_cp(['README', self.stage_prefix + '/share/foo'])
+
+        package_file = foo(environment).build(self.tmpdir)
+        names = taropen(package_file).getnames()
+        self.assertTrue('share/foo/README' in names)
+        self.assertFalse(exists(join(environment.prefix, 'share/foo')))
 
     # FIXME: This test works on my mac, 
     # but fails on travis because there are no linux packages in the test data
@@ -47,3 +178,105 @@ class TestFormula(TestCase):
 #        f = taropen(package_file)
 #        meta = json.load(f.extractfile('.ipkg.meta'))
 #        self.assertEqual(meta['name'], 'foo-bar')
+
+
+class TestLazyFormula(TestCase):
+
+    def test_inspect_formula_file(self):
+        meta = inspect_formula_file(join(FORMULA_DIR, 'two/two-1.6.py'))
+        self.assertEqual(meta, {'name': 'two', 'version': '1.6',
+                                'revision': 1, 'platform': 'any',
+                                'dependencies': ('four < 2.0', 'five')})
+
+    def test_inspect_formula_file_not_literal(self):
+        tmpdir = mkdtemp()
+        try:
+            formula_file = join(tmpdir, 'foo-1.0.py')
+            with open(formula_file, 'w') as fileobj:
+                fileobj.write('from ipkg.build import Formula\n'
+                              'class foo(Formula):\n'
+                              '    name = "foo"\n'
+                              '    version = "1." + "0"\n')
+            self.assertEqual(inspect_formula_file(formula_file), None)
+        finally:
+            rmtree(tmpdir)
+
+    def test_load(self):
+        formula = LazyFormula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+        self.assertTrue(isinstance(formula, LazyFormula))
+        self.assertEqual((formula.name, formula.version), ('foo', '1.0'))
+        self.assertTrue(isinstance(formula(), Formula))
+        self.assertTrue(isinstance(formula.sources, File))
+
+    def test_bytecode_cache(self):
+        environ = os.environ.copy()
+        tmpdir = mkdtemp()
+        os.environ[cache.ENVVAR_NAME] = tmpdir
+        try:
+            formula_file = join(FORMULA_DIR, 'foo/foo-1.0.py')
+            Formula.from_file(formula_file)
+            self.assertEqual(len(os.listdir(join(tmpdir, 'formulas'))), 1)
+            formula_cls = Formula.from_file(formula_file)
+            # __file__ is the formula file, not the bytecode file
+            self.assertTrue(isfile(formula_cls.sources.url))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            rmtree(tmpdir)
+
+    def test_bytecode_cache_syntax_error(self):
+        environ = os.environ.copy()
+        tmpdir = mkdtemp()
+        os.environ[cache.ENVVAR_NAME] = tmpdir
+        try:
+            formula_file = join(tmpdir, 'foo-1.0.py')
+            with open(formula_file, 'w') as fileobj:
+                fileobj.write('class foo(\n')
+            self.assertRaises(ImportError, load_module, 'foo', formula_file)
+            # No partial bytecode file is left
+            self.assertEqual(os.listdir(join(tmpdir, 'formulas')), [])
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            rmtree(tmpdir)
+
+
+class TestFindFiles(TestCase):
+
+    def test(self):
+        tmpdir = mkdtemp()
+        try:
+            os.makedirs(join(tmpdir, 'a', 'b'))
+            open(join(tmpdir, 'a', 'b', 'c'), 'w').close()
+            open(join(tmpdir, 'd'), 'w').close()
+            os.symlink('a', join(tmpdir, 'e'))
+            os.symlink('missing', join(tmpdir, 'f'))
+            self.assertEqual(sorted(find_files(tmpdir)),
+                             ['a/b/c', 'd', 'f'])
+            # Staged installs also package symlinks to directories
+            self.assertEqual(sorted(find_files(tmpdir, True)),
+                             ['a/b/c', 'd', 'e', 'f'])
+        finally:
+            rmtree(tmpdir)
+
+
+class TestFile(TestCase):
+
+    FILE = join(DATA_DIR, 'sources/foo-1.0.tar.gz')
+
+    def test_get_checksum(self):
+        self.assertEqual(File(self.FILE, md5='42').get_checksum(), 'md5:42')
+        self.assertEqual(
+            File(self.FILE).get_checksum(),
+            File(self.FILE, sha256=File(self.FILE).get_checksum()[7:])
+            .get_checksum())
+
+    def test_fetch_sources(self):
+        formula_cls = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+
+        class bar(formula_cls):
+            sources = File(self.FILE, md5='42')
+
+        self.assertEqual(fetch_sources([formula_cls]), [])
+        self.assertEqual(fetch_sources([formula_cls, bar]), [bar.sources])
+
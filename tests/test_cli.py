@@ -0,0 +1,87 @@
+import sys
+import json
+import shutil
+import tempfile
+from os.path import join, dirname, exists
+from unittest import TestCase
+from subprocess import call, Popen, PIPE
+
+
+PACKAGE_FILE = join(dirname(__file__), 'data', 'packages', 'foo',
+                    'foo-1.0-1-any.ipkg')
+FORMULA_FILE = join(dirname(__file__), 'data', 'formulas', 'foo',
+                    'foo-1.0.py')
+
+class TestLazyImports(TestCase):
+
+    def test(self):
+        # Starting ipkg must not import pkg_resources or requests
+        code = 'import sys, ipkg.cli; ipkg.cli.Environment("/nonexistent"); ' \
+               'sys.exit(bool(set(sys.modules) & ' \
+               'set(["pkg_resources", "requests", "ipkg.build"])))'
+        self.assertEqual(call([sys.executable, '-c', code]), 0)
+
+
+class TestMetricsFile(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        prefix = join(self.tmpdir, 'env')
+        metrics_file = join(self.tmpdir, 'metrics.json')
+        ipkg = [sys.executable, '-m', 'ipkg.cli']
+        self.assertEqual(call(ipkg + ['mkenv', prefix]), 0)
+        self.assertEqual(call(ipkg + ['--metrics-file', metrics_file,
+                                      'install', '-e', prefix, PACKAGE_FILE]),
+                         0)
+        metrics = json.load(open(metrics_file))
+        self.assertTrue('dictfile.save.seconds' in metrics['histograms'])
+        self.assertTrue('packages.extract.bytes' in metrics['counters'])
+
+
+class TestRepositoryMirrors(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        prefix = join(self.tmpdir, 'env')
+        ipkg = [sys.executable, '-m', 'ipkg.cli']
+        self.assertEqual(call(ipkg + ['mkenv', prefix]), 0)
+        self.assertEqual(call(ipkg + ['install', '-e', prefix,
+                                      '-r', join(self.tmpdir, 'missing'),
+                                      '-r', dirname(dirname(PACKAGE_FILE)),
+                                      'foo']), 0)
+        self.assertTrue(exists(join(prefix, 'foo.README')))
+
+
+class TestBuildProfile(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        process = Popen([sys.executable, '-m', 'ipkg.cli', 'build',
+                         '--profile', '-p', self.tmpdir, FORMULA_FILE],
+                        stdout=PIPE)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0)
+        self.assertTrue('unarchive' in output)
+        self.assertTrue('cp README' in output)
+
+    def test_reproducible(self):
+        self.assertEqual(call([sys.executable, '-m', 'ipkg.cli', 'build',
+                               '--reproducible', '-p', self.tmpdir,
+                               FORMULA_FILE]), 0)
+        self.assertTrue(exists(join(self.tmpdir,
+                                    'foo-1.0-1-any.ipkg.build.json')))
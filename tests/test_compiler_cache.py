@@ -0,0 +1,67 @@
+import os
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from ipkg.compiler_cache import CompilerCache, CompilerCacheException, \
+    get_tool, parse_stats_log, ENVVAR, STATS_LOG
+from ipkg.files import cache
+
+
+class TestCompilerCache(TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+        self.tmpdir = mkdtemp()
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        rmtree(self.tmpdir)
+
+    def test_get_tool(self):
+        os.environ[ENVVAR] = 'none'
+        self.assertEqual(get_tool(), None)
+        os.environ[ENVVAR] = 'distcc'
+        self.assertRaises(CompilerCacheException, get_tool)
+        os.environ[ENVVAR] = 'ccache'
+        os.environ['PATH'] = self.tmpdir
+        self.assertEqual(get_tool(), None)
+
+    def test_ccache_variables(self):
+        compiler_cache = CompilerCache('ccache', '/usr/bin/ccache',
+                                       self.tmpdir)
+        variables = compiler_cache.get_variables({'CC': 'gcc -m64'})
+        self.assertEqual(variables['CC'], '/usr/bin/ccache gcc -m64')
+        self.assertEqual(variables['CXX'], '/usr/bin/ccache c++')
+        self.assertEqual(variables['CCACHE_BASEDIR'],
+                         os.path.realpath(self.tmpdir))
+        self.assertTrue(variables['CCACHE_DIR'].startswith(self.tmpdir))
+        # Compilers already wrapped are kept
+        self.assertEqual(compiler_cache.get_variables(variables)['CC'],
+                         variables['CC'])
+
+    def test_ccache_basedir_link(self):
+        # In memory builds are linked from the temporary directory, but
+        # commands run in the directory itself
+        os.mkdir(join(self.tmpdir, 'build'))
+        build_dir = join(self.tmpdir, 'link')
+        os.symlink(join(self.tmpdir, 'build'), build_dir)
+        variables = CompilerCache('ccache', '/usr/bin/ccache',
+                                  build_dir).get_variables({})
+        self.assertEqual(variables['CCACHE_BASEDIR'],
+                         os.path.realpath(join(self.tmpdir, 'build')))
+
+    def test_ccache_stats(self):
+        with open(join(self.tmpdir, STATS_LOG), 'w') as stats_log:
+            stats_log.write('# foo.c\ndirect_cache_hit\n'
+                            '# bar.c\ncache_miss\n'
+                            '# baz.c\npreprocessed_cache_hit\n')
+        self.assertEqual(parse_stats_log(join(self.tmpdir, STATS_LOG)),
+                         (2, 1))
+        compiler_cache = CompilerCache('ccache', '/usr/bin/ccache',
+                                       self.tmpdir)
+        self.assertEqual(compiler_cache.get_stats(),
+                         {'tool': 'ccache', 'hits': 2, 'misses': 1})
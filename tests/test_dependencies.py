@@ -78,6 +78,28 @@ class TestSolver(TestCase):
         solver = Solver.from_obj(foobar, repositories=[repository])
         self.assertEqual(len(solver.unsatisfied), 0)
 
+    def test_from_obj__package_and_formula(self):
+        repositories = [LocalPackageRepository(PACKAGE_DIR),
+                        FormulaRepository(FORMULA_DIR)]
+        foobar = Formula.from_file(join(FORMULA_DIR,
+                                   'foo-bar/foo-bar-1.0.py'))
+        solver = Solver.from_obj(foobar, repositories=repositories)
+        # foo-1.0-1 is both a package and a formula: both are candidates
+        satisfiers = solver.requirements['foo'].satisfiers
+        self.assertEqual(sorted(type(node.obj).__name__
+                                for node in satisfiers),
+                         ['LazyFormula', 'PackageFile'])
+
+    def test_from_obj__repositories(self):
+        repositories = [LocalPackageRepository(PACKAGE_DIR),
+                        FormulaRepository(FORMULA_DIR)]
+        one = Formula.from_file(join(FORMULA_DIR, 'one/one-1.0.py'))
+        solver = Solver.from_obj(one, repositories=repositories, workers=4)
+        self.assertEqual(len(solver.unsatisfied), 0)
+        self.assertEqual(
+            [(o.name, o.version) for o in solver.find_best_dependencies(one)],
+            [('four', '1.8'), ('five', '1.0'), ('two', '1.6'), ('three', '2.0')])
+
     def test_find_best_dependencies__foo_bar(self):
         repository = FormulaRepository(FORMULA_DIR)
         foobar = Formula.from_file(join(FORMULA_DIR,
@@ -127,6 +149,18 @@ class TestSolver(TestCase):
             [(obj.name, obj.version) for obj in order],
             [('four', '1.8'), ('five', '1.0'), ('three', '2.0'), ('two', '1.6'), ('one', '1.0')])
 
+    def test_stats(self):
+        repository = FormulaRepository(FORMULA_DIR)
+        one = Formula.from_file(join(FORMULA_DIR, 'one/one-1.0.py'))
+        solver = Solver.from_obj(one, repositories=[repository])
+        solver.solve(one)
+        self.assertEqual(solver.stats['nodes'], len(solver.nodes))
+        self.assertTrue(solver.stats['edges'] > 0)
+        self.assertTrue(solver.stats['satisfied_by'] > 0)
+        self.assertTrue(solver.stats['selector'] > 0)
+        self.assertEqual(sorted(solver.timings.keys()),
+                         ['find_best_dependencies', 'from_obj', 'solve'])
+
     def test_solve__loop(self):
         repository = FormulaRepository(FORMULA_DIR)
         loop_a = Formula.from_file(join(FORMULA_DIR, 'loop-a/loop-a-1.0.py'))
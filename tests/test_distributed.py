@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import threading
+from os.path import join, dirname, abspath, isfile
+from unittest import TestCase
+from subprocess import Popen
+
+import requests
+
+from ipkg.distributed import BuildCoordinator, BuildWorker, \
+    DistributedBuildException, CLAIM_PATH, TOKEN_HEADER, TOKEN_ENVVAR
+from ipkg import workspaces
+from ipkg.repositories import LocalPackageRepository, FormulaRepository
+
+
+DATA_DIR = abspath(join(dirname(__file__), 'data'))
+FORMULA_DIR = join(DATA_DIR, 'formulas')
+TOKEN = 'secret'
+
+
+class TestDistributedBuild(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.formula_dir = join(self.tmpdir, 'formulas')
+        self.package_dir = join(self.tmpdir, 'packages')
+        os.mkdir(self.package_dir)
+        for name in ('foo', 'bar', 'foo-bar'):
+            os.makedirs(join(self.formula_dir, name))
+            filename = '%s-1.0.py' % name
+            source = open(join(FORMULA_DIR, name, filename)).read()
+            source = source.replace("dirname(__file__) + '/../..",
+                                    repr(DATA_DIR) + " + '")
+            with open(join(self.formula_dir, name, filename), 'w') as fileobj:
+                fileobj.write(source)
+
+    def start_worker(self):
+        # Build directories of killed workers are left in the test directory
+        env = dict(os.environ, TMPDIR=self.tmpdir)
+        env[workspaces.BACKEND_ENVVAR] = 'disk'
+        env[TOKEN_ENVVAR] = TOKEN
+        return Popen([sys.executable, '-m', 'ipkg.cli', 'build-worker',
+                      '--exit-when-done', '--poll-interval', '0.1', self.url],
+                     env=env, preexec_fn=os.setsid)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build(self):
+        repo = LocalPackageRepository(self.package_dir)
+        formula_repo = FormulaRepository(self.formula_dir)
+        coordinator = BuildCoordinator(repo, formula_repo,
+                                       [formula() for formula in formula_repo],
+                                       token=TOKEN)
+        env = dict(os.environ)
+        env[TOKEN_ENVVAR] = TOKEN
+        workers = [Popen([sys.executable, '-m', 'ipkg.cli', 'build-worker',
+                          '--exit-when-done', '--poll-interval', '0.1',
+                          coordinator.url], env=env) for _ in range(2)]
+        try:
+            package_files = coordinator.run()
+        finally:
+            for worker in workers:
+                worker.wait()
+
+        self.assertEqual(len(package_files), 3)
+        self.assertTrue(all(map(isfile, package_files)))
+        self.assertEqual(coordinator.failed, [])
+        meta = json.load(open(join(self.package_dir, 'repository.json')))
+        self.assertEqual(sorted(meta), ['bar', 'foo', 'foo-bar'])
+        # foo-bar is built with the packages of the other workers
+        self.assertEqual(package_files[-1],
+                         join(self.package_dir, 'foo-bar',
+                              'foo-bar-1.0-1-any.ipkg'))
+
+    def test_worker_killed(self):
+        started = join(self.tmpdir, 'started')
+        blocked = join(self.tmpdir, 'blocked')
+        open(blocked, 'w').close()
+        formula_file = join(self.formula_dir, 'foo', 'foo-1.0.py')
+        source = open(formula_file).read().replace(
+            '    def install(self):\n',
+            '    def install(self):\n'
+            '        self.run_command(["sh", "-c", "touch %s; '
+            'while test -f %s; do sleep 0.1; done"])\n' % (started, blocked))
+        with open(formula_file, 'w') as fileobj:
+            fileobj.write(source)
+
+        repo = LocalPackageRepository(self.package_dir)
+        formula_repo = FormulaRepository(self.formula_dir)
+        formulas = [formula() for formula in formula_repo
+                    if formula.name == 'foo']
+        coordinator = BuildCoordinator(repo, formula_repo, formulas, lease=1,
+                                       token=TOKEN)
+        self.url = coordinator.url
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(coordinator.run()))
+        thread.start()
+
+        worker = self.start_worker()
+        try:
+            while not os.path.exists(started):
+                time.sleep(0.1)
+        finally:
+            # The worker is killed while it builds foo
+            os.killpg(worker.pid, signal.SIGKILL)
+            worker.wait()
+            os.unlink(blocked)
+
+        worker = self.start_worker()
+        thread.join(60)
+        worker.wait()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(coordinator.failed, [])
+        self.assertEqual(map(os.path.basename, results[0]),
+                         ['foo-1.0-1-any.ipkg'])
+
+    def test_token(self):
+        repo = LocalPackageRepository(self.package_dir)
+        repo.meta.save()
+        formula_repo = FormulaRepository(self.formula_dir)
+        coordinator = BuildCoordinator(repo, formula_repo, [], token=TOKEN)
+        self.assertEqual(coordinator.server.server_address[0], '127.0.0.1')
+        thread = threading.Thread(target=coordinator.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = coordinator.url + CLAIM_PATH
+            self.assertEqual(requests.post(url).status_code, 403)
+            self.assertEqual(requests.post(url, headers={
+                TOKEN_HEADER: 'wrong'}).status_code, 403)
+            self.assertEqual(requests.put(coordinator.url + '/_build/1',
+                                          data='foo').status_code, 403)
+            # Done: there is no formula to build
+            self.assertEqual(requests.post(url, headers={
+                TOKEN_HEADER: TOKEN}).status_code, 410)
+            # The repository is still readable
+            self.assertEqual(requests.get(coordinator.url +
+                                          '/repository.json').status_code,
+                             200)
+            self.assertRaises(DistributedBuildException,
+                              BuildWorker(coordinator.url,
+                                          token='wrong').claim)
+        finally:
+            coordinator.server.shutdown()
+            coordinator.server.server_close()
+
+    def test_generated_token(self):
+        environ = os.environ.copy()
+        os.environ.pop(TOKEN_ENVVAR, None)
+        try:
+            repo = LocalPackageRepository(self.package_dir)
+            formula_repo = FormulaRepository(self.formula_dir)
+            coordinator = BuildCoordinator(repo, formula_repo, [])
+            coordinator.server.server_close()
+            other = BuildCoordinator(repo, formula_repo, [])
+            other.server.server_close()
+            self.assertTrue(len(coordinator.token) >= 32)
+            self.assertNotEqual(coordinator.token, other.token)
+            self.assertRaises(DistributedBuildException, BuildWorker,
+                              coordinator.url)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
@@ -4,6 +4,7 @@ from tempfile import mkdtemp
 from unittest import TestCase
 
 from ipkg.repositories import PackageRepository
+from ipkg.activation import load
 from ipkg.environments import Variable, InvalidVariableValue, \
     PathListVariable, EnvironmentDirectories, EnvironmentVariables, \
     Environment
@@ -107,6 +108,29 @@ class TestEnvironment(TestCase):
         readme = join(self.prefix, 'foo.README')
         self.assertEqual(open(readme).read(), 'Hello world\n')
 
+    def test_install_activation(self):
+        self.test_install_file()
+        self.assertEqual(load(self.prefix)['prefix'], self.prefix)
+
+    def test_packages(self):
+        self.assertEqual(self.env.packages, [])
+        self.test_install_file()
+        self.assertEqual([p.name for p in self.env.packages], ['foo'])
+        self.env.uninstall('foo')
+        self.assertEqual(self.env.packages, [])
+
+    def test_get_package(self):
+        self.assertEqual(self.env.get_package('foo'), None)
+        self.test_install_file()
+        self.assertEqual(self.env.get_package('foo').version, '1.0')
+
+    def test_satisfies(self):
+        self.test_install_file()
+        self.assertTrue(self.env.satisfies('foo'))
+        self.assertTrue(self.env.satisfies('foo>=1.0'))
+        self.assertFalse(self.env.satisfies('foo>1.0'))
+        self.assertFalse(self.env.satisfies('bar'))
+
     # FIXME: This test works on my mac, 
     # but fails on travis because there are no linux packages in the test data
 #    def test_install_dependencies(self):
@@ -1,7 +1,10 @@
 import hashlib
+import tempfile
 from unittest import TestCase
 from os.path import dirname, join
 
+from ipkg.files import get_backend, register_backend, vopen, BACKENDS
+from ipkg.files.exceptions import UnknownScheme
 from ipkg.files.backends import InvalidChecksum
 from ipkg.files.backends.filesystem import LocalFile
 
@@ -17,3 +20,46 @@ class TestLocalFile(TestCase):
     def test_verify_checksum_invalid(self):
         f = LocalFile(self.FILE, 'foo')
         self.assertRaises(InvalidChecksum, f.verify_checksum)
+
+    def test_update_hash(self):
+        f = LocalFile(self.FILE)
+        f.seek(10)
+        content = open(self.FILE, 'rb').read()
+        self.assertEqual(f.update_hash(hashlib.md5()).hexdigest(),
+                         hashlib.md5(content[10:]).hexdigest())
+        self.assertEqual(f.tell(), 10)
+
+    def test_view(self):
+        f = LocalFile(self.FILE)
+        content = open(self.FILE, 'rb').read()
+        self.assertEqual(len(f.view()), len(content))
+        self.assertEqual(f.view(5)[:10], content[5:15])
+
+    def test_view_empty(self):
+        with tempfile.NamedTemporaryFile() as empty:
+            self.assertEqual(len(LocalFile(empty.name).view()), 0)
+
+    def test_readinto(self):
+        f = LocalFile(self.FILE)
+        buf = bytearray(10)
+        self.assertEqual(f.readinto(buf), 10)
+        self.assertEqual(bytes(buf), open(self.FILE, 'rb').read(10))
+
+
+class TestGetBackend(TestCase):
+
+    def tearDown(self):
+        BACKENDS.pop('foo', None)
+
+    def test_builtin(self):
+        self.assertTrue(get_backend('file') is LocalFile)
+
+    def test_unknown(self):
+        self.assertRaises(UnknownScheme, get_backend, 'foo')
+
+    def test_register(self):
+        register_backend('foo', LocalFile)
+        self.assertTrue(get_backend('foo') is LocalFile)
+
+    def test_vopen(self):
+        self.assertTrue(isinstance(vopen(TestLocalFile.FILE), LocalFile))
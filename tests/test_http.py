@@ -0,0 +1,220 @@
+import os
+import time
+import hashlib
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from ipkg.files import cache
+from ipkg.files.backends import InvalidChecksum
+from ipkg.files.backends.http import HttpFile, HttpFileException, \
+    NotCached
+
+
+CONTENT = ''.join(chr(i % 256) for i in range(100000))
+CHECKSUM = hashlib.sha256(CONTENT).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        request_count = len(server.requests)
+
+        if request_count <= server.slow_requests:
+            time.sleep(server.delay)
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and server.ranges:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                start, len(CONTENT) - 1, len(CONTENT)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(CONTENT) - start))
+        self.end_headers()
+
+        if request_count <= server.failures:
+            # Drop the connection in the middle of the file
+            self.wfile.write(CONTENT[start:start + 1000])
+        else:
+            self.wfile.write(CONTENT[start:])
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, ranges=True, slow_requests=0, delay=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.requests = []
+        self.failures = failures
+        self.ranges = ranges
+        self.slow_requests = slow_requests
+        self.delay = delay
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/foo.ipkg' % self.server_address[1]
+
+
+class TestHttpFile(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.environ = os.environ.copy()
+        os.environ.pop(cache.ENVVAR_NAME, None)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.cache_dir)
+
+    def start_server(self, **kw):
+        self.server = Server(**kw)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.server
+
+    def test_read(self):
+        server = self.start_server()
+        self.assertEqual(HttpFile(server.url).read(), CONTENT)
+        self.assertEqual(server.requests, [None])
+
+    def test_resume(self):
+        server = self.start_server(failures=2)
+        f = HttpFile(server.url, backoff=0)
+        self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(server.requests,
+                         [None, 'bytes=1000-', 'bytes=2000-'])
+
+    def test_resume_without_ranges(self):
+        server = self.start_server(failures=1, ranges=False)
+        f = HttpFile(server.url, backoff=0)
+        self.assertEqual(f.read(), CONTENT)
+
+    def test_retries_exhausted(self):
+        server = self.start_server(failures=10)
+        f = HttpFile(server.url, retries=2, backoff=0)
+        self.assertRaises(HttpFileException, f.read)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_resume_from_cache(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server(failures=1)
+        f = HttpFile(server.url, retries=0)
+        self.assertRaises(HttpFileException, f.read)
+        partial_filepath = cache.get_partial_filepath(server.url)
+        self.assertEqual(os.path.getsize(partial_filepath), 1000)
+
+        # Another run resumes the download
+        self.assertEqual(HttpFile(server.url).read(), CONTENT)
+        self.assertEqual(server.requests, [None, 'bytes=1000-'])
+        self.assertFalse(os.path.exists(partial_filepath))
+        self.assertTrue(cache.has(server.url))
+
+    def test_checksum(self):
+        server = self.start_server(failures=1)
+        f = HttpFile(server.url, CHECKSUM, backoff=0)
+        f.verify_checksum()
+        self.assertEqual(f.read(), CONTENT)
+
+    def test_checksum_resume_from_cache(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server(failures=1)
+        self.assertRaises(HttpFileException,
+                          HttpFile(server.url, CHECKSUM, retries=0).read)
+        f = HttpFile(server.url, CHECKSUM)
+        f.verify_checksum()
+        self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(server.requests, [None, 'bytes=1000-'])
+
+    def test_invalid_checksum(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server()
+        f = HttpFile(server.url, 'invalid')
+        self.assertRaises(InvalidChecksum, f.read)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_cache_by_checksum(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server()
+        HttpFile(server.url, CHECKSUM).read()
+        # Same content from another URL
+        f = HttpFile(server.url.replace('foo.ipkg', 'bar.ipkg'), CHECKSUM)
+        f.verify_checksum()
+        self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_offline(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server()
+        HttpFile(server.url).read()
+        os.environ[cache.OFFLINE_ENVVAR] = '1'
+        self.assertEqual(HttpFile(server.url, use_cache=False).read(),
+                         CONTENT)
+        self.assertRaises(NotCached, HttpFile(server.url + '.foo').read)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_no_cache(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server()
+        HttpFile(server.url).read()
+        HttpFile(server.url, use_cache=False).read()
+        self.assertEqual(len(server.requests), 2)
+
+    def test_concurrent_downloads(self):
+        os.environ[cache.ENVVAR_NAME] = self.cache_dir
+        server = self.start_server(slow_requests=1, delay=0.5)
+        results = []
+
+        def read():
+            results.append(HttpFile(server.url, CHECKSUM).read())
+
+        threads = [threading.Thread(target=read) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [CONTENT, CONTENT])
+        # The second download waited for the first one
+        self.assertEqual(len(server.requests), 1)
+        key = cache.make_key(server.url, CHECKSUM)
+        self.assertFalse(os.path.exists(cache.get_partial_filepath(key)))
+        self.assertTrue(cache.has(key))
+
+    def test_hedged_request(self):
+        server = self.start_server(slow_requests=1, delay=1)
+        f = HttpFile(server.url, hedge_after=0.1)
+        start = time.time()
+        self.assertEqual(f.read(), CONTENT)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_settings(self):
+        os.environ['IPKG_HTTP_RETRIES'] = '7'
+        os.environ['IPKG_HTTP_TIMEOUT'] = '2.5'
+        f = HttpFile('http://localhost/foo')
+        self.assertEqual(f.retries, 7)
+        self.assertEqual(f.timeout, 2.5)
+        self.assertEqual(HttpFile('http://localhost/foo', retries=0).retries,
+                         0)
+
+    def test_invalid_setting(self):
+        os.environ['IPKG_HTTP_RETRIES'] = 'foo'
+        self.assertRaises(HttpFileException, HttpFile, 'http://localhost/foo')
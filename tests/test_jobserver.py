@@ -0,0 +1,151 @@
+import os
+import shutil
+import select
+import tempfile
+from os.path import join
+from unittest import TestCase
+from subprocess import Popen, PIPE
+
+from ipkg import jobserver as jobserver_module
+from ipkg.jobserver import JobServer, JobServerException, get_jobs, \
+    get_jobserver, merge_makeflags, JOBS_ENVVAR, PATH_ENVVAR
+from ipkg.build import Formula
+
+
+DATA_DIR = join(os.path.dirname(__file__), 'data')
+FORMULA_DIR = join(DATA_DIR, 'formulas')
+
+
+MAKEFILE = """\
+all: a b c
+
+a b c:
+\t@touch $@.start; sleep 0.2; ls | grep -c start > $@.count; rm $@.start
+"""
+
+
+class TestJobServer(TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        self.jobserver = jobserver_module.JOBSERVER
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        jobserver_module.JOBSERVER = self.jobserver
+        shutil.rmtree(self.tmpdir)
+
+    def has_token(self, jobserver):
+        return bool(select.select([jobserver.read_fd], [], [], 0)[0])
+
+    def test_get_jobs(self):
+        os.environ[JOBS_ENVVAR] = '3'
+        self.assertEqual(get_jobs(), 3)
+        os.environ[JOBS_ENVVAR] = '0'
+        self.assertRaises(JobServerException, get_jobs)
+
+    def test_tokens(self):
+        jobserver = JobServer(3)
+        tokens = [jobserver.acquire(), jobserver.acquire()]
+        self.assertEqual(tokens, ['+', '+'])
+        jobserver.release(tokens.pop())
+        with jobserver.token():
+            pass
+        self.assertEqual(jobserver.acquire(), '+')
+
+    def test_from_makeflags(self):
+        jobserver = JobServer(2)
+        other = JobServer.from_makeflags('w ' + jobserver.makeflags)
+        self.assertEqual((other.read_fd, other.write_fd),
+                         (jobserver.read_fd, jobserver.write_fd))
+        self.assertEqual(JobServer.from_makeflags('-j4'), None)
+        self.assertEqual(JobServer.from_makeflags(None), None)
+
+    def test_merge_makeflags(self):
+        flags = '-j --jobserver-fds=3,4'
+        self.assertEqual(merge_makeflags(None, flags), flags)
+        self.assertEqual(merge_makeflags('ks -j4 -- CC=gcc', flags),
+                         'ks -j --jobserver-fds=3,4 -- CC=gcc')
+        self.assertEqual(
+            merge_makeflags('-j --jobserver-auth=5,6 --no-print-directory',
+                            flags),
+            '--no-print-directory -j --jobserver-fds=3,4')
+
+    def test_make(self):
+        with open(join(self.tmpdir, 'Makefile'), 'w') as makefile:
+            makefile.write(MAKEFILE)
+        jobserver = JobServer(2)
+        env = dict(os.environ, MAKEFLAGS=jobserver.makeflags)
+        with jobserver.build_token():
+            process = Popen(['make'], cwd=self.tmpdir, env=env,
+                            stderr=PIPE)
+            self.assertEqual(process.communicate()[1], '')
+        self.assertEqual(process.returncode, 0)
+        counts = [int(open(join(self.tmpdir, name + '.count')).read())
+                  for name in 'abc']
+        # Jobs run in parallel, but never more than 2 at once
+        self.assertEqual(max(counts), 2)
+
+    def test_open(self):
+        path = join(self.tmpdir, 'jobserver')
+        first = JobServer.open(path, 2)
+        # Other processes share the tokens of the first one
+        second = JobServer.open(path, 4)
+        self.assertEqual([first.acquire(), second.acquire()], ['+', '+'])
+        self.assertFalse(self.has_token(first))
+        second.release()
+        self.assertTrue(self.has_token(first))
+
+    def test_process_jobserver(self):
+        os.environ.pop(PATH_ENVVAR, None)
+        os.environ.pop('MAKEFLAGS', None)
+        jobserver_module.JOBSERVER = None
+        # Not shared with other processes
+        self.assertEqual(getattr(get_jobserver(), 'users_fd', None), None)
+
+    def test_build_token(self):
+        os.environ[PATH_ENVVAR] = join(self.tmpdir, 'jobserver')
+        os.environ[JOBS_ENVVAR] = '1'
+        jobserver_module.JOBSERVER = None
+        has_token = self.has_token
+        tokens = []
+        foo = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+
+        class Foo(foo):
+            parallel_make = True
+
+            def install(self):
+                tokens.append(has_token(get_jobserver()))
+                foo.install(self)
+
+        Foo().build(self.tmpdir)
+        # The build held the only token
+        self.assertEqual(tokens, [False])
+        self.assertTrue(self.has_token(get_jobserver()))
+
+    def test_build_makeflags(self):
+        os.environ['MAKEFLAGS'] = 'k -- FOO=bar'
+        jobserver_module.JOBSERVER = None
+        makeflags = []
+        foo = Formula.from_file(join(FORMULA_DIR, 'foo/foo-1.0.py'))
+
+        class Foo(foo):
+
+            def install(self):
+                self.run_command(['sh', '-c', 'echo "$MAKEFLAGS" > %s' %
+                                  join(self.environment.prefix, 'flags')])
+                makeflags.append(open(join(self.environment.prefix,
+                                           'flags')).read().strip())
+                foo.install(self)
+
+        class ParallelFoo(Foo):
+            parallel_make = True
+
+        Foo().build(self.tmpdir)
+        ParallelFoo().build(self.tmpdir)
+        # The MAKEFLAGS of the caller are kept
+        self.assertEqual(makeflags[0], 'k -- FOO=bar')
+        self.assertEqual(makeflags[1],
+                         'k %s -- FOO=bar' % get_jobserver().makeflags)
@@ -0,0 +1,79 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from os.path import join, dirname
+
+from ipkg import metrics
+from ipkg.files import cache
+from ipkg.files.backends.filesystem import LocalFile
+from ipkg.packages import PackageFile
+
+
+PACKAGE_FILE = join(dirname(__file__), 'data', 'packages', 'foo',
+                    'foo-1.0-1-any.ipkg')
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        metrics.reset()
+        shutil.rmtree(self.tmpdir)
+
+    def test_increment(self):
+        metrics.increment('foo')
+        metrics.increment('foo', 2)
+        self.assertEqual(metrics.snapshot()['counters'], {'foo': 3})
+
+    def test_observe(self):
+        for value in (1, 3, 4, 0):
+            metrics.observe('foo', value)
+        histogram = metrics.snapshot()['histograms']['foo']
+        self.assertEqual(histogram['count'], 4)
+        self.assertEqual(histogram['sum'], 8)
+        self.assertEqual(histogram['min'], 0)
+        self.assertEqual(histogram['max'], 4)
+        self.assertEqual(histogram['mean'], 2)
+        self.assertEqual(histogram['buckets'], {'0': 1, '1': 1, '4': 2})
+
+    def test_timer(self):
+        with metrics.timer('foo'):
+            pass
+        self.assertEqual(metrics.snapshot()['histograms']['foo']['count'], 1)
+
+    def test_dump(self):
+        metrics.increment('foo')
+        path = join(self.tmpdir, 'metrics.json')
+        metrics.dump(path)
+        self.assertEqual(json.load(open(path))['counters'], {'foo': 1})
+
+    def test_local_file(self):
+        LocalFile(PACKAGE_FILE).read()
+        self.assertEqual(metrics.snapshot()['counters']['files.file.bytes'],
+                         os.path.getsize(PACKAGE_FILE))
+
+    def test_extract(self):
+        PackageFile(PACKAGE_FILE).extract(self.tmpdir)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['packages.extract.bytes'],
+                         os.path.getsize(join(self.tmpdir, 'foo.README')))
+
+    def test_cache_hit_ratio(self):
+        environ = os.environ.copy()
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        try:
+            cache.set('foo', 'bar')
+            cache.get('foo')
+            self.assertEqual(cache.get('missing'), None)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['files.cache.hits'], 1)
+        self.assertEqual(counters['files.cache.misses'], 1)
+        self.assertEqual(counters['files.cache.hit_ratio'], 0.5)
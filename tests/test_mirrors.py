@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from os.path import join, dirname
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from ipkg.files import cache
+from ipkg.mirrors import MirrorList, NoMirrorAvailable, STATS_FILE, \
+    STATS_MAX_AGE
+from ipkg.repositories import PackageRepository
+
+
+PACKAGE_DIR = join(dirname(__file__), 'data', 'packages')
+FOO = 'foo/foo-1.0-1-any.ipkg'
+FOO_CHECKSUM = \
+    'db0a39122eea57895550e7d390d98894fb7abb7b975c4f8a9af4d8e0d4d9e252'
+
+
+class PackageHandler(SimpleHTTPRequestHandler):
+    """Serves the test package repository."""
+
+    def translate_path(self, path):
+        return join(PACKAGE_DIR, path.lstrip('/'))
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingPackageHandler(PackageHandler):
+    """Counts the requests of each path."""
+
+    requests = {}
+
+    def do_GET(self):
+        self.requests[self.path] = self.requests.get(self.path, 0) + 1
+        return PackageHandler.do_GET(self)
+
+
+class TestMirrorList(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.missing = join(self.tmpdir, 'missing')
+        self.environ = os.environ.copy()
+        os.environ.pop(cache.ENVVAR_NAME, None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def test_ranked_unknown(self):
+        mirrors = MirrorList(['a', 'b', 'c'], {'a': {'latency': 1}})
+        self.assertEqual(mirrors.ranked(), ['b', 'c', 'a'])
+
+    def test_ranked(self):
+        mirrors = MirrorList(['a', 'b', 'c'], {})
+        mirrors.record('a', 1, 100)
+        mirrors.record('b', 0.1, 100)
+        mirrors.record('c', 0.01, 100)
+        mirrors.record_failure('c')
+        self.assertEqual(mirrors.ranked(), ['b', 'a', 'c'])
+
+    def test_ranked_throughput(self):
+        mirrors = MirrorList(['a', 'b'], {})
+        mirrors.record('a', 1, 10 * 1024 * 1024)
+        mirrors.record('b', 1, 1024 * 1024)
+        self.assertEqual(mirrors.ranked(), ['a', 'b'])
+
+    def test_open_failover(self):
+        mirrors = MirrorList([self.missing, PACKAGE_DIR], {})
+        fileobj = mirrors.open(FOO, expected_hash=FOO_CHECKSUM)
+        self.assertEqual(fileobj.read(),
+                         open(join(PACKAGE_DIR, FOO)).read())
+        self.assertEqual(mirrors.ranked(), [PACKAGE_DIR, self.missing])
+
+    def test_open_invalid_checksum(self):
+        mirror = join(self.tmpdir, 'mirror')
+        os.makedirs(join(mirror, 'foo'))
+        with open(join(mirror, FOO), 'w') as fileobj:
+            fileobj.write('corrupted')
+        mirrors = MirrorList([mirror, PACKAGE_DIR], {})
+        mirrors.open(FOO, expected_hash=FOO_CHECKSUM)
+        self.assertEqual(mirrors.stats[mirror]['failures'], 1)
+
+    def test_open_no_mirror(self):
+        mirrors = MirrorList([self.missing], {})
+        self.assertRaises(NoMirrorAvailable, mirrors.open, FOO)
+
+    def test_stats_saved(self):
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        MirrorList([PACKAGE_DIR]).open(FOO)
+        with open(join(self.tmpdir, STATS_FILE)) as fileobj:
+            self.assertEqual(json.load(fileobj).keys(), [PACKAGE_DIR])
+        self.assertEqual(MirrorList([PACKAGE_DIR]).ranked(), [PACKAGE_DIR])
+        self.assertTrue(
+            MirrorList([PACKAGE_DIR]).score(PACKAGE_DIR) is not None)
+
+    def test_is_stale(self):
+        mirrors = MirrorList(['a', 'b'], {})
+        self.assertTrue(mirrors.is_stale())
+        mirrors.record('a', 1, 100)
+        mirrors.record_failure('b')
+        self.assertFalse(mirrors.is_stale())
+        mirrors.stats['a']['updated'] = time.time() - STATS_MAX_AGE - 1
+        self.assertTrue(mirrors.is_stale())
+        self.assertFalse(MirrorList(['a'], {}).is_stale())
+
+    def test_probe(self):
+        mirrors = MirrorList([self.missing, PACKAGE_DIR], {})
+        fileobj = mirrors.probe(FOO)
+        # The file of the fastest mirror is returned
+        self.assertEqual(fileobj.read(),
+                         open(join(PACKAGE_DIR, FOO)).read())
+        fileobj.close()
+        self.assertEqual(mirrors.stats[self.missing]['failures'], 1)
+        self.assertEqual(mirrors.stats[PACKAGE_DIR]['failures'], 0)
+        self.assertEqual(mirrors.ranked(), [PACKAGE_DIR, self.missing])
+
+    def test_probe_cached(self):
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        file_url = join(PACKAGE_DIR, FOO)
+        cache.set(cache.make_key(file_url, FOO_CHECKSUM), 'foo')
+        mirrors = MirrorList([PACKAGE_DIR, self.missing], {})
+        # Cached by checksum, like open() looks it up
+        mirrors.probe(FOO, expected_hash=FOO_CHECKSUM)
+        self.assertFalse(PACKAGE_DIR in mirrors.stats)
+        mirrors.probe(FOO, expected_hash=FOO_CHECKSUM, use_cache=False)
+        self.assertEqual(mirrors.stats[PACKAGE_DIR]['failures'], 0)
+
+    def test_offline(self):
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        os.environ[cache.OFFLINE_ENVVAR] = '1'
+        mirrors = MirrorList(['http://localhost:1'], {})
+        mirrors.probe(FOO)
+        self.assertEqual(mirrors.stats, {})
+        # Not cached: the mirror is not contacted, and did not fail
+        self.assertRaises(NoMirrorAvailable, mirrors.open, FOO)
+        self.assertEqual(mirrors.stats, {})
+
+
+class TestPackageRepositoryMirrors(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.missing = join(self.tmpdir, 'missing')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_remote(self):
+        # repository.json of a single remote mirror is downloaded too
+        server = HTTPServer(('127.0.0.1', 0), PackageHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            repository = PackageRepository('http://127.0.0.1:%d' %
+                                           server.server_port)
+            self.assertEqual(sorted(repository.meta),
+                             ['bar', 'foo', 'foo-bar'])
+            self.assertEqual(repository['foo'].name, 'foo')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_mirrors(self):
+        repository = PackageRepository([self.missing, PACKAGE_DIR])
+        self.assertEqual(repository.mirrors.urls, [self.missing, PACKAGE_DIR])
+        self.assertEqual(repository.base, self.missing)
+        package = repository['foo']
+        self.assertEqual(package.name, 'foo')
+        package.extract(self.tmpdir)
+        self.assertTrue(os.path.isfile(join(self.tmpdir, 'foo.README')))
+
+    def test_probe_on_load(self):
+        repository = PackageRepository([self.missing, PACKAGE_DIR])
+        self.assertTrue(repository.mirrors.is_stale())
+        repository.meta
+        self.assertEqual(repository.mirrors.stats[self.missing]['failures'],
+                         1)
+        self.assertFalse(repository.mirrors.is_stale())
+
+    def test_probe_on_load_remote(self):
+        server = HTTPServer(('127.0.0.1', 0), CountingPackageHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            repository = PackageRepository([
+                self.missing, 'http://127.0.0.1:%d' % server.server_port])
+            self.assertEqual(sorted(repository.meta),
+                             ['bar', 'foo', 'foo-bar'])
+            # The file read by the probe is used
+            self.assertEqual(
+                CountingPackageHandler.requests['/repository.json'], 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_url_with_comma(self):
+        repository = PackageRepository('http://example.com/a,b')
+        self.assertEqual(repository.mirrors.urls, ['http://example.com/a,b'])
@@ -86,3 +86,26 @@ class TestNameVersionRevisionComparable(TestCase):
     def test_le(self):
         self.assertTrue(self.obj1 <= self.obj1)
         self.assertTrue(self.obj1 <= self.obj2)
+
+    def test_key(self):
+        self.assertEqual(self.obj1.key, ('foo', '1.0', '1', None))
+
+    def test_hash(self):
+        self.obj2.version = '1.0'
+        self.obj2.revision = '1'
+        self.assertEqual(hash(self.obj1), hash(self.obj2))
+        self.assertEqual(len(set([self.obj1, self.obj2])), 1)
+
+    def test_eq_package_like_diff_platform(self):
+        # e.g. a formula and the package built from it
+        self.obj2.version = '1.0'
+        self.obj1.platform = 'any'
+        self.obj2.platform = 'osx-10.9-x86_64'
+        self.assertTrue(self.obj1 == self.obj2)
+        self.assertEqual(hash(self.obj1), hash(self.obj2))
+        self.assertNotEqual(self.obj1.key, self.obj2.key)
+
+    def test_hash_package_spec(self):
+        # Spec strings are equal, but are not found in sets
+        self.assertTrue(self.obj1 == 'foo==1.0:1')
+        self.assertFalse('foo==1.0:1' in set([self.obj1]))
@@ -5,7 +5,7 @@ from tempfile import mkdtemp
 from unittest import TestCase
 import json
 
-from ipkg.packages import MetaPackage, PackageFile
+from ipkg.packages import MetaPackage, PackageFile, PackageIndex
 
 
 DATA_DIR = join(dirname(__file__), 'data')
@@ -20,6 +20,12 @@ class TestMetaPackage(TestCase):
                              'revision': '1', 'name': 'foo'})),
             'foo==1.0')
 
+    def test_hash(self):
+        meta = {'version': '1.0', 'revision': '1', 'name': 'foo',
+                'platform': 'any'}
+        self.assertEqual(hash(MetaPackage(meta)), hash(MetaPackage(meta)))
+        self.assertTrue(MetaPackage(meta) in set([MetaPackage(dict(meta))]))
+
 
 class TestPackageFile(TestCase):
 
@@ -36,3 +42,31 @@ class TestPackageFile(TestCase):
         readme = join(self.tmpdir, 'foo.README')
         self.assertTrue(isfile(readme))
         self.assertEqual(open(readme).read(), 'Hello world\n')
+
+
+class TestPackageIndex(TestCase):
+
+    def setUp(self):
+        self.foo = MetaPackage({'version': '1.0', 'revision': '1',
+                                'name': 'foo', 'platform': 'any'})
+        self.index = PackageIndex([self.foo])
+
+    def test_contains_package(self):
+        self.assertTrue(self.foo in self.index)
+        self.assertFalse(None in self.index)
+
+    def test_contains_key(self):
+        self.assertTrue(('foo', '1.0', '1', 'any') in self.index)
+        self.assertFalse(('foo', '1.0', '1', None) in self.index)
+
+    def test_contains_spec(self):
+        self.assertTrue('foo' in self.index)
+        self.assertTrue('foo==1.0' in self.index)
+        self.assertTrue('foo==1.0:1' in self.index)
+        self.assertFalse('foo==1.1' in self.index)
+        self.assertFalse('bar' in self.index)
+
+    def test_discard(self):
+        self.index.discard(self.foo)
+        self.assertFalse('foo' in self.index)
+        self.assertEqual(len(self.index), 0)
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+from os.path import join, dirname, isfile
+from unittest import TestCase
+
+from ipkg.environments import Environment
+from ipkg.pool import EnvironmentPool, PoolException, resolve, lock, \
+    find_rewritten, PREFIX_CONFIG_KEY, REWRITE_CONFIG_KEY
+from ipkg.repositories import PackageRepository, RequirementNotFound
+
+
+PACKAGE_DIR = join(dirname(__file__), 'data', 'packages')
+
+
+class Package(object):
+
+    def __init__(self, name, version, dependencies=None):
+        self.name = name
+        self.version = version
+        self.dependencies = dependencies
+
+
+class Repository(object):
+
+    def __init__(self, packages):
+        self.packages = packages
+
+    def __getitem__(self, requirement):
+        matches = [package for package in self.packages
+                   if requirement.satisfied_by(package)]
+        if not matches:
+            raise RequirementNotFound(requirement)
+        return matches[-1]
+
+
+class LookupRepository(PackageRepository):
+
+    def __init__(self, *args, **kwargs):
+        PackageRepository.__init__(self, *args, **kwargs)
+        self.lookups = []
+
+    def __getitem__(self, requirement):
+        self.lookups.append(requirement.name)
+        return PackageRepository.__getitem__(self, requirement)
+
+
+class TestEnvironmentPool(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pool = EnvironmentPool(join(self.tmpdir, 'pool'), size=1)
+        os.mkdir(self.pool.directory)
+        self.repository = PackageRepository(PACKAGE_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resolve(self):
+        self.assertEqual(sorted(resolve(['foo-bar'], self.repository)),
+                         ['bar', 'foo', 'foo-bar'])
+        self.assertRaises(PoolException, resolve, ['foo'])
+
+    def test_resolve_merged(self):
+        repository = Repository([Package('foo', '1.0'), Package('foo', '2.0'),
+                                 Package('baz', '1.0', ['foo<2.0'])])
+        # foo 2.0 is found first, then replaced to satisfy baz
+        packages = resolve(['baz', 'foo'], repository)
+        self.assertEqual(packages['foo'].version, '1.0')
+        self.assertRaises(RequirementNotFound, resolve, ['baz', 'foo>1.0'],
+                          repository)
+
+    def test_get(self):
+        path = self.pool.get(['foo-bar'], self.repository)
+        self.assertEqual(self.pool.get(['foo-bar', 'foo'], self.repository),
+                         path)
+        self.assertEqual(list(self.pool), [path])
+
+    def test_get_installs_resolved(self):
+        repository = LookupRepository(PACKAGE_DIR)
+        path = self.pool.get(['foo-bar'], repository)
+        # Packages are only looked up once, when resolving requirements
+        self.assertEqual(sorted(repository.lookups), ['bar', 'foo',
+                                                      'foo-bar'])
+        self.assertEqual(sorted(p.name for p in Environment(path).packages),
+                         ['bar', 'foo', 'foo-bar'])
+
+    def test_evict(self):
+        self.pool.get(['foo'], self.repository)
+        path = self.pool.get(['bar'], self.repository)
+        self.assertEqual(list(self.pool), [path])
+
+    def test_evict_locked(self):
+        path = self.pool.get(['foo'], self.repository)
+        lock_file = lock(path)
+        try:
+            self.pool.get(['bar'], self.repository)
+            self.assertTrue(os.path.isdir(path))
+        finally:
+            lock_file.close()
+        self.pool.evict()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(lock(path), None)
+
+    def test_clone(self):
+        prefix = join(self.tmpdir, 'env')
+        environment = self.pool.clone(['foo-bar'], prefix, self.repository)
+        self.assertEqual(sorted(p.name for p in environment.packages),
+                         ['bar', 'foo', 'foo-bar'])
+        source = self.pool.get(['foo-bar'], self.repository)
+        self.assertEqual(os.stat(join(prefix, 'foo.README')).st_ino,
+                         os.stat(join(source, 'foo.README')).st_ino)
+
+        # The pooled environment is not modified by the clone
+        environment.uninstall('foo')
+        self.assertTrue(isfile(join(source, 'foo.README')))
+        self.assertEqual(len(EnvironmentPool(
+            self.pool.directory).clone(['foo'], join(self.tmpdir, 'env2'),
+                                       self.repository).packages), 1)
+
+    def test_clone_copy(self):
+        prefix = join(self.tmpdir, 'env')
+        self.pool.clone(['foo'], prefix, self.repository, link=False)
+        source = self.pool.get(['foo'], self.repository)
+        self.assertNotEqual(os.stat(join(prefix, 'foo.README')).st_ino,
+                            os.stat(join(source, 'foo.README')).st_ino)
+
+    def test_clone_rewrite(self):
+        source = self.pool.get(['foo'], self.repository)
+        source_environment = Environment(source)
+        source_prefix = source_environment.get_config(PREFIX_CONFIG_KEY)
+        with open(join(source, 'share', 'foo.conf'), 'w') as fileobj:
+            fileobj.write('home=%s/share\nlib=%s/lib\n' % (source_prefix,
+                                                            source_prefix))
+        source_environment.set_config(REWRITE_CONFIG_KEY,
+                                      find_rewritten(source, source_prefix))
+        self.assertEqual(source_environment.get_config(REWRITE_CONFIG_KEY),
+                         ['share/foo.conf'])
+
+        prefix = join(self.tmpdir, 'env')
+        self.pool.clone(['foo'], prefix, self.repository)
+        self.assertEqual(open(join(prefix, 'share', 'foo.conf')).read(),
+                         'home=%s/share\nlib=%s/lib\n' % (prefix, prefix))
+        self.assertTrue(source_prefix in
+                        open(join(source, 'share', 'foo.conf')).read())
+
+    def test_clone_elf(self):
+        source = self.pool.get(['foo'], self.repository)
+        source_environment = Environment(source)
+        source_prefix = source_environment.get_config(PREFIX_CONFIG_KEY)
+        with open(join(source, 'share', 'foo.so'), 'wb') as fileobj:
+            fileobj.write('\x7fELF\0RPATH=%s/lib\0' % source_prefix)
+        source_environment.set_config(REWRITE_CONFIG_KEY,
+                                      find_rewritten(source, source_prefix))
+
+        prefix = join(self.tmpdir, 'env')
+        self.assertRaises(PoolException, self.pool.clone, ['foo'], prefix,
+                          self.repository)
+        self.assertFalse(os.path.exists(prefix))
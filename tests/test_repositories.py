@@ -1,4 +1,5 @@
 from os.path import join, dirname, isfile
+import os
 from os import mkdir
 from shutil import rmtree, copyfile
 from tempfile import mkdtemp
@@ -8,6 +9,7 @@ import json
 from ipkg.repositories import PackageRepository, LocalPackageRepository, \
     FormulaRepository
 from ipkg.build import Formula
+from ipkg.files import cache
 
 
 DATA_DIR = join(dirname(__file__), 'data')
@@ -68,6 +70,30 @@ class TestLocalPackageRepository(TestCase):
         self.assertTrue(meta.keys(), ['foo'])
         self.assertTrue(isfile(package_file))
 
+    def test_build_formulas_incremental(self):
+        formula_dir = join(self.tmpdir, 'formulas')
+        mkdir(formula_dir)
+        mkdir(join(formula_dir, 'foo'))
+        formula_file = join(formula_dir, 'foo', 'foo-1.0.py')
+        source = open(join(FORMULA_DIR, 'foo/foo-1.0.py')).read().replace(
+            "dirname(__file__) + '/../..", repr(DATA_DIR) + " + '")
+        with open(formula_file, 'w') as fileobj:
+            fileobj.write(source)
+
+        package_dir = join(self.tmpdir, 'packages')
+        mkdir(package_dir)
+        repo = LocalPackageRepository(package_dir)
+        self.assertEqual(len(repo.build_formulas(FormulaRepository(
+            formula_dir))), 1)
+        self.assertEqual(repo.build_formulas(FormulaRepository(
+            formula_dir)), [])
+
+        with open(formula_file, 'a') as fileobj:
+            fileobj.write("    build_envvars = {'CFLAGS': '-O3'}\n")
+        self.assertEqual(len(repo.build_formulas(FormulaRepository(
+            formula_dir))), 1)
+        self.assertEqual(len(repo.meta['foo']), 1)
+
     # This test need to be isolated because of new test formulas
     #
     #def test_build_formulas(self):
@@ -86,3 +112,30 @@ class TestFormulaRepository(TestCase):
         self.assertTrue(('bar', '1.0', 1) in packages)
         self.assertTrue(('foo', '1.0', 1) in packages)
         self.assertTrue(('foo-bar', '1.0', 1) in packages)
+
+    def test_index(self):
+        environ = os.environ.copy()
+        tmpdir = mkdtemp()
+        os.environ[cache.ENVVAR_NAME] = tmpdir
+        try:
+            FormulaRepository(FORMULA_DIR).load()
+            formula_dir = join(tmpdir, 'formulas')
+            index_file = [join(formula_dir, name)
+                          for name in os.listdir(formula_dir)
+                          if name.startswith('index-')][0]
+            index = json.load(open(index_file))
+            self.assertEqual(
+                index[join(FORMULA_DIR, 'two', 'two-1.6.py')]['meta']
+                ['dependencies'], ['four < 2.0', 'five'])
+
+            # The index is used instead of reading files
+            two = join(FORMULA_DIR, 'two', 'two-1.6.py')
+            index[two]['meta']['version'] = '1.7'
+            with open(index_file, 'w') as fileobj:
+                json.dump(index, fileobj)
+            repo = FormulaRepository(FORMULA_DIR)
+            self.assertEqual(len(repo.find('two==1.7')), 1)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            rmtree(tmpdir)
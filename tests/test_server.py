@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from os.path import join, dirname
+
+import requests
+
+from ipkg.server import RepositoryServer, parse_range
+from ipkg import server
+from ipkg.repositories import PackageRepository, LocalPackageRepository, \
+    FormulaRepository
+from ipkg.environments import Environment
+from ipkg.files import cache
+
+
+PACKAGE_DIR = join(dirname(__file__), 'data', 'packages')
+FOO = 'foo/foo-1.0-1-any.ipkg'
+
+
+class TestParseRange(TestCase):
+
+    def test_none(self):
+        self.assertEqual(parse_range(None, 10), None)
+        self.assertEqual(parse_range('bytes=0-1,4-5', 10), None)
+
+    def test_range(self):
+        self.assertEqual(parse_range('bytes=2-5', 10), (2, 5))
+        self.assertEqual(parse_range('bytes=2-', 10), (2, 9))
+        self.assertEqual(parse_range('bytes=2-50', 10), (2, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+
+    def test_unsatisfiable(self):
+        self.assertRaises(ValueError, parse_range, 'bytes=10-', 10)
+
+
+class TestRepositoryServer(TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = join(self.tmpdir, 'repository')
+        shutil.copytree(PACKAGE_DIR, self.root)
+        self.server = RepositoryServer(self.root, ('127.0.0.1', 0))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def get(self, path, **headers):
+        return requests.get(self.server.url + path, headers=headers)
+
+    def test_file(self):
+        response = self.get('/' + FOO)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, open(join(self.root, FOO)).read())
+
+    def test_range(self):
+        content = open(join(self.root, FOO)).read()
+        response = self.get('/' + FOO, Range='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[10:])
+        response = self.get('/' + FOO, Range='bytes=100000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_etag(self):
+        etag = self.get('/' + FOO).headers['ETag']
+        response = self.get('/' + FOO, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_found(self):
+        self.assertEqual(self.get('/foo/missing.ipkg').status_code, 404)
+        self.assertEqual(self.get('/foo').status_code, 404)
+        self.assertEqual(self.get('/../repository/foo/' + FOO).status_code,
+                         404)
+
+    def test_index(self):
+        response = self.get('/repository.json')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(sorted(response.json()), ['bar', 'foo', 'foo-bar'])
+        response = self.get('/repository.json', **{'Accept-Encoding': ''})
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertEqual(response.content,
+                         open(join(self.root, 'repository.json')).read())
+
+    def test_index_reload(self):
+        self.get('/repository.json')
+        shutil.rmtree(join(self.root, 'bar'))
+        LocalPackageRepository(self.root).update_metadata()
+        self.assertEqual(sorted(self.get('/repository.json').json()),
+                         ['foo', 'foo-bar'])
+
+    def test_batch(self):
+        response = self.get('/_batch?names=foo,missing&names=bar')
+        meta = response.json()
+        self.assertEqual(sorted(meta), ['bar', 'foo'])
+        self.assertEqual(meta['foo'][0]['version'], '1.0')
+
+    def test_package_repository(self):
+        repository = PackageRepository(self.server.url)
+        package = repository['foo']
+        package.extract(self.tmpdir)
+        self.assertTrue(os.path.isfile(join(self.tmpdir, 'foo.README')))
+
+    def test_fetch_offline(self):
+        cache_dir = join(self.tmpdir, 'cache')
+        os.mkdir(cache_dir)
+        os.environ[cache.ENVVAR_NAME] = cache_dir
+        packages = PackageRepository(self.server.url).fetch(['foo-bar'])
+        self.assertEqual(sorted(p.name for p in packages),
+                         ['bar', 'foo', 'foo-bar'])
+
+        self.server.shutdown()
+        os.environ[cache.OFFLINE_ENVVAR] = '1'
+        environment = Environment(join(self.tmpdir, 'env'))
+        environment.directories.create()
+        environment.install('foo-bar', PackageRepository(self.server.url))
+        self.assertEqual(sorted(p.name for p in environment.packages),
+                         ['bar', 'foo', 'foo-bar'])
+
+    def test_fetch_sources(self):
+        cache_dir = join(self.tmpdir, 'cache')
+        os.mkdir(cache_dir)
+        os.environ[cache.ENVVAR_NAME] = cache_dir
+        formula_dir = join(self.tmpdir, 'formulas')
+        os.makedirs(join(formula_dir, 'foo'))
+        url = self.server.url + '/' + FOO
+        checksum = hashlib.sha256(open(join(self.root, FOO)).read())
+        with open(join(formula_dir, 'foo', 'foo-1.0.py'), 'w') as fileobj:
+            fileobj.write('from ipkg.build import Formula, File\n'
+                          'class foo(Formula):\n'
+                          '    name = "foo"\n'
+                          '    version = "1.0"\n'
+                          '    sources = File(%r, sha256=%r)\n'
+                          % (url, checksum.hexdigest()))
+
+        self.assertEqual(FormulaRepository(formula_dir).fetch_sources(), [])
+        self.assertTrue(cache.has(cache.make_key(url, checksum.hexdigest())))
+
+
+class TestRepositoryServerWithoutSendfile(TestRepositoryServer):
+    """Files are copied through user space when ``sendfile`` is not
+       available.
+    """
+    def setUp(self):
+        self.sendfile = server.sendfile
+        server.sendfile = None
+        super(TestRepositoryServerWithoutSendfile, self).setUp()
+
+    def tearDown(self):
+        super(TestRepositoryServerWithoutSendfile, self).tearDown()
+        server.sendfile = self.sendfile
@@ -6,7 +6,9 @@ from os import listdir
 import json
 
 from ipkg.utils import DictFile, execute, make_package_spec, InvalidPackage, \
-    PIPE, ExecutionFailed, InvalidDictFileContent, unarchive, which
+    PIPE, ExecutionFailed, InvalidDictFileContent, unarchive, which, \
+    make_package_key, parallel_map, parse_package_spec
+from ipkg import utils
 
 
 DATA_DIR = join(dirname(__file__), 'data', 'sources')
@@ -121,6 +123,61 @@ class TestMakePackageSpec(TestCase):
         self.assertRaises(InvalidPackage, make_package_spec, None)
 
 
+class TestMakePackageKey(TestCase):
+
+    SAMPLE = {'name': 'foo', 'version': '1.0', 'revision': 1,
+              'platform': 'any'}
+
+    def test_package_like_obj(self):
+        obj = type('foo', (object,), self.SAMPLE)()
+        self.assertEqual(make_package_key(obj), ('foo', '1.0', '1', 'any'))
+
+    def test_dict(self):
+        self.assertEqual(make_package_key(self.SAMPLE),
+                         ('foo', '1.0', '1', 'any'))
+
+    def test_dict_no_platform(self):
+        self.assertEqual(make_package_key({'name': 'foo', 'version': '1.0'}),
+                         ('foo', '1.0', None, None))
+
+    def test_bad_obj_type(self):
+        self.assertRaises(InvalidPackage, make_package_key, None)
+
+
+class TestParsePackageSpec(TestCase):
+
+    def test_returns_copy(self):
+        spec = parse_package_spec('foo==1.0:1')
+        spec['name'] = 'bar'
+        self.assertEqual(parse_package_spec('foo==1.0:1')['name'], 'foo')
+
+    def test_bounded_cache(self):
+        for index in range(utils.PACKAGE_SPECS_SIZE + 10):
+            parse_package_spec('foo==1.%d' % index)
+        self.assertEqual(len(utils.PACKAGE_SPECS), utils.PACKAGE_SPECS_SIZE)
+        self.assertFalse('foo==1.0' in utils.PACKAGE_SPECS)
+
+    def test_invalid(self):
+        self.assertRaises(InvalidPackage, parse_package_spec, '==1.0')
+
+
+class TestParallelMap(TestCase):
+
+    def test(self):
+        self.assertEqual(parallel_map(lambda i: i * 2, range(10), 4),
+                         [i * 2 for i in range(10)])
+
+    def test_empty(self):
+        self.assertEqual(parallel_map(lambda i: i, []), [])
+
+    def test_exception(self):
+        def func(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+        self.assertRaises(ValueError, parallel_map, func, range(10), 4)
+
+
 class TestWhich(TestCase):
 
     def test(self):
@@ -0,0 +1,80 @@
+import os
+import time
+import tempfile
+from os.path import join, islink, exists
+from shutil import rmtree
+from unittest import TestCase
+
+from ipkg import workspaces
+from ipkg.workspaces import WorkspaceException
+from ipkg.files import cache
+
+
+class TestWorkspaces(TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        self.memory_dir = join(self.tmpdir, 'memory')
+        os.mkdir(self.memory_dir)
+        os.environ[workspaces.MEMORY_DIR_ENVVAR] = self.memory_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        rmtree(self.tmpdir)
+
+    def test_estimate_size(self):
+        os.environ[cache.ENVVAR_NAME] = self.tmpdir
+        self.assertEqual(workspaces.estimate_size('foo', 100),
+                         100 * workspaces.EXPANSION_RATIO)
+        workspaces.record_size('foo', 42)
+        self.assertEqual(workspaces.estimate_size('foo', 100), 42)
+
+    def test_create_in_memory(self):
+        backend, path = workspaces.create(1, 'test-%d' % os.getpid())
+        self.assertEqual(backend, 'memory')
+        self.assertTrue(islink(path))
+        target = os.readlink(path)
+        self.assertTrue(target.startswith(self.memory_dir))
+        self.assertEqual(workspaces.create(1, 'test-%d' % os.getpid())[1],
+                         None)
+        workspaces.remove(path)
+        self.assertFalse(exists(path) or exists(target))
+
+    def test_create_on_disk(self):
+        os.environ[workspaces.BACKEND_ENVVAR] = 'disk'
+        backend, path = workspaces.create(1)
+        self.assertEqual(backend, 'disk')
+        self.assertEqual(os.path.dirname(path), tempfile.gettempdir())
+        workspaces.remove(path)
+        self.assertFalse(exists(path))
+
+    def test_too_large(self):
+        # Neither fits in memory nor leaves enough disk space
+        self.assertRaises(WorkspaceException, workspaces.create, 2 ** 62)
+
+    def test_remove_stale(self):
+        stale = join(self.memory_dir, workspaces.PREFIX + 'stale')
+        recent = join(self.memory_dir, workspaces.PREFIX + 'recent')
+        os.mkdir(stale)
+        os.mkdir(recent)
+        mtime = time.time() - workspaces.STALE_AGE - 1
+        os.utime(stale, (mtime, mtime))
+        self.assertEqual(workspaces.remove_stale(self.memory_dir), 1)
+        self.assertEqual(os.listdir(self.memory_dir),
+                         [workspaces.PREFIX + 'recent'])
+
+    def test_remove_stale_locked(self):
+        backend, path = workspaces.create(1)
+        self.assertEqual(backend, 'memory')
+        mtime = time.time() - workspaces.STALE_AGE - 1
+        os.utime(path, (mtime, mtime))
+        # Used by a build: kept
+        self.assertEqual(workspaces.remove_stale(self.memory_dir), 0)
+        self.assertTrue(exists(path))
+
+        # Left by a build which is done
+        workspaces.LOCKS.pop(path).close()
+        self.assertEqual(workspaces.remove_stale(self.memory_dir), 1)
+        self.assertFalse(exists(path))